@@ -0,0 +1,72 @@
+from datetime import date, datetime
+from typing import List
+
+from sqlalchemy import DateTime, func, literal, select
+
+from allocation.adapters.orm import (
+    allocations, archived_allocations, archived_batches, batches, order_lines,
+    products,
+)
+
+
+def allocated_quantity():
+    counted = (
+        select(func.coalesce(func.sum(order_lines.c.quantity), 0))
+        .select_from(allocations.join(
+            order_lines, order_lines.c.id == allocations.c.order_line_id))
+        .where(allocations.c.batch_id == batches.c.id)
+        .scalar_subquery()
+    )
+    return func.coalesce(batches.c.allocated_quantity, counted)
+
+
+def is_closed(today: date):
+    arrived = batches.c.eta.is_(None) | (batches.c.eta < today)
+    consumed = allocated_quantity() >= batches.c._purchased_quantity
+    return batches.c.shipped | (arrived & consumed)
+
+
+def archive_closed_batches(session, today: date, chunk_size: int,
+                           archived_at: datetime = None) -> List[str]:
+    query = (
+        select(batches.c.id, batches.c.sku, batches.c.reference)
+        .where(is_closed(today))
+        .order_by(batches.c.id)
+        .limit(chunk_size)
+    )
+    if session.bind.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    rows = session.execute(query).all()
+    if not rows:
+        return []
+    ids = [row.id for row in rows]
+    session.execute(archived_batches.insert().from_select(
+        ["id", "sku", "reference", "purchased_quantity", "allocated_quantity",
+         "eta", "shipped", "archived_at"],
+        select(batches.c.id, batches.c.sku, batches.c.reference,
+               batches.c._purchased_quantity, allocated_quantity(),
+               batches.c.eta, batches.c.shipped,
+               literal(archived_at or datetime.utcnow(), DateTime))
+        .where(batches.c.id.in_(ids))
+    ))
+    session.execute(archived_allocations.insert().from_select(
+        ["order_line_id", "batch_id", "order_id", "sku", "quantity"],
+        select(order_lines.c.id, allocations.c.batch_id,
+               order_lines.c.order_id, order_lines.c.sku,
+               order_lines.c.quantity)
+        .select_from(allocations.join(
+            order_lines, order_lines.c.id == allocations.c.order_line_id))
+        .where(allocations.c.batch_id.in_(ids))
+    ))
+    session.execute(allocations.delete().where(allocations.c.batch_id.in_(ids)))
+    session.execute(order_lines.delete().where(order_lines.c.id.in_(
+        select(archived_allocations.c.order_line_id)
+        .where(archived_allocations.c.batch_id.in_(ids))
+    )))
+    session.execute(batches.delete().where(batches.c.id.in_(ids)))
+    session.execute(
+        products.update()
+        .where(products.c.sku.in_({row.sku for row in rows}))
+        .values(version_number=products.c.version_number + 1)
+    )
+    return [row.reference for row in rows]
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from allocation import config, metrics
+
+
+class TimedQueuePool(QueuePool):
+    engine_name = "default"
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.engine_name = self.engine_name
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.DB_POOL_TIMEOUTS.inc(self.engine_name)
+            raise
+        finally:
+            metrics.DB_POOL_WAIT_SECONDS.observe(
+                time.perf_counter() - start, self.engine_name)
+
+
+class EngineRegistry:
+    def __init__(self, urls: Dict[str, Callable[[], str]] = None):
+        self.urls = urls or {"default": config.get_postgres_uri}
+        self._engines: Dict[str, Engine] = {}
+        self._sessionmakers: Dict[str, sessionmaker] = {}
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def engine(self, name: str = "default") -> Engine:
+        engine = self._engines.get(name)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(name)
+                if engine is None:
+                    engine = self._engines[name] = self._create(name)
+        return engine
+
+    def session(self, name: str = "default") -> Session:
+        factory = self._sessionmakers.get(name)
+        if factory is None:
+            factory = self._sessionmakers.setdefault(
+                name, sessionmaker(bind=self.engine(name)))
+        return factory()
+
+    def session_factory(self, name: str = "default") -> Callable[[], Session]:
+        return lambda: self.session(name)
+
+    def pool_status(self) -> Dict[tuple, float]:
+        status = {}
+        for name, engine in list(self._engines.items()):
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            status[(name, "size")] = pool.size()
+            status[(name, "checked_out")] = pool.checkedout()
+            status[(name, "checked_in")] = pool.checkedin()
+            status[(name, "overflow")] = max(pool.overflow(), 0)
+        return status
+
+    def dispose(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+            self._sessionmakers.clear()
+
+    def _create(self, name: str) -> Engine:
+        url = self.urls[name]()
+        if url.startswith("sqlite"):
+            return create_engine(url)
+        connect_args = {}
+        statement_timeout = config.get_statement_timeout_ms()
+        if statement_timeout:
+            connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+        engine = create_engine(
+            url,
+            isolation_level=config.get_isolation_level(),
+            poolclass=TimedQueuePool,
+            connect_args=connect_args,
+            **config.get_db_pool_settings(),
+        )
+        engine.pool.engine_name = name
+        guard_against_forked_connections(engine)
+        return engine
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        for engine in self._engines.values():
+            engine.pool = engine.pool.recreate()
+
+
+def guard_against_forked_connections(engine: Engine):
+    @event.listens_for(engine, "connect")
+    def remember_pid(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def check_pid(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info["pid"] != os.getpid():
+            connection_record.dbapi_connection = None
+            connection_proxy.dbapi_connection = None
+            raise exc.DisconnectionError(
+                "Connection belongs to a parent process, reconnecting")
+
+
+ENGINES = EngineRegistry()
+
+metrics.REGISTRY.gauge(
+    "allocation_db_pool_connections",
+    "Connections in each engine's pool, by state",
+    ["engine", "state"],
+    collect=ENGINES.pool_status,
+)
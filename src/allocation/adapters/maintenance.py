@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection
+
+from allocation.adapters import orm
+
+
+@dataclass(frozen=True)
+class QuantityDrift:
+    batch_id: int
+    reference: str
+    sku: str
+    stored: Optional[int]
+    actual: int
+
+
+def allocated_quantity_drift(connection: Connection) -> List[QuantityDrift]:
+    allocated = (
+        select(orm.allocations.c.batch_id,
+               func.sum(orm.order_lines.c.quantity).label("quantity"))
+        .join(orm.order_lines,
+              orm.order_lines.c.id == orm.allocations.c.order_line_id)
+        .group_by(orm.allocations.c.batch_id)
+        .subquery()
+    )
+    actual = func.coalesce(allocated.c.quantity, 0)
+    stored = orm.batches.c.allocated_quantity
+    rows = connection.execute(
+        select(orm.batches.c.id, orm.batches.c.reference, orm.batches.c.sku,
+               stored, actual)
+        .select_from(orm.batches.outerjoin(
+            allocated, allocated.c.batch_id == orm.batches.c.id))
+        .where(stored.is_(None) | (stored != actual))
+        .order_by(orm.batches.c.id)
+    )
+    return [QuantityDrift(*row) for row in rows]
+
+
+def counted_quantity():
+    return (
+        select(func.coalesce(func.sum(orm.order_lines.c.quantity), 0))
+        .select_from(orm.allocations.join(
+            orm.order_lines,
+            orm.order_lines.c.id == orm.allocations.c.order_line_id))
+        .where(orm.allocations.c.batch_id == orm.batches.c.id)
+        .scalar_subquery()
+    )
+
+
+def reconcile_allocated_quantities(connection: Connection
+                                   ) -> List[QuantityDrift]:
+    # Allocators commit through a version check on their product row, so
+    # holding those rows makes the recount below atomic with respect to
+    # them even under READ COMMITTED.
+    skus = sorted({row.sku for row in allocated_quantity_drift(connection)})
+    if not skus:
+        return []
+    connection.execute(
+        select(orm.products.c.sku)
+        .where(orm.products.c.sku.in_(skus))
+        .with_for_update()
+    )
+    drift = [row for row in allocated_quantity_drift(connection)
+             if row.sku in skus]
+    counted = counted_quantity()
+    connection.execute(
+        orm.batches.update()
+        .where(orm.batches.c.sku.in_(skus))
+        .where(orm.batches.c.allocated_quantity.is_(None)
+               | (orm.batches.c.allocated_quantity != counted))
+        .values(allocated_quantity=counted)
+    )
+    connection.execute(
+        orm.products.update()
+        .where(orm.products.c.sku.in_(skus))
+        .values(version_number=orm.products.c.version_number + 1)
+    )
+    return drift
@@ -0,0 +1,149 @@
+import contextlib
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, inspect, \
+    text
+from sqlalchemy.engine import Connection, Engine
+
+from allocation.adapters import orm
+
+LOCK_KEY = 7_250_331
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(255), nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    transactional: bool = True
+
+
+def create_tables(connection: Connection):
+    orm.metadata.create_all(connection)
+
+
+def create_table(table: Table):
+    def upgrade(connection: Connection):
+        table.create(connection, checkfirst=True)
+    return upgrade
+
+
+def run_all(*upgrades: Callable[[Connection], None]):
+    def upgrade(connection: Connection):
+        for step in upgrades:
+            step(connection)
+    return upgrade
+
+
+def create_indexes(*indexes: Sequence):
+    def upgrade(connection: Connection):
+        concurrently = "CONCURRENTLY " \
+            if connection.dialect.name == "postgresql" else ""
+        for name, table, columns in indexes:
+            connection.execute(text(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS {name}"
+                f" ON {table} ({', '.join(columns)})"
+            ))
+    return upgrade
+
+
+def add_column(table: str, column: str, ddl: str):
+    def upgrade(connection: Connection):
+        existing = {c["name"] for c in inspect(connection).get_columns(table)}
+        if column not in existing:
+            connection.execute(
+                text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return upgrade
+
+
+# Version 1 creates any missing table from the current metadata, so later
+# migrations must also succeed against a schema that already has them.
+MIGRATIONS = [
+    Migration(1, "create_tables", create_tables),
+    Migration(2, "add_lookup_indexes", create_indexes(
+        ("ix_batches_reference", "batches", ["reference"]),
+        ("ix_batches_sku", "batches", ["sku"]),
+        ("ix_allocations_batch_id", "allocations", ["batch_id"]),
+        ("ix_allocations_order_line_id", "allocations", ["order_line_id"]),
+        ("ix_order_lines_order_id_sku", "order_lines", ["order_id", "sku"]),
+        ("ix_allocations_view_orderid_sku", "allocations_view",
+         ["orderid", "sku"]),
+    ), transactional=False),
+    Migration(3, "add_batches_allocated_quantity", add_column(
+        "batches", "allocated_quantity", "INTEGER NULL")),
+    Migration(4, "add_batch_archive", run_all(
+        add_column("batches", "shipped", "BOOLEAN NOT NULL DEFAULT FALSE"),
+        create_table(orm.archived_batches),
+        create_table(orm.archived_allocations),
+    )),
+    Migration(5, "add_outbox_dead_letters", run_all(
+        add_column("outbox", "attempts", "INTEGER NOT NULL DEFAULT 0"),
+        add_column("outbox", "dead_lettered_at", "TIMESTAMP NULL"),
+    )),
+]
+
+
+def applied_versions(connection: Connection) -> List[int]:
+    return list(connection.execute(
+        schema_migrations.select().with_only_columns(
+            [schema_migrations.c.version])
+        .order_by(schema_migrations.c.version)
+    ).scalars())
+
+
+def migrate(engine: Engine, migrations: Sequence[Migration] = MIGRATIONS,
+            target: Optional[int] = None) -> List[Migration]:
+    applied = []
+    with _migration_lock(engine):
+        schema_migrations.create(engine, checkfirst=True)
+        with engine.connect() as connection:
+            done = set(applied_versions(connection))
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version in done:
+                continue
+            if target is not None and migration.version > target:
+                break
+            _apply(engine, migration)
+            applied.append(migration)
+    return applied
+
+
+def _apply(engine: Engine, migration: Migration):
+    if migration.transactional:
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            _record(connection, migration)
+        return
+    with engine.connect() as connection:
+        migration.upgrade(
+            connection.execution_options(isolation_level="AUTOCOMMIT"))
+    with engine.begin() as connection:
+        _record(connection, migration)
+
+
+def _record(connection: Connection, migration: Migration):
+    connection.execute(schema_migrations.insert().values(
+        version=migration.version, name=migration.name))
+
+
+@contextlib.contextmanager
+def _migration_lock(engine: Engine):
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as connection:
+        connection.execute(
+            text("SELECT pg_advisory_lock(:key)"), dict(key=LOCK_KEY))
+        try:
+            yield
+        finally:
+            connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), dict(key=LOCK_KEY))
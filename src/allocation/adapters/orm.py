@@ -1,6 +1,6 @@
 from sqlalchemy import Table, MetaData, Column, Integer, String, Date, \
-    ForeignKey, event
-from sqlalchemy.orm import mapper, relationship
+    DateTime, Boolean, ForeignKey, Index, Text, event, false
+from sqlalchemy.orm import Session, mapper, relationship
 
 from allocation.domain import model
 
@@ -13,6 +13,7 @@ order_lines = Table(
     Column("sku", String(255)),
     Column("quantity", Integer, nullable=False),
     Column("order_id", String(255)),
+    Index("ix_order_lines_order_id_sku", "order_id", "sku"),
 )
 products = Table(
     "products",
@@ -25,18 +26,21 @@ batches = Table(
     "batches",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("sku", ForeignKey("products.sku")),
-    Column("reference", String(255)),
+    Column("sku", ForeignKey("products.sku"), index=True),
+    Column("reference", String(255), index=True),
     Column("_purchased_quantity", Integer, nullable=False),
     Column("eta", Date, nullable=True),
+    Column("allocated_quantity", Integer, nullable=True),
+    Column("shipped", Boolean, nullable=False, default=False,
+           server_default=false()),
 )
 
 allocations = Table(
     "allocations",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("order_line_id", ForeignKey("order_lines.id")),
-    Column("batch_id", ForeignKey("batches.id")),
+    Column("order_line_id", ForeignKey("order_lines.id"), index=True),
+    Column("batch_id", ForeignKey("batches.id"), index=True),
 )
 
 allocations_view = Table(
@@ -45,25 +49,95 @@ allocations_view = Table(
     Column("orderid", String(255)),
     Column("sku", String(255)),
     Column("batchref", String(255)),
+    Index("ix_allocations_view_orderid_sku", "orderid", "sku"),
 )
 
+archived_batches = Table(
+    "archived_batches",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("sku", String(255), index=True),
+    Column("reference", String(255), index=True),
+    Column("purchased_quantity", Integer, nullable=False),
+    Column("allocated_quantity", Integer, nullable=True),
+    Column("eta", Date, nullable=True),
+    Column("shipped", Boolean, nullable=False),
+    Column("archived_at", DateTime, nullable=False),
+)
+
+archived_allocations = Table(
+    "archived_allocations",
+    metadata,
+    Column("order_line_id", Integer, primary_key=True, autoincrement=False),
+    Column("batch_id", Integer, nullable=False, index=True),
+    Column("order_id", String(255)),
+    Column("sku", String(255)),
+    Column("quantity", Integer, nullable=False),
+    Index("ix_archived_allocations_order_id_sku", "order_id", "sku"),
+)
+
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0, server_default="0"),
+    Column("dead_lettered_at", DateTime, nullable=True),
+)
+
+
 def start_mappers():
-    lines_mapper = mapper(model.OrderLine, order_lines)
+    lines_mapper = mapper(model.OrderLine, order_lines, properties={
+        "_batch": relationship(
+            model.Batch,
+            secondary=allocations,
+            uselist=False,
+            back_populates="_allocations",
+        )
+    })
     batches_mapper = mapper(
         model.Batch,
         batches, properties={
+            "_allocated_quantity": batches.c.allocated_quantity,
             "_allocations": relationship(
                 lines_mapper,
                 secondary=allocations,
                 collection_class=set,
+                cascade="save-update, merge, expunge",
+                back_populates="_batch",
             )
         }, )
     mapper(
         model.Product, products,
-        properties={"batches": relationship(batches_mapper)}
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
+        properties={"batches": relationship(
+            batches_mapper, cascade="save-update, merge, expunge")}
     )
 
 
 @event.listens_for(model.Product, "load")
 def recieve_load(product, _):
     product.events = []
+    product.reset_indexes()
+
+
+@event.listens_for(model.Batch, "load")
+def recieve_batch_load(batch, _):
+    batch.defer_lines()
+
+
+@event.listens_for(model.Batch, "expire")
+def recieve_batch_expire(batch, attrs):
+    if batch is not None and attrs is None:
+        batch._pending_lines = []
+
+
+@event.listens_for(Session, "before_flush")
+def flush_pending_lines(session, *_):
+    for batch in session.dirty:
+        if isinstance(batch, model.Batch) and batch._pending_lines:
+            pending, batch._pending_lines = batch._pending_lines, []
+            for line in pending:
+                line._batch = batch
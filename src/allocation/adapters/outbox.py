@@ -0,0 +1,59 @@
+import json
+from dataclasses import asdict
+from datetime import datetime
+from typing import Iterable, List
+
+from sqlalchemy import select
+
+from allocation.adapters.orm import outbox
+from allocation.domain import events
+
+EVENT_TYPES = {
+    event_type.__name__: event_type
+    for event_type in events.Event.__subclasses__()
+}
+
+
+def add(session, events_: Iterable[events.Event]):
+    rows = [
+        dict(event_type=type(event).__name__,
+             payload=json.dumps(asdict(event)))
+        for event in events_
+    ]
+    if rows:
+        session.execute(outbox.insert(), rows)
+
+
+def fetch(session, limit: int) -> List:
+    return session.execute(
+        select(outbox.c.id, outbox.c.event_type, outbox.c.payload,
+               outbox.c.attempts)
+        .where(outbox.c.dead_lettered_at.is_(None))
+        .order_by(outbox.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).fetchall()
+
+
+def load(row) -> events.Event:
+    return EVENT_TYPES[row.event_type](**json.loads(row.payload))
+
+
+def delete(session, ids: List[int]):
+    session.execute(outbox.delete().where(outbox.c.id.in_(ids)))
+
+
+def record_failures(session, rows: List, max_attempts: int) -> List[int]:
+    dead = [row.id for row in rows if row.attempts + 1 >= max_attempts]
+    session.execute(
+        outbox.update()
+        .where(outbox.c.id.in_([row.id for row in rows]))
+        .values(attempts=outbox.c.attempts + 1)
+    )
+    if dead:
+        session.execute(
+            outbox.update()
+            .where(outbox.c.id.in_(dead))
+            .values(dead_lettered_at=datetime.utcnow())
+        )
+    return dead
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import abc
+from typing import TYPE_CHECKING, Dict, List, Sequence
+
+import redis
+from sqlalchemy import bindparam, text
+
+from allocation import config
+from allocation.domain import events
+
+if TYPE_CHECKING:
+    from allocation.service_layer import unit_of_work
+
+
+class AbstractReadModel(abc.ABC):
+    @abc.abstractmethod
+    def add(self, uow: unit_of_work.AbstractUnitOfWork,
+            allocated: List[events.Allocated]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove(self, uow: unit_of_work.AbstractUnitOfWork,
+               deallocated: List[events.Deallocated]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def allocations(self, uow: unit_of_work.AbstractUnitOfWork,
+                    order_id) -> List[dict]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def allocations_many(self, uow: unit_of_work.AbstractUnitOfWork,
+                         order_ids: Sequence, chunk_size: int = 500
+                         ) -> Dict[str, List[dict]]:
+        raise NotImplementedError
+
+
+ALLOCATIONS_FOR_ORDERS = text(
+    "SELECT orderid, sku, batchref FROM allocations_view"
+    " WHERE orderid IN :order_ids"
+).bindparams(bindparam("order_ids", expanding=True))
+
+
+def chunks(items: Sequence, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SqlAlchemyReadModel(AbstractReadModel):
+    def add(self, uow, allocated):
+        with uow:
+            uow.session.execute(
+                "DELETE FROM allocations_view"
+                " WHERE orderid = :orderid AND sku = :sku",
+                [
+                    dict(orderid=event.order_id, sku=event.sku)
+                    for event in allocated
+                ]
+            )
+            uow.session.execute(
+                "INSERT INTO allocations_view (orderid, sku, batchref)"
+                " VALUES (:orderid, :sku, :batchref)",
+                [
+                    dict(orderid=event.order_id, sku=event.sku,
+                         batchref=event.batchref)
+                    for event in allocated
+                ]
+            )
+            uow.commit()
+
+    def remove(self, uow, deallocated):
+        with uow:
+            uow.session.execute(
+                "DELETE FROM  allocations_view WHERE orderid = :orderid AND sku = :sku",
+                [
+                    dict(orderid=event.order_id, sku=event.sku)
+                    for event in deallocated
+                ]
+            )
+            uow.commit()
+
+    def allocations(self, uow, order_id):
+        with uow:
+            results = uow.session.execute(
+                """
+                SELECT sku, batchref FROM allocations_view WHERE orderid = :order_id
+                """,
+                dict(order_id=order_id),
+            )
+            return [dict(r) for r in results]
+
+    def allocations_many(self, uow, order_ids, chunk_size=500):
+        found = {order_id: [] for order_id in order_ids}
+        with uow:
+            for chunk in chunks(list(found), chunk_size):
+                for row in uow.session.execute(
+                        ALLOCATIONS_FOR_ORDERS, dict(order_ids=chunk)):
+                    found[row.orderid].append(
+                        dict(sku=row.sku, batchref=row.batchref))
+        return found
+
+
+class RedisReadModel(AbstractReadModel):
+    def __init__(self, client: redis.Redis = None,
+                 prefix: str = "allocations:"):
+        self.client = client or redis.Redis(
+            **config.get_redis_host_and_port(), decode_responses=True)
+        self.prefix = prefix
+
+    def add(self, uow, allocated):
+        def write():
+            with self.client.pipeline(transaction=False) as pipe:
+                for event in allocated:
+                    pipe.hset(self._key(event.order_id),
+                              event.sku, event.batchref)
+                pipe.execute()
+
+        uow.after_commit(write)
+
+    def remove(self, uow, deallocated):
+        def write():
+            with self.client.pipeline(transaction=False) as pipe:
+                for event in deallocated:
+                    pipe.hdel(self._key(event.order_id), event.sku)
+                pipe.execute()
+
+        uow.after_commit(write)
+
+    def allocations(self, uow, order_id):
+        return [
+            dict(sku=sku, batchref=batchref)
+            for sku, batchref in sorted(
+                self.client.hgetall(self._key(order_id)).items())
+        ]
+
+    def allocations_many(self, uow, order_ids, chunk_size=500):
+        found = {}
+        for chunk in chunks(list(dict.fromkeys(order_ids)), chunk_size):
+            with self.client.pipeline(transaction=False) as pipe:
+                for order_id in chunk:
+                    pipe.hgetall(self._key(order_id))
+                hashes = pipe.execute()
+            for order_id, fields in zip(chunk, hashes):
+                found[order_id] = [
+                    dict(sku=sku, batchref=batchref)
+                    for sku, batchref in sorted(fields.items())
+                ]
+        return found
+
+    def _key(self, order_id) -> str:
+        return f"{self.prefix}{order_id}"
+
+
+BACKENDS = {
+    "sql": SqlAlchemyReadModel,
+    "redis": RedisReadModel,
+}
+
+
+def build(backend: str) -> AbstractReadModel:
+    return BACKENDS[backend]()
@@ -8,5 +8,11 @@ from allocation.domain import events
 
 r = redis.Redis(**config.get_redis_host_and_port())
 
-def publish(channel, event: events.Event):
-    r.publish(channel, json.dumps(asdict(event)))
\ No newline at end of file
+def publish(channel, *events_: events.Event):
+    if len(events_) == 1:
+        r.publish(channel, json.dumps(asdict(events_[0])))
+        return
+    with r.pipeline(transaction=False) as pipe:
+        for event in events_:
+            pipe.publish(channel, json.dumps(asdict(event)))
+        pipe.execute()
@@ -1,54 +1,344 @@
 import abc
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm import joinedload, object_session, selectinload
+
+from allocation import metrics
 from allocation.adapters import orm
 from allocation.domain import model
 
 
+LOADING_PROFILES = {"lazy", "selectin", "joined", "counts_only"}
+LINES_DEFERRED = {"lazy", "counts_only"}
+
+
+def loading_options(loading: str) -> list:
+    if loading == "selectin":
+        return [selectinload(model.Product.batches)
+                .selectinload(model.Batch._allocations)]
+    if loading == "joined":
+        return [joinedload(model.Product.batches)
+                .joinedload(model.Batch._allocations)]
+    if loading == "counts_only":
+        return [selectinload(model.Product.batches)]
+    if loading == "lazy":
+        return []
+    raise ValueError(f"Unknown loading profile {loading!r}")
+
+
+def allocated_batchref(session, order_id, sku) -> Optional[str]:
+    return session.execute(
+        select(orm.batches.c.reference)
+        .select_from(orm.order_lines)
+        .join(orm.allocations,
+              orm.allocations.c.order_line_id == orm.order_lines.c.id)
+        .join(orm.batches, orm.batches.c.id == orm.allocations.c.batch_id)
+        .where(orm.order_lines.c.order_id == order_id,
+               orm.order_lines.c.sku == sku)
+        .limit(1)
+    ).scalar()
+
+
+class AllocatedLines(dict):
+    def __init__(self, product: model.Product):
+        super().__init__()
+        self.product = product
+
+    def get(self, key, default=None):
+        if not dict.__contains__(self, key):
+            self[key] = allocated_batchref(object_session(self.product), *key)
+        value = dict.__getitem__(self, key)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+class ProductCache:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.stale = self.evictions = 0
+        self._products = OrderedDict()
+        self._lock = threading.Lock()
+
+    def checkout(self, sku) -> Optional[model.Product]:
+        with self._lock:
+            return self._products.pop(sku, None)
+
+    def put(self, product: model.Product):
+        with self._lock:
+            cached = self._products.get(product.sku)
+            if cached is not None \
+                    and cached.version_number > product.version_number:
+                return
+            self._products[product.sku] = product
+            self._products.move_to_end(product.sku)
+            while len(self._products) > self.maxsize:
+                self._products.popitem(last=False)
+                self.evictions += 1
+                metrics.PRODUCT_CACHE.inc("evicted")
+
+    def discard(self, sku):
+        with self._lock:
+            self._products.pop(sku, None)
+
+    def clear(self):
+        with self._lock:
+            self._products.clear()
+
+    def record(self, result: str):
+        setattr(self, result, getattr(self, result) + 1)
+        metrics.PRODUCT_CACHE.inc(result)
+
+    def __len__(self):
+        return len(self._products)
+
+
+class BatchrefIndex:
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._skus = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ref) -> Optional[str]:
+        with self._lock:
+            sku = self._skus.get(ref)
+            if sku is not None:
+                self._skus.move_to_end(ref)
+        metrics.BATCHREF_INDEX.inc("hits" if sku is not None else "misses")
+        return sku
+
+    def put_many(self, refs: Iterable[Tuple[str, str]]):
+        with self._lock:
+            for ref, sku in refs:
+                self._skus[ref] = sku
+                self._skus.move_to_end(ref)
+            while len(self._skus) > self.maxsize:
+                self._skus.popitem(last=False)
+
+    def put(self, ref, sku):
+        self.put_many([(ref, sku)])
+
+    def discard(self, ref):
+        with self._lock:
+            self._skus.pop(ref, None)
+
+    def __len__(self):
+        return len(self._skus)
+
+
 class AbstractRepository(abc.ABC):
-    def __init__(self):
+    def __init__(self, cache: ProductCache = None,
+                 batchrefs: BatchrefIndex = None,
+                 numpy_engine_threshold: int = None):
         self.seen = set()
+        self.cache = cache
+        self.batchrefs = batchrefs
+        self.numpy_engine_threshold = numpy_engine_threshold
 
     def add(self, product: model.Product):
         self._add(product)
-        self.seen.add(product)
+        self._see([product])
 
-    def get(self, sku) -> model.Product:
-        product = self._get(sku)
+    def get(self, sku, loading: str = "lazy") -> model.Product:
+        product = None
+        if self.cache is not None:
+            product = self._get_cached(sku)
+        if product is None:
+            product = self._get(sku, loading)
+            if product is not None:
+                self._index_batchrefs([product], loading)
         if product:
-            self.seen.add(product)
+            self._see([product])
         return product
 
-    def get_by_batchref(self, batchred) -> model.Product:
-        product = self._get_by_batchref(batchred)
-        if product:
+    def get_many(self, skus: Iterable[str], loading: str = "lazy"
+                 ) -> Dict[str, model.Product]:
+        skus = list(dict.fromkeys(skus))
+        products = {}
+        if self.cache is not None:
+            products.update(self._get_many_cached(skus))
+        missing = [sku for sku in skus if sku not in products]
+        if missing:
+            loaded = self._get_many(missing, loading)
+            self._index_batchrefs(loaded, loading)
+            products.update((product.sku, product) for product in loaded)
+        self._see(products.values())
+        return products
+
+    def get_by_batchref(self, batchref, loading: str = "lazy"
+                        ) -> Optional[model.Product]:
+        if self.batchrefs is not None:
+            sku = self.batchrefs.get(batchref)
+            if sku is not None:
+                product = self.get(sku, loading)
+                if product is not None and product.has_batch(batchref):
+                    return product
+                self.batchrefs.discard(batchref)
+        sku = self._get_sku_by_batchref(batchref)
+        if sku is None:
+            return None
+        self.remember_batchref(batchref, sku)
+        return self.get(sku, loading)
+
+    def remember_batchref(self, batchref, sku):
+        if self.batchrefs is not None:
+            self.batchrefs.put(batchref, sku)
+
+    def reset_indexes(self, product: model.Product):
+        product.reset_indexes()
+
+    def release(self):
+        for product in self.seen:
+            self._detach(product)
+            self.cache.put(product)
+        self.seen.clear()
+
+    def _see(self, products: Iterable[model.Product]):
+        for product in products:
+            if self.numpy_engine_threshold is not None:
+                product.numpy_engine_threshold = self.numpy_engine_threshold
             self.seen.add(product)
-        return product
+
+    def _index_batchrefs(self, products, loading):
+        if self.batchrefs is None or loading == "lazy":
+            return
+        self.batchrefs.put_many(
+            (batch.reference, product.sku)
+            for product in products for batch in product.batches
+        )
+
+    def _get_cached(self, sku):
+        return self._get_many_cached([sku]).get(sku)
+
+    def _get_many_cached(self, skus):
+        seen = {p.sku for p in self.seen}
+        candidates = {}
+        for sku in skus:
+            if sku in seen:
+                continue
+            product = self.cache.checkout(sku)
+            if product is None:
+                self.cache.record("misses")
+            else:
+                candidates[sku] = product
+        if not candidates:
+            return {}
+        versions = self._get_versions(list(candidates))
+        products = {}
+        for sku, product in candidates.items():
+            if versions.get(sku) != product.version_number:
+                self.cache.record("stale")
+                continue
+            self.cache.record("hits")
+            self._attach(product)
+            products[sku] = product
+        return products
 
     @abc.abstractmethod
     def _add(self, product: model.Product):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def _get(self, sku) -> model.Product:
+    def _get(self, sku, loading: str) -> model.Product:
         raise NotImplementedError
 
     @abc.abstractmethod
-    def _get_by_batchref(self, batchref) -> model.Product:
+    def _get_sku_by_batchref(self, batchref) -> Optional[str]:
         raise NotImplementedError
 
+    def _get_many(self, skus: List[str], loading: str
+                  ) -> List[model.Product]:
+        return [
+            product for product in (self._get(sku, loading) for sku in skus)
+            if product is not None
+        ]
+
+    def _get_versions(self, skus: List[str]) -> Dict[str, int]:
+        # Without a way to read current versions, treat every cached
+        # product as stale so the cache is never trusted.
+        return {}
+
+    def _attach(self, product: model.Product):
+        pass
+
+    def _detach(self, product: model.Product):
+        pass
+
 
 class SqlAlchemyRepository(AbstractRepository):
-    def __init__(self, session):
-        super().__init__()
+    def __init__(self, session, cache: ProductCache = None,
+                 batchrefs: BatchrefIndex = None,
+                 numpy_engine_threshold: int = None):
+        super().__init__(cache, batchrefs, numpy_engine_threshold)
         self.session = session
 
     def _add(self, product):
         self.session.add(product)
 
-    def _get(self, sku):
-        return self.session.query(
-            model.Product).filter_by(sku=sku).first()
+    def _get(self, sku, loading):
+        product = self.session.query(model.Product).options(
+            *loading_options(loading)).filter_by(sku=sku).first()
+        if product is not None:
+            self._prepare([product], loading)
+        return product
+
+    def _get_many(self, skus, loading):
+        products = self.session.query(model.Product).options(
+            *loading_options(loading)).filter(
+            orm.products.c.sku.in_(skus)).all()
+        self._prepare(products, loading)
+        return products
+
+    def _get_sku_by_batchref(self, batchref):
+        return self.session.execute(
+            select(orm.batches.c.sku)
+            .where(orm.batches.c.reference == batchref).limit(1)
+        ).scalar()
+
+    def _prepare(self, products, loading):
+        if loading not in LINES_DEFERRED:
+            return
+        for product in products:
+            if product._allocated_lines is None:
+                product._allocated_lines = AllocatedLines(product)
+        if loading == "counts_only":
+            self._load_allocated_quantities([
+                batch for product in products for batch in product.batches
+                if batch._allocated_quantity is None
+                and "_allocations" in inspect(batch).unloaded
+            ])
+
+    def reset_indexes(self, product):
+        super().reset_indexes(product)
+        if inspect(product).persistent:
+            product._allocated_lines = AllocatedLines(product)
+
+    def _load_allocated_quantities(self, batches):
+        if not batches:
+            return
+        allocated = dict(self.session.execute(
+            select(orm.allocations.c.batch_id,
+                   func.sum(orm.order_lines.c.quantity))
+            .join(orm.order_lines,
+                  orm.order_lines.c.id == orm.allocations.c.order_line_id)
+            .where(orm.allocations.c.batch_id.in_([b.id for b in batches]))
+            .group_by(orm.allocations.c.batch_id)
+        ).all())
+        for batch in batches:
+            batch._allocated_quantity = allocated.get(batch.id, 0)
+
+    def _get_versions(self, skus):
+        return dict(self.session.execute(
+            select(orm.products.c.sku, orm.products.c.version_number)
+            .where(orm.products.c.sku.in_(skus))
+        ).all())
+
+    def _attach(self, product):
+        self.session.add(product)
 
-    def _get_by_batchref(self, batchref):
-        return self.session.query(model.Product).join(model.Batch).filter(
-            orm.batches.c.reference == batchref).first()
+    def _detach(self, product):
+        self.session.expunge(product)
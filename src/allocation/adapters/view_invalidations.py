@@ -0,0 +1,57 @@
+import json
+import logging
+import threading
+import time
+from typing import Callable, Iterable
+
+import redis
+
+from allocation import config
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "allocations_view_invalidated"
+
+r = redis.Redis(**config.get_redis_host_and_port())
+
+
+def broadcast(order_ids: Iterable[str]):
+    with r.pipeline(transaction=False) as pipe:
+        for order_id in order_ids:
+            pipe.publish(CHANNEL, json.dumps({"order_id": order_id}))
+        pipe.execute()
+
+
+def handle_invalidation(m, cache):
+    data = json.loads(m["data"])
+    cache.invalidate(data["order_id"])
+
+
+def listen(cache, pubsub, should_stop: Callable[[], bool] = lambda: False,
+           timeout: float = 1.0):
+    pubsub.subscribe(CHANNEL)
+    cache.clear()
+    while not should_stop():
+        m = pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if m is not None:
+            handle_invalidation(m, cache)
+
+
+def start_listener(cache, client: redis.Redis = None,
+                   should_stop: Callable[[], bool] = lambda: False,
+                   retry_interval: float = 1.0) -> threading.Thread:
+    client = client or r
+
+    def run():
+        while not should_stop():
+            try:
+                listen(cache, client.pubsub(), should_stop)
+            except redis.exceptions.RedisError:
+                logger.exception("Lost allocations view invalidations")
+                cache.clear()
+                time.sleep(retry_interval)
+
+    thread = threading.Thread(
+        target=run, name="view-invalidations", daemon=True)
+    thread.start()
+    return thread
@@ -1,36 +1,168 @@
+import functools
 import inspect
-from typing import Callable
-from allocation.adapters import orm, redis_eventpublisher, email
+import smtplib
+import socket
+import time
+from typing import Callable, Dict
+
+import redis
+from sqlalchemy import exc
+from tenacity import wait_random_exponential
+
+from allocation import config, metrics, views
+from allocation.adapters import orm, redis_eventpublisher, email, repository, \
+    read_models
 from allocation.adapters.notifications import AbstractNotification, \
     EmailNotifications
+from allocation.domain import model
 from allocation.service_layer import handlers, messagebus, unit_of_work
+from allocation.service_layer.archiver import BatchArchiver
+from allocation.service_layer.outbox_relay import OutboxRelay
+
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+    smtplib.SMTPConnectError,
+    smtplib.SMTPServerDisconnected,
+    redis.exceptions.ConnectionError,
+    redis.exceptions.TimeoutError,
+    exc.OperationalError,
+)
 
 
 def bootstrap(
         start_orm: bool = True,
-        uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
+        uow: unit_of_work.AbstractUnitOfWork = None,
         notifications: AbstractNotification = EmailNotifications(),
-        publish: Callable = redis_eventpublisher,
+        publish: Callable = redis_eventpublisher.publish,
+        deallocation_strategy: model.DeallocationStrategy =
+        model.deallocation_strategy(config.get_deallocation_strategy()),
+        numpy_engine_threshold: int = config.get_numpy_engine_threshold(),
+        retry_policy: messagebus.RetryPolicy =
+        messagebus.RetryPolicy(retryable=TRANSIENT_ERRORS),
+        retry_policies: Dict[Callable, messagebus.RetryPolicy] = None,
+        command_retry_policy: messagebus.RetryPolicy = messagebus.RetryPolicy(
+            attempts=config.get_conflict_retry_attempts(),
+            wait=wait_random_exponential(multiplier=0.01, max=0.5),
+            is_retryable=unit_of_work.is_concurrency_conflict,
+        ),
+        asynchronous: bool = False,
+        max_in_flight: int = 16,
+        outbox: bool = config.get_outbox_enabled(),
+        product_cache_size: int = config.get_product_cache_size(),
+        batchref_index_size: int = config.get_batchref_index_size(),
+        cascade_transactions: bool = config.get_cascade_transactions(),
+        read_model: read_models.AbstractReadModel =
+        read_models.build(config.get_read_model_backend()),
+        views_cache: views.AllocationsCache = None,
+        broadcast_view_invalidations: Callable = None,
 ):
     if start_orm:
         orm.start_mappers()
+    retry_policies = retry_policies or {}
+    # A caller passing its own uow configures it; the outbox, cache and
+    # engine settings here only apply to the one built by default.
+    uow = uow or unit_of_work.SqlAlchemyUnitOfWork(
+        outbox_event_types=tuple(handlers.OUTBOX_HANDLERS) if outbox else (),
+        product_cache=repository.ProductCache(product_cache_size)
+        if product_cache_size else None,
+        batchref_index=repository.BatchrefIndex(batchref_index_size)
+        if batchref_index_size else None,
+        numpy_engine_threshold=numpy_engine_threshold,
+    )
 
-    dependencies = {"uow": uow, "notifications": notifications, "publish": publish}
+    dependencies = {
+        "uow": uow,
+        "notifications": notifications,
+        "publish": publish,
+        "deallocation_strategy": deallocation_strategy,
+        "read_model": read_model,
+        "views_cache": views_cache,
+        "broadcast_view_invalidations": broadcast_view_invalidations,
+    }
+    injected = {
+        handler: retry_policies.get(handler, retry_policy).wrap(
+            inject_dependencies(handler, dependencies))
+        for event_handlers in handlers.EVENT_HANDLERS.values()
+        for handler in event_handlers
+    }
+    outboxed = getattr(uow, "outbox_event_types", ())
     injected_event_handlers = {
         event_type: [
-            inject_dependencies(handler, dependencies)
+            injected[handler]
             for handler in event_handlers
+            if not (event_type in outboxed
+                    and handler is handlers.OUTBOX_HANDLERS.get(event_type))
         ]
         for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
     }
+    # In cascade mode a conflict retry has to start a new transaction, so
+    # it wraps the whole cascade instead of each command handler.
     injected_command_handlers = {
         command_type: inject_dependencies(handler, dependencies)
+        if cascade_transactions else command_retry_policy.wrap(
+            inject_dependencies(handler, dependencies))
         for command_type, handler in handlers.COMMAND_HANDLERS.items()
     }
+    if asynchronous:
+        if cascade_transactions:
+            raise ValueError(
+                "cascade transactions need every handler on one thread")
+        return messagebus.AsyncMessageBus(
+            uow=uow,
+            event_handlers=injected_event_handlers,
+            command_handlers=injected_command_handlers,
+            max_in_flight=max_in_flight,
+        )
     return messagebus.MessageBus(
         uow=uow,
         event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers,
+        cascade_transactions=cascade_transactions,
+        cascade_retry_policy=command_retry_policy,
+    )
+
+
+def bootstrap_outbox_relay(
+        uow: unit_of_work.SqlAlchemyUnitOfWork = None,
+        notifications: AbstractNotification = None,
+        publish: Callable = redis_eventpublisher.publish,
+        retry_policy: messagebus.RetryPolicy =
+        messagebus.RetryPolicy(retryable=TRANSIENT_ERRORS),
+        batch_size: int = config.get_outbox_batch_size(),
+        poll_interval: float = config.get_outbox_poll_interval(),
+        max_attempts: int = config.get_outbox_max_attempts(),
+) -> OutboxRelay:
+    uow = uow or unit_of_work.SqlAlchemyUnitOfWork()
+    dependencies = {
+        "uow": uow,
+        "notifications": notifications or EmailNotifications(),
+        "publish": publish,
+    }
+    injected_event_handlers = {
+        event_type: retry_policy.wrap(
+            inject_dependencies(handler, dependencies))
+        for event_type, handler in handlers.OUTBOX_HANDLERS.items()
+    }
+    return OutboxRelay(
+        uow=uow,
+        event_handlers=injected_event_handlers,
+        batch_size=batch_size,
+        poll_interval=poll_interval,
+        max_attempts=max_attempts,
+    )
+
+
+def bootstrap_archiver(
+        uow: unit_of_work.SqlAlchemyUnitOfWork = None,
+        chunk_size: int = config.get_archive_chunk_size(),
+        interval: float = config.get_archive_interval(),
+) -> BatchArchiver:
+    return BatchArchiver(
+        uow=uow or unit_of_work.SqlAlchemyUnitOfWork(),
+        chunk_size=chunk_size,
+        interval=interval,
     )
 
 
@@ -41,4 +173,18 @@ def inject_dependencies(handler, dependencies):
         for name, dependency in dependencies.items()
         if name in params
     }
-    return lambda message: handler(message, **deps)
+
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    def injected_handler(message):
+        start = time.perf_counter()
+        try:
+            return handler(message, **deps)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+    return injected_handler
+
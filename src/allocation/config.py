@@ -9,6 +9,10 @@ def get_postgres_uri():
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_isolation_level():
+    return os.environ.get("DB_ISOLATION_LEVEL", "REPEATABLE READ")
+
+
 def get_api_url():
     host = os.environ.get("API_HOST", "localhost")
     port = 5005 if host == "localhost" else 80
@@ -26,3 +30,91 @@ def get_email_host_and_port():
     port = 11025 if host == "localhost" else 1025
     http_port = 18025 if host == "localhost" else 8025
     return dict(host=host, port=port, http_port=http_port)
+
+
+def get_deallocation_strategy():
+    return os.environ.get("DEALLOCATION_STRATEGY", "fewest_lines")
+
+
+def get_numpy_engine_threshold():
+    return int(os.environ.get("NUMPY_ENGINE_THRESHOLD", 500))
+
+
+def get_outbox_enabled():
+    return os.environ.get("OUTBOX_ENABLED", "0").lower() in ("1", "true")
+
+
+def get_outbox_batch_size():
+    return int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+
+
+def get_outbox_poll_interval():
+    return float(os.environ.get("OUTBOX_POLL_INTERVAL", 1.0))
+
+
+def get_outbox_max_attempts():
+    return int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+
+
+def get_archive_chunk_size():
+    return int(os.environ.get("ARCHIVE_CHUNK_SIZE", 500))
+
+
+def get_archive_interval():
+    return float(os.environ.get("ARCHIVE_INTERVAL", 3600))
+
+
+def get_metrics_dump_path():
+    return os.environ.get(
+        "METRICS_DUMP_PATH", "/tmp/allocation_consumer_metrics.prom")
+
+
+def get_product_cache_size():
+    return int(os.environ.get("PRODUCT_CACHE_SIZE", 1024))
+
+
+def get_read_model_backend():
+    return os.environ.get("READ_MODEL_BACKEND", "sql")
+
+
+def get_views_cache_size():
+    return int(os.environ.get("VIEWS_CACHE_SIZE", 10_000))
+
+
+def get_views_cache_ttl():
+    return float(os.environ.get("VIEWS_CACHE_TTL", 5.0))
+
+
+def get_views_lookup_chunk_size():
+    return int(os.environ.get("VIEWS_LOOKUP_CHUNK_SIZE", 500))
+
+
+def get_views_lookup_max_orders():
+    return int(os.environ.get("VIEWS_LOOKUP_MAX_ORDERS", 10_000))
+
+
+def get_batchref_index_size():
+    return int(os.environ.get("BATCHREF_INDEX_SIZE", 100_000))
+
+
+def get_conflict_retry_attempts():
+    return int(os.environ.get("CONFLICT_RETRY_ATTEMPTS", 5))
+
+
+def get_cascade_transactions():
+    return os.environ.get("CASCADE_TRANSACTIONS", "0").lower() in ("1", "true")
+
+
+def get_db_pool_settings():
+    return dict(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.environ.get(
+            "DB_POOL_PRE_PING", "1").lower() in ("1", "true"),
+    )
+
+
+def get_statement_timeout_ms():
+    return int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))
@@ -0,0 +1,137 @@
+from __future__ import annotations
+import bisect
+from collections import Counter
+from datetime import date
+from typing import TYPE_CHECKING, List, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if TYPE_CHECKING:
+    from allocation.domain.model import Batch, OrderLine
+
+
+def allocation_order_for(batches: List[Batch], numpy_threshold: int):
+    if numpy is not None and len(batches) >= numpy_threshold:
+        return NumpyAllocationOrder(batches)
+    return AllocationOrder(batches)
+
+
+class AllocationOrder:
+    def __init__(self, batches: List[Batch]):
+        self._keys = {}
+        self._batches = {}
+        self._all = []
+        self._open = []
+        for batch in batches:
+            self.add(batch)
+
+    def add(self, batch: Batch):
+        key = (batch.eta is not None, batch.eta or date.min, len(self._keys))
+        self._keys[id(batch)] = key
+        self._batches[key] = batch
+        bisect.insort(self._all, key)
+        self.update(batch)
+
+    def update(self, batch: Batch):
+        key = self._keys[id(batch)]
+        position = bisect.bisect_left(self._open, key)
+        is_listed = position < len(self._open) and self._open[position] == key
+        if batch.available_quantity > 0 and not is_listed:
+            self._open.insert(position, key)
+        elif batch.available_quantity <= 0 and is_listed:
+            del self._open[position]
+
+    def first_fit(self, line: OrderLine) -> Optional[Batch]:
+        return self._first_fit(line, Counter(), self._open)
+
+    def first_fit_many(self, lines: List[OrderLine]) -> List[Optional[Batch]]:
+        claimed, claimed_lines, chosen = Counter(), set(), []
+        open_keys = list(self._open)
+        for line in lines:
+            batch = self._first_fit(line, claimed, open_keys)
+            if batch is not None and _is_new_claim(batch, line, claimed_lines):
+                claimed[id(batch)] += line.quantity
+                if batch.available_quantity - claimed[id(batch)] <= 0:
+                    key = self._keys[id(batch)]
+                    position = bisect.bisect_left(open_keys, key)
+                    if position < len(open_keys) and open_keys[position] == key:
+                        del open_keys[position]
+            chosen.append(batch)
+        return chosen
+
+    def _first_fit(self, line: OrderLine, claimed: Counter, open_keys: list
+                   ) -> Optional[Batch]:
+        for key in open_keys if line.quantity > 0 else self._all:
+            batch = self._batches[key]
+            if (batch.can_allocate(line) and
+                    batch.available_quantity - claimed[id(batch)]
+                    >= line.quantity):
+                return batch
+        return None
+
+
+class NumpyAllocationOrder:
+    def __init__(self, batches: List[Batch]):
+        keys = [_eta_key(batch, position) for position, batch in enumerate(batches)]
+        order = sorted(range(len(batches)), key=keys.__getitem__)
+        self._added = len(batches)
+        self._batches = [batches[i] for i in order]
+        self._keys = numpy.array([keys[i] for i in order], dtype=numpy.int64)
+        self._available = numpy.array(
+            [batch.available_quantity for batch in self._batches],
+            dtype=numpy.int64)
+        self._index_slots()
+
+    def add(self, batch: Batch):
+        key = _eta_key(batch, self._added)
+        self._added += 1
+        slot = int(numpy.searchsorted(self._keys, key))
+        self._batches.insert(slot, batch)
+        self._keys = numpy.insert(self._keys, slot, key)
+        self._available = numpy.insert(
+            self._available, slot, batch.available_quantity)
+        self._index_slots()
+
+    def update(self, batch: Batch):
+        self._available[self._slots[id(batch)]] = batch.available_quantity
+
+    def first_fit(self, line: OrderLine) -> Optional[Batch]:
+        slot = self._first_fit(line, self._available)
+        return None if slot is None else self._batches[slot]
+
+    def first_fit_many(self, lines: List[OrderLine]) -> List[Optional[Batch]]:
+        available, claimed_lines, chosen = self._available.copy(), set(), []
+        for line in lines:
+            slot = self._first_fit(line, available)
+            if slot is None:
+                chosen.append(None)
+                continue
+            batch = self._batches[slot]
+            if _is_new_claim(batch, line, claimed_lines):
+                available[slot] -= line.quantity
+            chosen.append(batch)
+        return chosen
+
+    def _index_slots(self):
+        self._slots = {id(batch): slot for slot, batch in enumerate(self._batches)}
+
+    def _first_fit(self, line: OrderLine, available) -> Optional[int]:
+        for slot in numpy.flatnonzero(available >= line.quantity):
+            if self._batches[slot].sku == line.sku:
+                return int(slot)
+        return None
+
+
+def _eta_key(batch: Batch, position: int) -> int:
+    ordinal = 0 if batch.eta is None else batch.eta.toordinal()
+    return ordinal << 32 | position
+
+
+def _is_new_claim(batch: Batch, line: OrderLine, claimed_lines: set) -> bool:
+    if (id(batch), line) in claimed_lines or batch.is_allocated(line):
+        return False
+    claimed_lines.add((id(batch), line))
+    return True
@@ -1,12 +1,15 @@
 from datetime import date
-from typing import Optional
+from typing import Optional, List, Tuple
 from dataclasses import dataclass
 
+from allocation.domain.slots import slotted
+
 
 class Command:
-    pass
+    __slots__ = ()
 
 
+@slotted
 @dataclass
 class Allocate(Command):
     order_id: str
@@ -14,6 +17,21 @@ class Allocate(Command):
     quantity: int
 
 
+@slotted
+@dataclass
+class AllocateMany(Command):
+    sku: str
+    lines: List[Tuple[str, int]]
+
+
+@slotted
+@dataclass
+class AllocateOrder(Command):
+    order_id: str
+    lines: List[Tuple[str, int]]
+
+
+@slotted
 @dataclass
 class CreateBatch(Command):
     ref: str
@@ -22,7 +40,14 @@ class CreateBatch(Command):
     eta: Optional[date] = None
 
 
+@slotted
 @dataclass
 class ChangeBatchQuantity(Command):
     ref: str
     quantity: int
+
+
+@slotted
+@dataclass
+class ShipBatch(Command):
+    ref: str
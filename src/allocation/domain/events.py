@@ -1,15 +1,19 @@
 from dataclasses import dataclass
 
+from allocation.domain.slots import slotted
+
 
 class Event:
-    pass
+    __slots__ = ()
 
 
+@slotted
 @dataclass
 class OutOfStock(Event):
     sku: str
 
 
+@slotted
 @dataclass
 class Allocated(Event):
     order_id: str
@@ -18,6 +22,7 @@ class Allocated(Event):
     batchref: str
 
 
+@slotted
 @dataclass
 class Deallocated(Event):
     order_id: str
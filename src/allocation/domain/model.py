@@ -1,9 +1,13 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional, List
+from typing import Optional, List, Iterable, Callable, Set
 
 from allocation.domain import events, commands
+from allocation.domain.allocation_order import allocation_order_for
+
+CHECK_QUANTITY_COUNTERS = False
+LEAST_QUANTITY_SEARCH_LIMIT = 50_000_000
 
 
 class OutOfStock(Exception):
@@ -11,41 +15,146 @@ class OutOfStock(Exception):
 
 
 class Product:
+    numpy_engine_threshold = 500
+
     def __init__(self, sku: str, batches: List[Batch],
                  version_number: int = 0):
         self.sku = sku
         self.batches = batches
         self.version_number = version_number
         self.events = []
+        self.reset_indexes()
+
+    def reset_indexes(self):
+        self._reset_batch_indexes()
+        self._allocated_lines = None
+
+    def _reset_batch_indexes(self):
+        self._indexed_batches = None
+        self._allocation_order = None
+        self._batches_by_ref = None
+
+    def add_batch(self, batch: Batch):
+        self._ensure_indexes()
+        self.batches.append(batch)
+        if len(self.batches) == self.numpy_engine_threshold:
+            self._reset_batch_indexes()
+        else:
+            self._index_batch(batch)
+        self.version_number += 1
 
     def allocate(self, line: OrderLine) -> str:
-        try:
-            batch = next(
-                b for b in sorted(self.batches) if b.can_allocate(line))
-            batch.allocate(line)
+        existing = self._get_allocated_lines().get(_line_key(line))
+        if existing is not None:
+            return existing
+        batchref = self._allocate(line)
+        if batchref is not None:
             self.version_number += 1
-            self.events.append(
-                events.Allocated(
-                    order_id=line.order_id,
-                    sku=line.sku,
-                    quantity=line.quantity,
-                    batchref=batch.reference
-                )
-            )
-            return batch.reference
-        except StopIteration:
+        return batchref
+
+    def allocate_many(self, lines: List[OrderLine]) -> List[Optional[str]]:
+        keys = [_line_key(line) for line in lines]
+        if len(set(keys)) < len(keys):
+            return [self.allocate(line) for line in lines]
+        allocated_lines = self._get_allocated_lines()
+        new_lines = [
+            line for key, line in zip(keys, lines)
+            if key not in allocated_lines
+        ]
+        planned = self._get_allocation_order().first_fit_many(new_lines)
+        results = {
+            _line_key(line): self._allocate_to(line, batch)
+            for line, batch in zip(new_lines, planned)
+        }
+        if any(ref is not None for ref in results.values()):
+            self.version_number += 1
+        return [
+            results[key] if key in results else allocated_lines[key]
+            for key in keys
+        ]
+
+    def _allocate(self, line: OrderLine) -> Optional[str]:
+        return self._allocate_to(
+            line, self._get_allocation_order().first_fit(line))
+
+    def _allocate_to(self, line: OrderLine, batch: Optional[Batch]
+                     ) -> Optional[str]:
+        if batch is None:
             self.events.append(events.OutOfStock(line.sku))
             return None
+        batch.allocate(line)
+        self._allocation_order.update(batch)
+        self._allocated_lines[_line_key(line)] = batch.reference
+        self.events.append(
+            events.Allocated(
+                order_id=line.order_id,
+                sku=line.sku,
+                quantity=line.quantity,
+                batchref=batch.reference
+            )
+        )
+        return batch.reference
 
-    def change_batch_quantity(self, ref: str, quantity: int):
-        batch = next(b for b in self.batches if b.reference == ref)
+    def change_batch_quantity(
+            self, ref: str, quantity: int,
+            deallocation_strategy: DeallocationStrategy = None):
+        batch = self._get_batch(ref)
         batch._purchased_quantity = quantity
-        while batch.available_quantity < 0:
-            line = batch.deallocate_one()
+        evicted = batch.deallocate_to_fit(
+            deallocation_strategy or deallocate_fewest_lines)
+        for line in evicted:
+            self._get_allocated_lines().pop(_line_key(line), None)
             self.events.append(
                 events.Deallocated(line.order_id, line.sku,
                                           line.quantity)
             )
+        self._get_allocation_order().update(batch)
+        self.version_number += 1
+
+    def ship_batch(self, ref: str):
+        batch = self._get_batch(ref)
+        if batch.shipped:
+            return
+        batch.shipped = True
+        self._get_allocation_order().update(batch)
+        self.version_number += 1
+
+    def has_batch(self, ref: str) -> bool:
+        if self._indexed_batches == len(self.batches):
+            return ref in self._batches_by_ref
+        return any(batch.reference == ref for batch in self.batches)
+
+    def _get_batch(self, ref: str) -> Batch:
+        self._ensure_indexes()
+        return self._batches_by_ref[ref]
+
+    def _get_allocation_order(self):
+        self._ensure_indexes()
+        return self._allocation_order
+
+    def _get_allocated_lines(self):
+        self._ensure_indexes()
+        if self._allocated_lines is None:
+            self._allocated_lines = {
+                _line_key(line): batch.reference
+                for batch in self.batches
+                for line in batch._lines()
+            }
+        return self._allocated_lines
+
+    def _ensure_indexes(self):
+        if self._indexed_batches != len(self.batches):
+            self._allocation_order = allocation_order_for(
+                self.batches, self.numpy_engine_threshold)
+            self._batches_by_ref = {}
+            for batch in self.batches:
+                self._batches_by_ref.setdefault(batch.reference, batch)
+            self._indexed_batches = len(self.batches)
+
+    def _index_batch(self, batch: Batch):
+        self._allocation_order.add(batch)
+        self._batches_by_ref.setdefault(batch.reference, batch)
+        self._indexed_batches += 1
 
 
 @dataclass(unsafe_hash=True)
@@ -55,6 +164,10 @@ class OrderLine:
     quantity: int
 
 
+def _line_key(line: OrderLine):
+    return line.order_id, line.sku
+
+
 class Batch:
     def __init__(
             self,
@@ -67,6 +180,10 @@ class Batch:
         self.eta = eta
         self._purchased_quantity = quantity
         self._allocations = set()
+        self._allocated_quantity = 0
+        self._lines_deferred = False
+        self._pending_lines = []
+        self.shipped = False
 
     def __repr__(self):
         return f"<Batch {self.reference}>"
@@ -86,24 +203,156 @@ class Batch:
             return True
         return self.eta > other.eta
 
+    def defer_lines(self):
+        self._lines_deferred = True
+        self._pending_lines = []
+
     def allocate(self, line: OrderLine):
-        if self.can_allocate(line):
+        if not self.can_allocate(line):
+            return
+        if self._lines_deferred:
+            self._pending_lines.append(line)
+        elif line not in self._allocations:
             self._allocations.add(line)
+        else:
+            return
+        self._allocated_quantity = self.allocated_quantity + line.quantity
+        self._check_quantity_counters()
 
     def deallocate(self, line: OrderLine):
-        if line in self._allocations:
+        if line in self._lines():
+            allocated = self.allocated_quantity
             self._allocations.remove(line)
+            self._allocated_quantity = allocated - line.quantity
+            self._check_quantity_counters()
+
+    def is_allocated(self, line: OrderLine) -> bool:
+        return line in self._lines()
+
+    def _lines(self) -> Set[OrderLine]:
+        if self._pending_lines:
+            pending, self._pending_lines = self._pending_lines, []
+            self._allocations.update(pending)
+        return self._allocations
+
+    def _check_quantity_counters(self):
+        # A deferred batch has no lines in memory to add up; its stored
+        # counter is checked against the database by
+        # maintenance.allocated_quantity_drift instead.
+        if CHECK_QUANTITY_COUNTERS and not self._lines_deferred:
+            expected = sum(line.quantity for line in self._allocations)
+            assert self._allocated_quantity == expected, (
+                f"{self!r} counts {self._allocated_quantity} allocated,"
+                f" lines add up to {expected}"
+            )
 
     @property
     def allocated_quantity(self) -> int:
-        return sum(line.quantity for line in self._allocations)
+        if self._allocated_quantity is None:
+            self._allocated_quantity = sum(
+                line.quantity for line in self._lines())
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
+        if self.shipped:
+            return 0
         return self._purchased_quantity - self.allocated_quantity
 
     def can_allocate(self, line: OrderLine) -> bool:
         return self.sku == line.sku and self.available_quantity >= line.quantity
 
+    def deallocate_to_fit(
+            self, strategy: DeallocationStrategy) -> List[OrderLine]:
+        shortfall = -self.available_quantity
+        if shortfall <= 0:
+            return []
+        lines = strategy(self._lines(), shortfall)
+        for line in lines:
+            self.deallocate(line)
+        return lines
+
     def deallocate_one(self) -> OrderLine:
-        return self._allocations.pop()
+        allocated = self.allocated_quantity
+        line = self._lines().pop()
+        self._allocated_quantity = allocated - line.quantity
+        self._check_quantity_counters()
+        return line
+
+
+DeallocationStrategy = Callable[[Iterable[OrderLine], int], List[OrderLine]]
+
+
+def _by_quantity(lines: Iterable[OrderLine]) -> List[OrderLine]:
+    return sorted(lines, key=lambda line: (line.quantity, line.order_id))
+
+
+def _take_until_covered(lines: Iterable[OrderLine], shortfall: int):
+    chosen, freed = [], 0
+    for line in lines:
+        if freed >= shortfall:
+            break
+        chosen.append(line)
+        freed += line.quantity
+    return chosen
+
+
+def deallocate_any(lines: Iterable[OrderLine], shortfall: int
+                   ) -> List[OrderLine]:
+    return _take_until_covered(lines, shortfall)
+
+
+def deallocate_fewest_lines(lines: Iterable[OrderLine], shortfall: int
+                            ) -> List[OrderLine]:
+    return _take_until_covered(reversed(_by_quantity(lines)), shortfall)
+
+
+def deallocate_least_quantity(lines: Iterable[OrderLine], shortfall: int
+                              ) -> List[OrderLine]:
+    lines = list(reversed(_by_quantity(lines)))
+    if not lines:
+        return []
+    limit = shortfall + lines[0].quantity
+    if len(lines) * limit > LEAST_QUANTITY_SEARCH_LIMIT:
+        return _trim(_take_until_covered(lines, shortfall), shortfall)
+    mask = (1 << limit) - 1
+    reachable = [1]
+    for line in lines:
+        sums = reachable[-1]
+        reachable.append((sums | (sums << line.quantity)) & mask)
+    covering = reachable[-1] >> shortfall
+    if not covering:
+        return lines
+    target = shortfall + (covering & -covering).bit_length() - 1
+    chosen = []
+    for i in range(len(lines), 0, -1):
+        if not (reachable[i - 1] >> target) & 1:
+            chosen.append(lines[i - 1])
+            target -= lines[i - 1].quantity
+    return chosen
+
+
+def _trim(lines: List[OrderLine], shortfall: int) -> List[OrderLine]:
+    freed = sum(line.quantity for line in lines)
+    kept = []
+    for line in reversed(lines):
+        if freed - line.quantity >= shortfall:
+            freed -= line.quantity
+        else:
+            kept.append(line)
+    return kept
+
+
+DEALLOCATION_STRATEGIES = {
+    "any": deallocate_any,
+    "fewest_lines": deallocate_fewest_lines,
+    "least_quantity": deallocate_least_quantity,
+}
+
+
+def deallocation_strategy(name: str) -> DeallocationStrategy:
+    if name not in DEALLOCATION_STRATEGIES:
+        raise ValueError(
+            f"Unknown deallocation strategy {name!r},"
+            f" expected one of {', '.join(DEALLOCATION_STRATEGIES)}")
+    return DEALLOCATION_STRATEGIES[name]
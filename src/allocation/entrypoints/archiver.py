@@ -0,0 +1,13 @@
+import logging
+
+from allocation import bootstrap
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    archiver = bootstrap.bootstrap_archiver()
+    archiver.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import argparse
+import logging
+import sys
+
+from allocation.adapters import engines, maintenance
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare batches.allocated_quantity with allocations")
+    parser.add_argument("--fix", action="store_true",
+                        help="rewrite drifted quantities")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    with engines.ENGINES.engine().begin() as connection:
+        if args.fix:
+            drift = maintenance.reconcile_allocated_quantities(connection)
+        else:
+            drift = maintenance.allocated_quantity_drift(connection)
+    for row in drift:
+        logger.warning("Batch %s (%s) stores %s allocated, lines add up to %s",
+                       row.reference, row.sku, row.stored, row.actual)
+    return 1 if drift and not args.fix else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
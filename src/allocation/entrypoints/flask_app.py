@@ -1,27 +1,47 @@
+import time
 from datetime import datetime
 
-from flask import Flask, request, jsonify
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from flask import Flask, Response, g, request, jsonify
 
-from allocation import config
 from allocation.domain import commands
-from allocation.adapters import repository
 from allocation.service_layer import unit_of_work
-from allocation.service_layer.handlers import InvalidSku
-from allocation import views, bootstrap
-
-get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
+from allocation.service_layer.handlers import InvalidBatchref, InvalidSku
+from allocation import config, views, bootstrap, metrics
+from allocation.adapters import read_models, view_invalidations
 
 app = Flask(__name__)
-bus = bootstrap.bootstrap()
+read_model = read_models.build(config.get_read_model_backend())
+views_cache = views.AllocationsCache(
+    maxsize=config.get_views_cache_size(), ttl=config.get_views_cache_ttl(),
+) if config.get_views_cache_size() else None
+bus = bootstrap.bootstrap(
+    read_model=read_model,
+    views_cache=views_cache,
+    broadcast_view_invalidations=view_invalidations.broadcast,
+)
+if views_cache is not None:
+    view_invalidations.start_listener(views_cache)
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            request.method, route, response.status_code,
+        )
+    return response
 
 
 @app.route("/allocate", methods=["POST"])
 def allocate_endpoint():
-    session = get_session()
-    repo = repository.SqlAlchemyRepository(session)
-
     try:
         command = commands.Allocate(request.json["order_id"],
                                   request.json["sku"],
@@ -33,10 +53,21 @@ def allocate_endpoint():
     return "ok", 202
 
 
+@app.route("/allocate_order", methods=["POST"])
+def allocate_order_endpoint():
+    try:
+        command = commands.AllocateOrder(
+            request.json["order_id"],
+            [(line["sku"], line["quantity"]) for line in request.json["lines"]],
+        )
+        [batchrefs, *_] = bus.handle(command)
+    except InvalidSku as e:
+        return {"message": str(e)}, 400
+    return {"batchrefs": batchrefs}, 202
+
+
 @app.route("/add_batch", methods=["POST"])
 def add_batch():
-    session = get_session()
-    repo = repository.SqlAlchemyRepository(session)
     eta = request.json["eta"]
     if eta is not None:
         eta = datetime.fromisoformat(eta).date()
@@ -50,10 +81,42 @@ def add_batch():
     return "OK", 201
 
 
+@app.route("/ship_batch", methods=["POST"])
+def ship_batch_endpoint():
+    try:
+        bus.handle(commands.ShipBatch(request.json["ref"]))
+    except InvalidBatchref as e:
+        return {"message": str(e)}, 400
+    return "OK", 202
+
+
 @app.route("/allocations/<order_id>", methods=["GET"])
 def allocations_view_endpoint(order_id):
     uow = unit_of_work.SqlAlchemyUnitOfWork()
-    result = views.allocations(order_id, uow)
+    result = views.allocations(
+        order_id, uow, cache=views_cache, read_model=read_model)
     if not result:
         return "not found", 404
     return jsonify(result), 200
+
+
+@app.route("/allocations/lookup", methods=["POST"])
+def allocations_lookup_endpoint():
+    order_ids = (request.get_json(silent=True) or {}).get("order_ids")
+    if not isinstance(order_ids, list) \
+            or not all(isinstance(o, str) for o in order_ids):
+        return {"message": "order_ids must be a list of strings"}, 400
+    if len(order_ids) > config.get_views_lookup_max_orders():
+        return {"message": "Too many order ids"}, 400
+    uow = unit_of_work.SqlAlchemyUnitOfWork()
+    result = views.allocations_for_orders(
+        order_ids, uow, cache=views_cache, read_model=read_model,
+        chunk_size=config.get_views_lookup_chunk_size(),
+    )
+    return jsonify(result), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(),
+                    mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,16 @@
+import logging
+
+from allocation.adapters import engines, migrations
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    for migration in migrations.migrate(engines.ENGINES.engine()):
+        logger.info("Applied migration %s %s",
+                    migration.version, migration.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import logging
+
+from allocation import bootstrap
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    relay = bootstrap.bootstrap_outbox_relay()
+    relay.run()
+
+
+if __name__ == "__main__":
+    main()
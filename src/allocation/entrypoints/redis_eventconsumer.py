@@ -1,6 +1,10 @@
 import json
+import os
+import signal
+
 import redis
-from allocation import config, bootstrap
+from allocation import config, bootstrap, metrics
+from allocation.adapters import view_invalidations
 from allocation.domain import commands
 
 r = redis.Redis(**config.get_redis_host_and_port())
@@ -9,7 +13,9 @@ r = redis.Redis(**config.get_redis_host_and_port())
 def main():
     pubsub = r.pubsub(ignore_subscribe_messages=True)
     pubsub.subscribe("change_batch_quantity")
-    bus = bootstrap.bootstrap()
+    bus = bootstrap.bootstrap(
+        broadcast_view_invalidations=view_invalidations.broadcast)
+    signal.signal(signal.SIGUSR1, dump_metrics)
 
     for m in pubsub.listen():
         handle_change_batch_quantity(m, bus)
@@ -22,5 +28,12 @@ def handle_change_batch_quantity(m, bus):
     bus.handle(cmd)
 
 
+def dump_metrics(*_, path=None):
+    path = path or config.get_metrics_dump_path()
+    with open(f"{path}.tmp", "w") as f:
+        f.write(metrics.REGISTRY.render())
+    os.replace(f"{path}.tmp", path)
+
+
 if __name__ == "__main__":
     main()
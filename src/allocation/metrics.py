@@ -0,0 +1,250 @@
+import bisect
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (
+    .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+DEPTH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.type}"]
+
+    def _labels(self, values: Tuple, **extra) -> str:
+        pairs = [*zip(self.labelnames, values), *extra.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(
+            f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = super().render()
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in values.items():
+            lines.append(f"{self.name}{self._labels(labels)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+    drain_every = 1024
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._pending = deque()
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        self._pending.append((labels, value))
+        if len(self._pending) >= self.drain_every:
+            self._drain()
+
+    def _drain(self):
+        with self._lock:
+            pending, buckets = self._pending, self.buckets
+            for _ in range(len(pending)):
+                labels, value = pending.popleft()
+                series = self._series.get(labels)
+                if series is None:
+                    series = self._series[labels] = [0] * (len(buckets) + 2)
+                series[bisect.bisect_left(buckets, value)] += 1
+                series[-1] += value
+
+    def count(self, *labels) -> int:
+        self._drain()
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = super().render()
+        self._drain()
+        with self._lock:
+            series = {
+                labels: list(values) for labels, values in self._series.items()
+            }
+        for labels, values in series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket"
+                             f"{self._labels(labels, le=bound)} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{self._labels(labels)} {values[-1]}")
+            lines.append(
+                f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(),
+                 collect: Callable[[], Dict[Tuple, float]] = dict):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = super().render()
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{self._labels(labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(),
+                  buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), collect=dict) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, collect))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(
+            line for metric in self.metrics for line in metric.render()
+        ) + "\n"
+
+
+def _hit_ratio(counter: Counter, *served) -> Dict[Tuple, float]:
+    hits = sum(counter.value(result) for result in served)
+    lookups = hits + counter.value("misses")
+    return {(): hits / lookups} if lookups else {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r'\"') \
+        .replace("\n", r"\n")
+
+
+REGISTRY = Registry()
+
+MESSAGE_SECONDS = REGISTRY.histogram(
+    "allocation_message_seconds",
+    "Time spent handling a message on the bus, including its handlers",
+    ["kind", "message_type"],
+)
+MESSAGE_ERRORS = REGISTRY.counter(
+    "allocation_message_errors_total",
+    "Messages whose handling raised",
+    ["kind", "message_type"],
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    "allocation_handler_seconds",
+    "Time spent in one call of an injected handler",
+    ["handler"],
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "allocation_handler_errors_total",
+    "Handler calls that raised",
+    ["handler"],
+)
+HANDLER_RETRIES = REGISTRY.counter(
+    "allocation_handler_retries_total",
+    "Handler attempts retried by a retry policy",
+    ["handler"],
+)
+CASCADE_MESSAGES = REGISTRY.histogram(
+    "allocation_cascade_messages",
+    "Messages handled by one bus.handle call",
+    buckets=DEPTH_BUCKETS,
+)
+QUEUE_DEPTH = REGISTRY.histogram(
+    "allocation_queue_depth",
+    "Largest bus queue length seen during one bus.handle call",
+    buckets=DEPTH_BUCKETS,
+)
+UOW_SECONDS = REGISTRY.histogram(
+    "allocation_uow_seconds",
+    "Time spent committing or rolling back a unit of work",
+    ["operation"],
+)
+UOW_ERRORS = REGISTRY.counter(
+    "allocation_uow_errors_total",
+    "Unit of work commits or rollbacks that raised",
+    ["operation"],
+)
+PRODUCT_CACHE = REGISTRY.counter(
+    "allocation_product_cache_total",
+    "Product cache lookups by result, and evictions",
+    ["result"],
+)
+VIEW_CACHE = REGISTRY.counter(
+    "allocation_view_cache_total",
+    "Allocations view cache lookups by result, evictions and invalidations",
+    ["result"],
+)
+VIEW_CACHE_HIT_RATIO = REGISTRY.gauge(
+    "allocation_view_cache_hit_ratio",
+    "Share of allocations view lookups served from the cache",
+    collect=lambda: _hit_ratio(VIEW_CACHE, "hits", "coalesced"),
+)
+VIEW_CACHE_AGE_SECONDS = REGISTRY.histogram(
+    "allocation_view_cache_age_seconds",
+    "Age of the cached allocations view entries served on a hit",
+)
+OUTBOX_DEAD_LETTERS = REGISTRY.counter(
+    "allocation_outbox_dead_letters_total",
+    "Outbox rows set aside after failing every dispatch attempt",
+    ["event_type"],
+)
+ARCHIVED_BATCHES = REGISTRY.counter(
+    "allocation_archived_batches_total",
+    "Closed batches moved to the archive tables",
+)
+BATCHREF_INDEX = REGISTRY.counter(
+    "allocation_batchref_index_total",
+    "Batch reference to sku lookups by result",
+    ["result"],
+)
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "allocation_db_pool_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["engine"],
+)
+DB_POOL_TIMEOUTS = REGISTRY.counter(
+    "allocation_db_pool_timeouts_total",
+    "Pool checkouts that gave up after pool_timeout",
+    ["engine"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "allocation_http_request_seconds",
+    "Time spent serving an HTTP request",
+    ["method", "route", "status"],
+)
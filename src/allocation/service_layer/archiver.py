@@ -0,0 +1,51 @@
+from __future__ import annotations
+import logging
+import time
+from datetime import date
+from typing import TYPE_CHECKING, Callable, List
+
+from allocation import metrics
+from allocation.adapters import archive
+
+if TYPE_CHECKING:
+    from . import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+
+class BatchArchiver:
+    def __init__(self,
+                 uow: unit_of_work.SqlAlchemyUnitOfWork,
+                 chunk_size: int = 500,
+                 interval: float = 3600,
+                 today: Callable[[], date] = date.today,
+                 ):
+        self.uow = uow
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.today = today
+
+    def archive_once(self) -> List[str]:
+        with self.uow:
+            archived = archive.archive_closed_batches(
+                self.uow.session, self.today(), self.chunk_size)
+            self.uow.commit()
+        metrics.ARCHIVED_BATCHES.inc(amount=len(archived))
+        return archived
+
+    def archive_all(self) -> int:
+        total = 0
+        while True:
+            archived = self.archive_once()
+            total += len(archived)
+            if len(archived) < self.chunk_size:
+                return total
+
+    def run(self, should_stop: Callable[[], bool] = lambda: False):
+        while not should_stop():
+            try:
+                archived = self.archive_all()
+                logger.info("Archived %s closed batches", archived)
+            except Exception:
+                logger.exception("Exception archiving closed batches")
+            time.sleep(self.interval)
@@ -1,15 +1,18 @@
 from __future__ import annotations
 
+import itertools
+from collections import defaultdict
 from dataclasses import asdict
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable, List, Optional, Union
 
-from allocation.adapters import email, redis_eventpublisher
+from allocation.adapters import email, read_models
 from allocation.domain import events, commands
 from allocation.adapters import notifications
 
 from allocation.domain import model
 
 if TYPE_CHECKING:
+    from allocation import views
     from . import unit_of_work
 
 
@@ -17,6 +20,25 @@ class InvalidSku(Exception):
     pass
 
 
+class InvalidBatchref(Exception):
+    pass
+
+
+LOADING_PROFILES = {
+    commands.CreateBatch: "counts_only",
+    commands.Allocate: "counts_only",
+    commands.AllocateMany: "selectin",
+    commands.AllocateOrder: "selectin",
+    commands.ChangeBatchQuantity: "selectin",
+    commands.ShipBatch: "counts_only",
+}
+
+
+def batchable(handler):
+    handler.batchable = True
+    return handler
+
+
 def is_valid_sku(sku, batches):
     return sku in {b.sku for b in batches}
 
@@ -24,13 +46,15 @@ def is_valid_sku(sku, batches):
 def add_batch(cmd: commands.CreateBatch, uow: unit_of_work.AbstractUnitOfWork
               ) -> None:
     with uow:
-        product = uow.products.get(sku=cmd.sku)
+        product = uow.products.get(
+            sku=cmd.sku, loading=LOADING_PROFILES[commands.CreateBatch])
         if product is None:
             product = model.Product(cmd.sku, batches=[])
             uow.products.add(product)
-        product.batches.append(
+        product.add_batch(
             model.Batch(cmd.ref, cmd.sku, cmd.quantity, cmd.eta))
         uow.commit()
+        uow.products.remember_batchref(cmd.ref, cmd.sku)
 
 
 def allocate(
@@ -38,13 +62,63 @@ def allocate(
 ):
     line = model.OrderLine(cmd.order_id, cmd.sku, cmd.quantity)
     with uow:
-        product = uow.products.get(sku=line.sku)
+        product = uow.products.get(
+            sku=line.sku, loading=LOADING_PROFILES[commands.Allocate])
         if product is None:
             raise InvalidSku(f"Invalid sku {line.sku}")
         product.allocate(line)
         uow.commit()
 
 
+def allocate_many(
+        cmd: commands.AllocateMany, uow: unit_of_work.AbstractUnitOfWork
+) -> List[Optional[str]]:
+    lines = [
+        model.OrderLine(order_id, cmd.sku, quantity)
+        for order_id, quantity in cmd.lines
+    ]
+    with uow:
+        product = uow.products.get(
+            sku=cmd.sku, loading=LOADING_PROFILES[commands.AllocateMany])
+        if product is None:
+            raise InvalidSku(f"Invalid sku {cmd.sku}")
+        batchrefs = product.allocate_many(lines)
+        uow.commit()
+    return batchrefs
+
+
+def allocate_order(
+        cmd: commands.AllocateOrder, uow: unit_of_work.AbstractUnitOfWork
+) -> List[Optional[str]]:
+    # The order commits as a whole: an unknown or repeated sku rejects every
+    # line, and a version conflict on any product retries the entire order.
+    # Lines that are out of stock stay unallocated, as with Allocate.
+    lines = [
+        model.OrderLine(cmd.order_id, sku, quantity)
+        for sku, quantity in cmd.lines
+    ]
+    positions = defaultdict(list)
+    for position, line in enumerate(lines):
+        positions[line.sku].append(position)
+    repeated = sorted(sku for sku, at in positions.items() if len(at) > 1)
+    if repeated:
+        raise InvalidSku(f"Repeated sku {', '.join(repeated)}")
+    with uow:
+        products = uow.products.get_many(
+            positions, loading=LOADING_PROFILES[commands.AllocateOrder])
+        unknown = sorted(positions.keys() - products.keys())
+        if unknown:
+            raise InvalidSku(f"Invalid sku {', '.join(unknown)}")
+        batchrefs = [None] * len(lines)
+        for sku, sku_positions in positions.items():
+            allocated = products[sku].allocate_many(
+                [lines[position] for position in sku_positions])
+            for position, batchref in zip(sku_positions, allocated):
+                batchrefs[position] = batchref
+        uow.commit()
+    return batchrefs
+
+
 def reallocate(event: events.Deallocated, uow:unit_of_work.SqlAlchemyUnitOfWork):
     with uow:
         product = uow.products.get(sku=event.sku)
@@ -53,67 +127,94 @@ def reallocate(event: events.Deallocated, uow:unit_of_work.SqlAlchemyUnitOfWork)
 
 def change_batch_quantity(
         cmd: commands.ChangeBatchQuantity,
-        uow: unit_of_work.AbstractUnitOfWork
+        uow: unit_of_work.AbstractUnitOfWork,
+        deallocation_strategy: model.DeallocationStrategy,
 ):
     with uow:
-        product = uow.products.get_by_batchref(cmd.ref)
-        product.change_batch_quantity(ref=cmd.ref, quantity=cmd.quantity)
+        product = uow.products.get_by_batchref(
+            cmd.ref, loading=LOADING_PROFILES[commands.ChangeBatchQuantity])
+        product.change_batch_quantity(
+            ref=cmd.ref, quantity=cmd.quantity,
+            deallocation_strategy=deallocation_strategy,
+        )
+        uow.commit()
+
+
+def ship_batch(
+        cmd: commands.ShipBatch, uow: unit_of_work.AbstractUnitOfWork
+):
+    with uow:
+        product = uow.products.get_by_batchref(
+            cmd.ref, loading=LOADING_PROFILES[commands.ShipBatch])
+        if product is None:
+            raise InvalidBatchref(f"Invalid batch reference {cmd.ref}")
+        product.ship_batch(cmd.ref)
         uow.commit()
 
 
 def send_out_of_stock_notification(
         event: events.OutOfStock,
+        uow: unit_of_work.AbstractUnitOfWork,
         notifications: notifications.AbstractNotification
 ):
-    notifications.send(
+    uow.after_commit(lambda: notifications.send(
         "stock@made.com",
         f"Out of stock for {event.sku}"
-    )
+    ))
 
 
+@batchable
 def publish_allocated_event(
-        event: events.Allocated,
-        uow: unit_of_work.AbstractUnitOfWork
+        allocated: List[events.Allocated],
+        uow: unit_of_work.AbstractUnitOfWork,
+        publish: Callable,
 ):
-    redis_eventpublisher.publish("line_allocated", event)
+    uow.after_commit(lambda: publish("line_allocated", *allocated))
 
 
-def add_allocation_to_read_model(
-        event: events.Allocated,
-        uow: unit_of_work.AbstractUnitOfWork
+@batchable
+def update_allocations_view(
+        changes: List[Union[events.Allocated, events.Deallocated]],
+        uow: unit_of_work.AbstractUnitOfWork,
+        read_model: read_models.AbstractReadModel,
+        views_cache: Optional[views.AllocationsCache],
+        broadcast_view_invalidations: Optional[Callable],
 ):
-    with uow:
-        uow.session.execute(
-            "INSERT INTO allocations_view (orderid, sku, batchref)"
-            " VALUES (:orderid, :sku, :batchref)",
-            dict(orderid=event.order_id, sku=event.sku, batchref=event.batchref)
-        )
-        uow.commit()
+    for event_type, run in itertools.groupby(changes, type):
+        if event_type is events.Allocated:
+            read_model.add(uow, list(run))
+        else:
+            read_model.remove(uow, list(run))
+    order_ids = {event.order_id for event in changes}
 
+    def invalidate():
+        if views_cache is not None:
+            views_cache.invalidate_many(order_ids)
+        if broadcast_view_invalidations is not None:
+            broadcast_view_invalidations(order_ids)
+
+    uow.after_commit(invalidate)
 
-def remove_allocation_from_read_model(
-        event: events.Deallocated,
-        uow: unit_of_work.AbstractUnitOfWork
-):
-    with uow:
-        uow.session.execute(
-            "DELETE FROM  allocations_view WHERE orderid = :orderid AND sku = :sku",
-            dict(orderid=event.order_id, sku=event.sku)
-        )
-        uow.commit()
 
 EVENT_HANDLERS = {
     events.Allocated: [
         publish_allocated_event,
-        add_allocation_to_read_model],
+        update_allocations_view],
     events.Deallocated: [
-        remove_allocation_from_read_model,
+        update_allocations_view,
         reallocate
     ],
     events.OutOfStock: [send_out_of_stock_notification],
 }
+OUTBOX_HANDLERS = {
+    events.Allocated: publish_allocated_event,
+    events.OutOfStock: send_out_of_stock_notification,
+}
 COMMAND_HANDLERS = {
     commands.CreateBatch: add_batch,
     commands.ChangeBatchQuantity: change_batch_quantity,
     commands.Allocate: allocate,
+    commands.AllocateMany: allocate_many,
+    commands.AllocateOrder: allocate_order,
+    commands.ShipBatch: ship_batch,
 }
\ No newline at end of file
@@ -1,58 +1,263 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Union, List, Dict, Type, Callable
-from tenacity import Retrying, RetryError, stop_after_attempt, wait_exponential
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Union, List, Dict, Type, Callable, Tuple
+from tenacity import Retrying, stop_after_attempt, wait_exponential, \
+    retry_if_exception, retry_if_exception_type
+from allocation import metrics
 from allocation.domain import events, commands
 
 if TYPE_CHECKING:
     from . import unit_of_work
 
+logger = logging.getLogger(__name__)
+
 Message = Union[commands.Command, events.Event]
 
 
+class RetryPolicy:
+    def __init__(self,
+                 retryable: Tuple[Type[Exception], ...] = (Exception,),
+                 attempts: int = 3,
+                 wait=wait_exponential(),
+                 is_retryable: Callable[[BaseException], bool] = None,
+                 ):
+        self.retryable = retryable
+        self._retrying = Retrying(
+            stop=stop_after_attempt(attempts),
+            wait=wait,
+            retry=retry_if_exception(is_retryable) if is_retryable
+            else retry_if_exception_type(retryable),
+            before_sleep=self._count_retry,
+            reraise=True,
+        )
+
+    @staticmethod
+    def _count_retry(retry_state):
+        metrics.HANDLER_RETRIES.inc(
+            getattr(retry_state.fn, "__name__", repr(retry_state.fn)))
+
+    def wrap(self, handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def retrying_handler(message):
+            return self._retrying(handler, message)
+        return retrying_handler
+
+
+def is_batchable(handler: Callable) -> bool:
+    return getattr(handler, "batchable", False)
+
+
 class MessageBus:
     def __init__(self,
                  uow: unit_of_work.AbstractUnitOfWork,
                  event_handlers: Dict[Type[events.Event], List[Callable]],
                  command_handlers: Dict[
                      Type[commands.Command], Callable],
+                 cascade_transactions: bool = False,
+                 cascade_retry_policy: RetryPolicy = None,
                  ):
         self.uow = uow
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
-        self.queue = [None]
+        self.cascade_transactions = cascade_transactions
+        self.handle_cascade = cascade_retry_policy.wrap(self.handle_cascade) \
+            if cascade_retry_policy else self.handle_cascade
+        self.queue = deque()
+        self.batches = {}
 
     def handle(self, message: Message):
+        if self.cascade_transactions:
+            return self.handle_cascade(message)
+        return self._handle(message)
+
+    def handle_cascade(self, message: Message):
+        with self.uow.cascade():
+            return self._handle(message)
+
+    def _handle(self, message: Message):
         results = []
-        self.queue = [message]
-        while self.queue:
-            message = self.queue.pop(0)
-            if isinstance(message, events.Event):
-                self.handle_event(message)
-            elif isinstance(message, commands.Command):
-                cmd_result = self.handle_command(message)
-                results.append(cmd_result)
-            else:
-                raise Exception(f"{message} was not an Event or Command")
+        self.queue = deque([message])
+        self.batches = {}
+        handled = depth = 0
+        try:
+            while self.queue or self.batches:
+                if not self.queue:
+                    self.flush_batches()
+                    continue
+                depth = max(depth, len(self.queue))
+                message = self.queue.popleft()
+                handled += 1
+                if isinstance(message, events.Event):
+                    self.handle_event(message)
+                elif isinstance(message, commands.Command):
+                    cmd_result = self.handle_command(message)
+                    results.append(cmd_result)
+                else:
+                    raise Exception(f"{message} was not an Event or Command")
+        except Exception:
+            self.flush_batches()
+            raise
+        finally:
+            metrics.CASCADE_MESSAGES.observe(handled)
+            metrics.QUEUE_DEPTH.observe(depth)
         return results
 
     def handle_event(self, event: events.Event):
+        start = time.perf_counter()
         for handler in self.event_handlers[type(event)]:
+            if is_batchable(handler):
+                self.batches.setdefault(handler, []).append(event)
+                continue
+            try:
+                handler(event)
+                self.queue.extend(self.uow.collect_new_events())
+            except Exception:
+                metrics.MESSAGE_ERRORS.inc("event", type(event).__name__)
+                logger.exception("Exception handling event %s", event)
+                continue
+        metrics.MESSAGE_SECONDS.observe(
+            time.perf_counter() - start, "event", type(event).__name__)
+
+    def flush_batches(self):
+        batches, self.batches = self.batches, {}
+        for handler, batch in batches.items():
             try:
-                for attempt in Retrying(
-                        stop=stop_after_attempt(3),
-                        wait=wait_exponential()
-                ):
-                    with attempt:
-                        handler(event)
-                        self.queue.extend(self.uow.collect_new_events())
-            except RetryError as retry_failure:
+                handler(batch)
+                self.queue.extend(self.uow.collect_new_events())
+            except Exception:
+                logger.exception("Exception handling events %s", batch)
                 continue
 
     def handle_command(self, command: commands.Command):
+        start = time.perf_counter()
         try:
             handler = self.command_handlers[type(command)]
             result = handler(command)
             self.queue.extend(self.uow.collect_new_events())
             return result
         except Exception:
+            metrics.MESSAGE_ERRORS.inc("command", type(command).__name__)
+            raise
+        finally:
+            metrics.MESSAGE_SECONDS.observe(
+                time.perf_counter() - start, "command", type(command).__name__)
+
+
+class AsyncMessageBus:
+    def __init__(self,
+                 uow: unit_of_work.AbstractUnitOfWork,
+                 event_handlers: Dict[Type[events.Event], List[Callable]],
+                 command_handlers: Dict[
+                     Type[commands.Command], Callable],
+                 max_in_flight: int = 16,
+                 executor: Executor = None,
+                 ):
+        self.uow = uow
+        self.event_handlers = event_handlers
+        self.command_handlers = command_handlers
+        self.max_in_flight = max_in_flight
+        self.executor = executor or ThreadPoolExecutor(max_in_flight)
+        self._loop = None
+        self._in_flight = None
+
+    async def handle(self, message: Message):
+        results = []
+        queue, batches = deque([message]), {}
+        handled = depth = 0
+        try:
+            while queue or batches:
+                if not queue:
+                    await self.flush_batches(batches, queue)
+                    continue
+                depth = max(depth, len(queue))
+                message = queue.popleft()
+                handled += 1
+                if isinstance(message, events.Event):
+                    await self.handle_event(message, queue, batches)
+                elif isinstance(message, commands.Command):
+                    cmd_result = await self.handle_command(message, queue)
+                    results.append(cmd_result)
+                else:
+                    raise Exception(f"{message} was not an Event or Command")
+        except Exception:
+            await self.flush_batches(batches, queue)
             raise
+        finally:
+            metrics.CASCADE_MESSAGES.observe(handled)
+            metrics.QUEUE_DEPTH.observe(depth)
+        return results
+
+    async def handle_event(self, event: events.Event, queue: deque,
+                           batches: dict):
+        start = time.perf_counter()
+        handlers = []
+        for handler in self.event_handlers[type(event)]:
+            if is_batchable(handler):
+                batches.setdefault(handler, []).append(event)
+            else:
+                handlers.append(handler)
+        outcomes = await asyncio.gather(
+            *(self._run(handler, event) for handler in handlers),
+            return_exceptions=True,
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                metrics.MESSAGE_ERRORS.inc("event", type(event).__name__)
+                logger.error("Exception handling event %s", event,
+                             exc_info=outcome)
+                continue
+            _, new_events = outcome
+            queue.extend(new_events)
+        metrics.MESSAGE_SECONDS.observe(
+            time.perf_counter() - start, "event", type(event).__name__)
+
+    async def flush_batches(self, batches: dict, queue: deque):
+        pending = dict(batches)
+        batches.clear()
+        outcomes = await asyncio.gather(
+            *(self._run(handler, batch) for handler, batch in pending.items()),
+            return_exceptions=True,
+        )
+        for batch, outcome in zip(pending.values(), outcomes):
+            if isinstance(outcome, Exception):
+                logger.error("Exception handling events %s", batch,
+                             exc_info=outcome)
+                continue
+            _, new_events = outcome
+            queue.extend(new_events)
+
+    async def handle_command(self, command: commands.Command, queue: deque):
+        start = time.perf_counter()
+        try:
+            handler = self.command_handlers[type(command)]
+            result, new_events = await self._run(handler, command)
+        except Exception:
+            metrics.MESSAGE_ERRORS.inc("command", type(command).__name__)
+            raise
+        finally:
+            metrics.MESSAGE_SECONDS.observe(
+                time.perf_counter() - start, "command", type(command).__name__)
+        queue.extend(new_events)
+        return result
+
+    async def _run(self, handler: Callable, message: Message):
+        async with self._get_in_flight():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, self._call, handler, message)
+
+    def _call(self, handler: Callable, message: Message):
+        result = handler(message)
+        return result, list(self.uow.collect_new_events())
+
+    def _get_in_flight(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self._in_flight
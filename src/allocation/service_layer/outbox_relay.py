@@ -0,0 +1,92 @@
+from __future__ import annotations
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Type
+
+from allocation import metrics
+from allocation.adapters import outbox
+from allocation.domain import events
+from allocation.service_layer.messagebus import is_batchable
+
+if TYPE_CHECKING:
+    from . import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    def __init__(self,
+                 uow: unit_of_work.SqlAlchemyUnitOfWork,
+                 event_handlers: Dict[Type[events.Event], Callable],
+                 batch_size: int = 100,
+                 poll_interval: float = 1.0,
+                 max_attempts: int = 5,
+                 ):
+        self.uow = uow
+        self.event_handlers = event_handlers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+    def relay_once(self) -> int:
+        with self.uow:
+            rows = outbox.fetch(self.uow.session, self.batch_size)
+            if not rows:
+                return 0
+            batches = {}
+            for row in rows:
+                batches.setdefault(row.event_type, []).append(row)
+            failed = []
+            for batch in batches.values():
+                failed.extend(self.dispatch(batch))
+            failed_ids = {row.id for row in failed}
+            delivered = [row for row in rows if row.id not in failed_ids]
+            outbox.delete(self.uow.session, [row.id for row in delivered])
+            if failed:
+                self.record_failures(failed)
+            self.uow.commit()
+        return len(delivered)
+
+    def dispatch(self, rows: list) -> list:
+        handler = self.event_handlers.get(
+            outbox.EVENT_TYPES.get(rows[0].event_type))
+        if handler is None:
+            logger.error("No handler for %s outbox rows %s",
+                         rows[0].event_type, [row.id for row in rows])
+            return rows
+        if is_batchable(handler) and len(rows) > 1:
+            try:
+                handler([outbox.load(row) for row in rows])
+                return []
+            except Exception:
+                logger.exception(
+                    "Exception relaying %s %s events, retrying one by one",
+                    len(rows), rows[0].event_type)
+        failed = []
+        for row in rows:
+            try:
+                event = outbox.load(row)
+                handler([event] if is_batchable(handler) else event)
+            except Exception:
+                logger.exception("Exception relaying outbox row %s", row.id)
+                failed.append(row)
+        return failed
+
+    def record_failures(self, rows: list):
+        dead = outbox.record_failures(
+            self.uow.session, rows, self.max_attempts)
+        for row in rows:
+            if row.id in dead:
+                metrics.OUTBOX_DEAD_LETTERS.inc(row.event_type)
+                logger.error("Dead-lettered outbox row %s after %s attempts",
+                             row.id, self.max_attempts)
+
+    def run(self, should_stop: Callable[[], bool] = lambda: False):
+        while not should_stop():
+            try:
+                relayed = self.relay_once()
+            except Exception:
+                logger.exception("Exception relaying outbox")
+                relayed = 0
+            if relayed < self.batch_size:
+                time.sleep(self.poll_interval)
@@ -1,13 +1,21 @@
 from __future__ import annotations
 import abc
-
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from allocation import config
-from allocation.adapters import repository
+import contextlib
+import logging
+import threading
+import time
+from typing import Callable, Tuple, Type
+
+from sqlalchemy import exc
+from sqlalchemy.orm.exc import StaleDataError
+
+from allocation import metrics
+from allocation.adapters import engines, outbox, repository
+from allocation.domain import events
 from allocation.service_layer import messagebus
 
+logger = logging.getLogger(__name__)
+
 
 class AbstractUnitOfWork(abc.ABC):
     products: repository.AbstractRepository
@@ -21,10 +29,22 @@ class AbstractUnitOfWork(abc.ABC):
     def commit(self):
         self._commit()
 
+    def after_commit(self, callback: Callable[[], None]):
+        callback()
+
+    @contextlib.contextmanager
+    def cascade(self):
+        yield self
+
     def collect_new_events(self):
-        for product in self.products.seen:
+        products = getattr(self, "products", None)
+        if products is None:
+            return
+        for product in products.seen:
             while product.events:
-                yield product.events.pop(0)
+                new_events = list(product.events)
+                product.events.clear()
+                yield from new_events
 
     @abc.abstractmethod
     def _commit(self):
@@ -35,27 +55,178 @@ class AbstractUnitOfWork(abc.ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(config.get_postgres_uri(),
-                       isolation_level="REPEATABLE READ",
-                       ))
+DEFAULT_SESSION_FACTORY = engines.ENGINES.session_factory()
+
+SERIALIZATION_FAILURE = "40001"
+DEADLOCK_DETECTED = "40P01"
+
+
+def is_concurrency_conflict(error: BaseException) -> bool:
+    if isinstance(error, StaleDataError):
+        return True
+    return isinstance(error, exc.DBAPIError) and getattr(
+        error.orig, "pgcode", None) in (SERIALIZATION_FAILURE,
+                                        DEADLOCK_DETECTED)
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY,
+                 outbox_event_types: Tuple[Type[events.Event], ...] = (),
+                 product_cache: repository.ProductCache = None,
+                 batchref_index: repository.BatchrefIndex = None,
+                 numpy_engine_threshold: int = None):
         self.session_factory = session_factory
+        self.outbox_event_types = outbox_event_types
+        self.product_cache = product_cache
+        self.batchref_index = batchref_index
+        self.numpy_engine_threshold = numpy_engine_threshold
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        return self._local.session
+
+    @property
+    def products(self):
+        return getattr(self._local, "products", None)
+
+    @property
+    def savepoints(self):
+        return getattr(self._local, "savepoints", None)
+
+    @contextlib.contextmanager
+    def cascade(self):
+        if self.savepoints is not None:
+            yield self
+            return
+        self._begin()
+        self._local.savepoints = []
+        self._local.after_commit = []
+        try:
+            yield self
+            self._commit()
+            self._run_after_commit()
+        finally:
+            self._local.savepoints = None
+            self._local.after_commit = None
+            self.rollback()
+            self.session.close()
+
+    def after_commit(self, callback):
+        if self.savepoints is None:
+            callback()
+            return
+        self._local.after_commit.append(callback)
 
     def __enter__(self):
-        self.session = self.session_factory()
-        self.products = repository.SqlAlchemyRepository(self.session)
+        if self.savepoints is not None:
+            self.savepoints.append(self.session.begin_nested())
+            return self
+        self._begin()
         return super().__enter__()
 
     def __exit__(self, *args):
         super().__exit__(*args)
-        self.session.close()
+        if self.savepoints:
+            self.savepoints.pop()
+        else:
+            self.session.close()
+
+    def _begin(self):
+        self._local.session = self.session_factory()
+        self._local.products = repository.SqlAlchemyRepository(
+            self.session, cache=self.product_cache,
+            batchrefs=self.batchref_index,
+            numpy_engine_threshold=self.numpy_engine_threshold)
+        self._local.outboxed = {}
+        self._local.released_events = []
+        if self.product_cache is not None:
+            self.session.expire_on_commit = False
 
     def _commit(self):
-        self.session.commit()
+        if self.savepoints:
+            self._release_savepoint()
+            return
+        start = time.perf_counter()
+        try:
+            if self.outbox_event_types:
+                self._add_to_outbox()
+            self.session.commit()
+            if self.product_cache is not None:
+                self._release_products()
+        except Exception:
+            metrics.UOW_ERRORS.inc("commit")
+            raise
+        finally:
+            metrics.UOW_SECONDS.observe(time.perf_counter() - start, "commit")
+
+    def _run_after_commit(self):
+        errors = []
+        for callback in self._local.after_commit:
+            try:
+                callback()
+            except Exception as e:
+                logger.exception("Exception running after commit %s", callback)
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def collect_new_events(self):
+        released = getattr(self._local, "released_events", None)
+        if released:
+            self._local.released_events = []
+            yield from released
+        yield from super().collect_new_events()
+
+    def _release_products(self):
+        for product in self.products.seen:
+            self._local.released_events.extend(product.events)
+            product.events.clear()
+        self.products.release()
+
+    def _add_to_outbox(self):
+        pending = [
+            event
+            for product in self.products.seen
+            for event in product.events
+            if isinstance(event, self.outbox_event_types)
+            and id(event) not in self._local.outboxed
+        ]
+        # Keep the events themselves so their ids are not reused while
+        # the session is open.
+        self._local.outboxed.update((id(event), event) for event in pending)
+        outbox.add(self.session, pending)
+
+    def _release_savepoint(self):
+        start = time.perf_counter()
+        if self.outbox_event_types:
+            self._add_to_outbox()
+        self.savepoints[-1].commit()
+        metrics.UOW_SECONDS.observe(
+            time.perf_counter() - start, "release_savepoint")
+
+    def _rollback_savepoint(self):
+        savepoint = self.savepoints[-1]
+        if not savepoint.is_active:
+            return
+        start = time.perf_counter()
+        savepoint.rollback()
+        for product in self.products.seen:
+            product.events.clear()
+            self.products.reset_indexes(product)
+        metrics.UOW_SECONDS.observe(
+            time.perf_counter() - start, "rollback_savepoint")
 
     def rollback(self):
-        self.session.rollback()
+        if self.savepoints:
+            self._rollback_savepoint()
+            return
+        start = time.perf_counter()
+        try:
+            self.session.rollback()
+        except Exception:
+            metrics.UOW_ERRORS.inc("rollback")
+            raise
+        finally:
+            metrics.UOW_SECONDS.observe(
+                time.perf_counter() - start, "rollback")
@@ -1,12 +1,172 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from allocation import metrics
+from allocation.adapters import read_models
 from allocation.service_layer import unit_of_work
 
+DEFAULT_READ_MODEL = read_models.SqlAlchemyReadModel()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.invalidated = False
+        self.result = None
+        self.error = None
+
+
+class AllocationsCache:
+    def __init__(self, maxsize: int = 10_000, ttl: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, order_id, load: Callable[[], List[dict]]
+                    ) -> List[dict]:
+        return self.get_many_or_load(
+            [order_id], lambda order_ids: {order_id: load()})[order_id]
+
+    def get_many_or_load(
+            self, order_ids: Iterable,
+            load_many: Callable[[List], Dict[str, List[dict]]],
+    ) -> Dict[str, List[dict]]:
+        order_ids = list(dict.fromkeys(order_ids))
+        found, waiting, leading = {}, {}, {}
+        with self._lock:
+            for order_id in order_ids:
+                result = self._lookup(order_id)
+                if result is not None:
+                    found[order_id] = result
+                elif order_id in self._flights:
+                    waiting[order_id] = self._flights[order_id]
+                    metrics.VIEW_CACHE.inc("coalesced")
+                else:
+                    leading[order_id] = self._flights[order_id] = _Flight()
+                    metrics.VIEW_CACHE.inc("misses")
+        if leading:
+            found.update(self._lead(leading, load_many))
+        for order_id, flight in waiting.items():
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            found[order_id] = flight.result
+        return {order_id: found[order_id] for order_id in order_ids}
+
+    def _lookup(self, order_id) -> Optional[List[dict]]:
+        entry = self._entries.get(order_id)
+        if entry is None:
+            return None
+        result, loaded_at = entry
+        age = self.clock() - loaded_at
+        if age >= self.ttl:
+            del self._entries[order_id]
+            metrics.VIEW_CACHE.inc("expired")
+            return None
+        self._entries.move_to_end(order_id)
+        metrics.VIEW_CACHE.inc("hits")
+        metrics.VIEW_CACHE_AGE_SECONDS.observe(age)
+        return result
+
+    def _lead(self, flights: Dict[str, _Flight], load_many):
+        loaded_at = self.clock()
+        error = None
+        try:
+            loaded = load_many(list(flights))
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            with self._lock:
+                for order_id, flight in flights.items():
+                    del self._flights[order_id]
+                    if error is not None:
+                        flight.error = error
+                        continue
+                    flight.result = loaded.get(order_id, [])
+                    if not flight.invalidated:
+                        self._store(order_id, flight.result, loaded_at)
+            for flight in flights.values():
+                flight.done.set()
+        return {order_id: flights[order_id].result for order_id in flights}
+
+    def invalidate_many(self, order_ids: Iterable[str]):
+        with self._lock:
+            for order_id in order_ids:
+                self._entries.pop(order_id, None)
+                flight = self._flights.get(order_id)
+                if flight is not None:
+                    flight.invalidated = True
+                metrics.VIEW_CACHE.inc("invalidated")
+
+    def invalidate(self, order_id):
+        self.invalidate_many([order_id])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for flight in self._flights.values():
+                flight.invalidated = True
+
+    def _store(self, order_id, result, loaded_at):
+        self._entries[order_id] = (result, loaded_at)
+        self._entries.move_to_end(order_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            metrics.VIEW_CACHE.inc("evicted")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def allocations(order_id: int, uow: unit_of_work.SqlAlchemyUnitOfWork,
+                cache: AllocationsCache = None,
+                read_model: read_models.AbstractReadModel = None):
+    read_model = read_model or DEFAULT_READ_MODEL
+    if cache is not None:
+        return cache.get_or_load(
+            order_id, lambda: read_model.allocations(uow, order_id))
+    return read_model.allocations(uow, order_id)
+
+
+def allocations_for_orders(
+        order_ids: Iterable, uow: unit_of_work.SqlAlchemyUnitOfWork,
+        cache: AllocationsCache = None,
+        read_model: read_models.AbstractReadModel = None,
+        chunk_size: int = 500,
+) -> Dict[str, List[dict]]:
+    read_model = read_model or DEFAULT_READ_MODEL
+
+    def load_many(missing):
+        return read_model.allocations_many(uow, missing, chunk_size)
+
+    if cache is not None:
+        return cache.get_many_or_load(order_ids, load_many)
+    return load_many(list(dict.fromkeys(order_ids)))
+
 
-def allocations(order_id:int, uow: unit_of_work.SqlAlchemyUnitOfWork):
+def allocation_history(order_id: int, uow: unit_of_work.SqlAlchemyUnitOfWork):
     with uow:
         results = uow.session.execute(
             """
-            SELECT sku, batchref FROM allocations_view WHERE orderid = :order_id
+            SELECT ol.sku, b.reference AS batchref, ol.quantity,
+                   0 AS archived
+            FROM allocations AS a
+            JOIN order_lines AS ol ON ol.id = a.order_line_id
+            JOIN batches AS b ON b.id = a.batch_id
+            WHERE ol.order_id = :order_id
+            UNION ALL
+            SELECT aa.sku, ab.reference, aa.quantity, 1
+            FROM archived_allocations AS aa
+            JOIN archived_batches AS ab ON ab.id = aa.batch_id
+            WHERE aa.order_id = :order_id
             """,
             dict(order_id=order_id),
         )
-        return [dict(r) for r in results]
\ No newline at end of file
+        return [dict(r, archived=bool(r.archived)) for r in results]
@@ -0,0 +1,63 @@
+import timeit
+from datetime import date, timedelta
+
+from allocation.domain import allocation_order
+from allocation.domain.model import Batch, OrderLine, Product
+
+BATCH_COUNTS = [100, 1_000, 5_000, 20_000]
+ALLOCATIONS = 200
+
+
+# Thousands of open batches whose leftovers are too small for the incoming
+# lines: the python engine walks every fragment, numpy compares them at once.
+def product_with_open_batches(count, threshold):
+    start = date(2011, 1, 1)
+    batches = [
+        Batch(f"batch-{i}", "SKU",
+              quantity=ALLOCATIONS * 10 if i == count - 1 else 1 + i % 4,
+              eta=start + timedelta(days=i))
+        for i in range(count)
+    ]
+    product = Product("SKU", batches)
+    product.numpy_engine_threshold = threshold
+    return product
+
+
+def lines():
+    return [OrderLine(f"order-{i}", "SKU", 5 + i % 5) for i in range(ALLOCATIONS)]
+
+
+def time_single(count, threshold):
+    product = product_with_open_batches(count, threshold)
+    product._get_allocation_order()
+    todo = lines()
+    return timeit.timeit(
+        lambda: [product.allocate(line) for line in todo], number=1
+    ) / ALLOCATIONS * 1e6
+
+
+def time_bulk(count, threshold):
+    product = product_with_open_batches(count, threshold)
+    product._get_allocation_order()
+    todo = lines()
+    return timeit.timeit(
+        lambda: product.allocate_many(todo), number=1) / ALLOCATIONS * 1e6
+
+
+def main():
+    if allocation_order.numpy is None:
+        print("numpy is not installed, only the python engine is available")
+        return
+    python, vectorised = 10 ** 9, 0
+    print(f"{'batches':>8} {'python us':>10} {'numpy us':>10}"
+          f" {'python bulk':>12} {'numpy bulk':>12}  (per line)")
+    for count in BATCH_COUNTS:
+        print(f"{count:>8}"
+              f" {time_single(count, python):>10.1f}"
+              f" {time_single(count, vectorised):>10.1f}"
+              f" {time_bulk(count, python):>12.1f}"
+              f" {time_bulk(count, vectorised):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import timeit
+from datetime import date, timedelta
+
+from allocation.domain.model import Batch, OrderLine, Product
+
+BATCH_COUNTS = [10, 100, 1_000, 5_000]
+ALLOCATIONS = 200
+
+
+def sorted_allocate(product, line):
+    batch = next(
+        (b for b in sorted(product.batches) if b.can_allocate(line)), None)
+    if batch is not None:
+        batch.allocate(line)
+
+
+def mostly_full_product(count):
+    start = date(2011, 1, 1)
+    batches = [
+        Batch(f"batch-{i}", "SKU", quantity=ALLOCATIONS + 1 if i == count - 1 else 1,
+              eta=start + timedelta(days=i))
+        for i in range(count)
+    ]
+    product = Product("SKU", batches)
+    for i in range(count - 1):
+        product.allocate(OrderLine(f"fill-{i}", "SKU", 1))
+    return product
+
+
+def time_allocations(allocate, count):
+    product = mostly_full_product(count)
+    lines = [OrderLine(f"order-{i}", "SKU", 1) for i in range(ALLOCATIONS)]
+
+    def run():
+        for line in lines:
+            allocate(product, line)
+
+    return timeit.timeit(run, number=1) / ALLOCATIONS * 1e6
+
+
+def main():
+    print(f"{'batches':>8} {'sorted us':>12} {'indexed us':>12} {'speedup':>8}")
+    for count in BATCH_COUNTS:
+        legacy = time_allocations(sorted_allocate, count)
+        indexed = time_allocations(Product.allocate, count)
+        print(f"{count:>8} {legacy:>12.1f} {indexed:>12.1f} {legacy / indexed:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
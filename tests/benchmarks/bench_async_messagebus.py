@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from allocation import bootstrap
+from allocation.adapters import notifications
+from allocation.domain import commands
+from tests.fakes import FakeUnitOfWork
+
+REDIS_LATENCY = 0.02
+DATABASE_LATENCY = 0.02
+SMTP_LATENCY = 0.05
+COMMANDS = 20
+
+
+class SlowSession:
+    def execute(self, *args, **kwargs):
+        time.sleep(DATABASE_LATENCY)
+
+
+class SlowSessionUnitOfWork(FakeUnitOfWork):
+    session = SlowSession()
+
+
+class SlowNotifications(notifications.AbstractNotification):
+    def send(self, destination, message):
+        time.sleep(SMTP_LATENCY)
+
+
+def slow_publish(channel, *events):
+    time.sleep(REDIS_LATENCY)
+
+
+def build_bus(asynchronous):
+    return bootstrap.bootstrap(
+        start_orm=False,
+        uow=SlowSessionUnitOfWork(),
+        notifications=SlowNotifications(),
+        publish=slow_publish,
+        asynchronous=asynchronous,
+    )
+
+
+def allocation_commands():
+    yield commands.CreateBatch("batch", "SKU", COMMANDS // 2, None)
+    for i in range(COMMANDS):
+        yield commands.Allocate(f"order-{i}", "SKU", 1)
+
+
+def sync_latency_ms():
+    bus = build_bus(asynchronous=False)
+    timings = []
+    for command in allocation_commands():
+        start = time.perf_counter()
+        bus.handle(command)
+        timings.append(time.perf_counter() - start)
+    return sum(timings[1:]) / COMMANDS * 1000
+
+
+async def async_latency_ms():
+    bus = build_bus(asynchronous=True)
+    timings = []
+    for command in allocation_commands():
+        start = time.perf_counter()
+        await bus.handle(command)
+        timings.append(time.perf_counter() - start)
+    return sum(timings[1:]) / COMMANDS * 1000
+
+
+def main():
+    print(f"simulated latency: redis {REDIS_LATENCY * 1000:.0f}ms,"
+          f" database {DATABASE_LATENCY * 1000:.0f}ms,"
+          f" smtp {SMTP_LATENCY * 1000:.0f}ms")
+    print("half the allocations succeed, half run out of stock")
+    print(f"MessageBus      {sync_latency_ms():6.1f} ms per command")
+    print(f"AsyncMessageBus {asyncio.run(async_latency_ms()):6.1f} ms per command")
+
+
+if __name__ == "__main__":
+    main()
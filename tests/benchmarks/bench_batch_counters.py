@@ -0,0 +1,44 @@
+import timeit
+
+from allocation.domain.model import Batch, OrderLine
+
+LINE_COUNTS = [10, 100, 1_000, 10_000, 50_000]
+REPEAT = 2_000
+
+
+def summed_can_allocate(batch, line):
+    allocated = sum(l.quantity for l in batch._allocations)
+    return batch._purchased_quantity - allocated >= line.quantity
+
+
+def batch_with_lines(count):
+    batch = Batch("batch", "SKU", quantity=count + REPEAT, eta=None)
+    for i in range(count):
+        batch.allocate(OrderLine(f"order-{i}", "SKU", 1))
+    return batch
+
+
+def per_call_us(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print(f"{'lines':>8} {'counter us':>12} {'summing us':>12}")
+    probe = OrderLine("probe", "SKU", 1)
+    for count in LINE_COUNTS:
+        batch = batch_with_lines(count)
+
+        def allocate_and_release():
+            batch.allocate(probe)
+            batch.deallocate(probe)
+
+        counter = per_call_us(allocate_and_release, REPEAT)
+        summing = per_call_us(
+            lambda: summed_can_allocate(batch, probe),
+            max(1, REPEAT * 10 // count),
+        )
+        print(f"{count:>8} {counter:>12.2f} {summing:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
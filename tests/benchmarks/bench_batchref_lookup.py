@@ -0,0 +1,89 @@
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from allocation.adapters import orm, repository
+from allocation.domain import model
+
+SKUS = 2000
+BATCHES_PER_SKU = 25
+LOOKUPS = 2000
+
+
+def populate(engine):
+    orm.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(orm.products.insert(), [
+            dict(sku=f"SKU-{s}", version_number=0) for s in range(SKUS)])
+        connection.execute(orm.batches.insert(), [
+            dict(reference=f"batch-{s}-{b}", sku=f"SKU-{s}",
+                 _purchased_quantity=100)
+            for s in range(SKUS) for b in range(BATCHES_PER_SKU)
+        ])
+
+
+def time_lookups(session, refs, lookup):
+    start = time.perf_counter()
+    for ref in refs:
+        lookup(ref)
+        session.expunge_all()
+    return (time.perf_counter() - start) / len(refs) * 1e6
+
+
+def joined_lookup(session):
+    return lambda ref: session.query(model.Product).join(model.Batch).filter(
+        orm.batches.c.reference == ref).first()
+
+
+def sku_lookup(session):
+    return lambda ref: session.execute(
+        select(orm.batches.c.sku)
+        .where(orm.batches.c.reference == ref).limit(1)).scalar()
+
+
+def main():
+    random.seed(0)
+    refs = [f"batch-{random.randrange(SKUS)}-{random.randrange(BATCHES_PER_SKU)}"
+            for _ in range(LOOKUPS)]
+    orm.start_mappers()
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{Path(directory) / 'batches.db'}")
+        populate(engine)
+        session = sessionmaker(bind=engine)()
+        batchrefs = repository.BatchrefIndex()
+        warm = repository.SqlAlchemyRepository(session, batchrefs=batchrefs)
+        for s in range(SKUS):
+            warm.get(f"SKU-{s}", loading="selectin")
+        session.expunge_all()
+        indexed = {
+            "join": time_lookups(session, refs, joined_lookup(session)),
+            "sku": time_lookups(session, refs, sku_lookup(session)),
+            "map": time_lookups(session, refs, batchrefs.get),
+            "get_by_batchref": time_lookups(
+                session, refs, lambda ref: repository.SqlAlchemyRepository(
+                    session).get_by_batchref(ref, loading="selectin")),
+            "get_by_batchref+map": time_lookups(
+                session, refs, lambda ref: repository.SqlAlchemyRepository(
+                    session, batchrefs=batchrefs).get_by_batchref(
+                    ref, loading="selectin")),
+        }
+        session.execute("DROP INDEX ix_batches_reference")
+        unindexed = {
+            "join": time_lookups(session, refs, joined_lookup(session)),
+            "sku": time_lookups(session, refs, sku_lookup(session)),
+        }
+    clear_mappers()
+    print(f"{SKUS * BATCHES_PER_SKU} batches across {SKUS} skus")
+    print(f"{'lookup':>20} {'no index µs':>12} {'indexed µs':>11}")
+    for name, micros in indexed.items():
+        before = f"{unindexed[name]:>12.1f}" if name in unindexed \
+            else f"{'-':>12}"
+        print(f"{name:>20} {before} {micros:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
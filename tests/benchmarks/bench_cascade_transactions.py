@@ -0,0 +1,81 @@
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from allocation import bootstrap
+from allocation.adapters import orm
+from allocation.domain import commands
+from allocation.service_layer import unit_of_work
+from tests.fakes import FakeNotifications
+
+REQUESTS = 200
+
+
+def file_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def let_sqlalchemy_emit_begin(dbapi_connection, _):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    orm.metadata.create_all(engine)
+    return engine
+
+
+def run(cascade_transactions, directory):
+    engine = file_engine(Path(directory) / f"cascade-{cascade_transactions}.db")
+    commits = []
+    event.listen(engine, "commit", lambda connection: commits.append(1))
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine)),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+        cascade_transactions=cascade_transactions,
+    )
+    bus.handle(commands.CreateBatch("spare", "SKU", 10 ** 9, None))
+    results = {}
+    for i in range(REQUESTS):
+        bus.handle(commands.CreateBatch(f"small-{i}", "OTHER", 10, None))
+        bus.handle(commands.Allocate(f"big-{i}", "OTHER", 10))
+    bus.handle(commands.CreateBatch("other-spare", "OTHER", 10 ** 9, None))
+    for name, make_command in [
+        ("allocate", lambda i: commands.Allocate(f"order-{i}", "SKU", 1)),
+        ("add_batch", lambda i: commands.CreateBatch(
+            f"batch-{i}", "SKU", 10, None)),
+        ("reallocate", lambda i: commands.ChangeBatchQuantity(
+            f"small-{i}", 5)),
+    ]:
+        commits.clear()
+        latencies = []
+        for i in range(REQUESTS):
+            start = time.perf_counter()
+            bus.handle(make_command(i))
+            latencies.append(time.perf_counter() - start)
+        results[name] = (len(commits) / REQUESTS,
+                         statistics.mean(latencies) * 1000)
+    clear_mappers()
+    return results
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        per_handler = run(False, directory)
+        cascade = run(True, directory)
+    print(f"{'command':>11} {'commits/req':>12} {'cascade':>8}"
+          f" {'ms/req':>8} {'cascade':>8}")
+    for name in per_handler:
+        print(f"{name:>11} {per_handler[name][0]:>12.1f} {cascade[name][0]:>8.1f}"
+              f" {per_handler[name][1]:>8.2f} {cascade[name][1]:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, clear_mappers
+from tenacity import wait_random_exponential
+
+from allocation import bootstrap, metrics
+from allocation.adapters import orm
+from allocation.domain import commands
+from allocation.service_layer import messagebus, unit_of_work
+
+THREAD_COUNTS = [1, 2, 4, 8]
+ALLOCATIONS_PER_THREAD = 100
+
+
+def run(thread_count, directory):
+    engine = create_engine(
+        f"sqlite:///{Path(directory) / f'contention-{thread_count}.db'}",
+        connect_args={"timeout": 30},
+    )
+    orm.metadata.create_all(engine)
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine)),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        command_retry_policy=messagebus.RetryPolicy(
+            attempts=100,
+            wait=wait_random_exponential(multiplier=0.001, max=0.05),
+            is_retryable=unit_of_work.is_concurrency_conflict,
+        ),
+    )
+    bus.handle(commands.CreateBatch("batch", "SKU", 10 ** 9, None))
+    retries_before = metrics.HANDLER_RETRIES.value("allocate")
+
+    def allocate(thread):
+        for i in range(ALLOCATIONS_PER_THREAD):
+            bus.handle(commands.Allocate(f"order-{thread}-{i}", "SKU", 1))
+
+    threads = [threading.Thread(target=allocate, args=(t,))
+               for t in range(thread_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    [[allocated]] = engine.execute("SELECT COUNT(*) FROM allocations")
+    clear_mappers()
+    total = thread_count * ALLOCATIONS_PER_THREAD
+    assert allocated == total, f"lost {total - allocated} allocations"
+    retries = metrics.HANDLER_RETRIES.value("allocate") - retries_before
+    return total / elapsed, retries
+
+
+def main():
+    print(f"{'threads':>8} {'allocations/s':>14} {'conflict retries':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        for thread_count in THREAD_COUNTS:
+            throughput, retries = run(thread_count, directory)
+            print(f"{thread_count:>8} {throughput:>14,.0f} {retries:>17,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import random
+
+from allocation.domain.model import (
+    Batch, OrderLine, Product, DEALLOCATION_STRATEGIES
+)
+
+LINE_COUNT = 2_000
+REDUCTIONS = [0.01, 0.05, 0.2, 0.5]
+TRIALS = 20
+
+
+def full_batch(rng):
+    quantities = [rng.choice([1, 1, 1, 2, 3, 5, 10, 25, 50])
+                  for _ in range(LINE_COUNT)]
+    batch = Batch("batch", "SKU", sum(quantities), eta=None)
+    for i, quantity in enumerate(quantities):
+        batch.allocate(OrderLine(f"order-{i}", "SKU", quantity))
+    return batch
+
+
+def evictions(name, reduction, seed):
+    batch = full_batch(random.Random(seed))
+    product = Product("SKU", [batch])
+    new_quantity = int(batch._purchased_quantity * (1 - reduction))
+    product.change_batch_quantity(
+        "batch", new_quantity,
+        deallocation_strategy=DEALLOCATION_STRATEGIES[name])
+    return len(product.events), sum(e.quantity for e in product.events)
+
+
+def main():
+    names = list(DEALLOCATION_STRATEGIES)
+    print(f"{'reduction':>10}" + "".join(
+        f" {name + ' lines/qty':>24}" for name in names))
+    for reduction in REDUCTIONS:
+        row = f"{reduction:>10.0%}"
+        for name in names:
+            results = [evictions(name, reduction, seed) for seed in range(TRIALS)]
+            lines = sum(r[0] for r in results) / TRIALS
+            quantity = sum(r[1] for r in results) / TRIALS
+            row += f" {f'{lines:.1f} / {quantity:.1f}':>24}"
+        print(row)
+    print("('any' pops lines in set order, as deallocate_one used to)")
+
+
+if __name__ == "__main__":
+    main()
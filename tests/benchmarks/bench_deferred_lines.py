@@ -0,0 +1,56 @@
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from allocation import bootstrap
+from allocation.adapters import migrations
+from allocation.domain import commands
+from allocation.service_layer import handlers, unit_of_work
+from tests.fakes import FakeNotifications
+
+LINE_COUNTS = [100, 1_000, 10_000]
+BATCHES = 20
+ALLOCATIONS = 100
+
+
+def run(loading, line_count, directory):
+    engine = create_engine(
+        f"sqlite:///{Path(directory) / f'lines-{loading}-{line_count}.db'}")
+    migrations.migrate(engine)
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine)),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+    )
+    for i in range(BATCHES):
+        bus.handle(commands.CreateBatch(f"batch-{i}", "SKU", 10 ** 6, None))
+    bus.handle(commands.AllocateMany(
+        "SKU", [(f"old-{i}", 1) for i in range(line_count)]))
+    latencies = []
+    with mock.patch.dict(handlers.LOADING_PROFILES,
+                         {commands.Allocate: loading}):
+        for i in range(ALLOCATIONS):
+            start = time.perf_counter()
+            bus.handle(commands.Allocate(f"new-{i}", "SKU", 1))
+            latencies.append(time.perf_counter() - start)
+    clear_mappers()
+    return statistics.median(latencies) * 1000
+
+
+def main():
+    print(f"{'lines':>8} {'selectin ms':>12} {'deferred ms':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in LINE_COUNTS:
+            selectin = run("selectin", count, directory)
+            deferred = run("counts_only", count, directory)
+            print(f"{count:>8} {selectin:>12.2f} {deferred:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import time
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from allocation import bootstrap
+from allocation.adapters import orm
+from allocation.domain import commands
+from allocation.service_layer import messagebus, unit_of_work
+
+LINE_COUNTS = [100, 1_000, 5_000]
+
+
+class UnbatchedMessageBus(messagebus.MessageBus):
+    def handle_event(self, event):
+        for handler in self.event_handlers[type(event)]:
+            try:
+                handler([event] if messagebus.is_batchable(handler) else event)
+                self.queue.extend(self.uow.collect_new_events())
+            except Exception:
+                continue
+
+
+def run(batched, line_count):
+    engine = create_engine("sqlite://")
+    orm.metadata.create_all(engine)
+    statements, publishes = [], []
+    event.listen(engine, "before_cursor_execute",
+                 lambda *args: statements.append(args[2]))
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine)),
+        notifications=mock.Mock(),
+        publish=lambda channel, *events: publishes.append(len(events)),
+    )
+    if not batched:
+        bus.__class__ = UnbatchedMessageBus
+    bus.handle(commands.CreateBatch("batch", "SKU", 10 ** 9, None))
+    statements.clear()
+    start = time.perf_counter()
+    bus.handle(commands.AllocateMany(
+        "SKU", [(f"order-{i}", 1) for i in range(line_count)]))
+    elapsed = time.perf_counter() - start
+    clear_mappers()
+    read_model = sum(1 for s in statements if "allocations_view" in s)
+    return elapsed, read_model, len(publishes)
+
+
+def main():
+    print(f"{'lines':>6} {'mode':>10} {'seconds':>8}"
+          f" {'view stmts':>11} {'publish calls':>14}")
+    for line_count in LINE_COUNTS:
+        for batched in (False, True):
+            elapsed, read_model, publishes = run(batched, line_count)
+            print(f"{line_count:>6} {'batched' if batched else 'per event':>10}"
+                  f" {elapsed:>8.3f} {read_model:>11} {publishes:>14}")
+
+
+if __name__ == "__main__":
+    main()
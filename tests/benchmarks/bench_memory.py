@@ -0,0 +1,105 @@
+import gc
+import tracemalloc
+from dataclasses import make_dataclass
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from allocation.adapters import orm, repository
+from allocation.domain import commands, events, model
+from allocation.domain.slots import slotted
+
+COUNT = 20_000
+LINES_PER_PRODUCT = 5_000
+
+
+def bytes_per_instance(factory, count=COUNT):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    instances = [factory(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    del instances
+    return allocated / count
+
+
+def with_dict(cls):
+    return make_dataclass(
+        cls.__name__, [(f, object) for f in cls.__dataclass_fields__])
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    del kept
+    return allocated
+
+
+def product_with_lines(line_cls):
+    product = model.Product("SKU", [model.Batch("batch", "SKU", 10 ** 9, None)])
+    for i in range(LINES_PER_PRODUCT):
+        product.allocate(line_cls(f"order-{i}", "SKU", 1))
+    return product
+
+
+def product_database():
+    engine = create_engine("sqlite://")
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    session_factory = sessionmaker(bind=engine)
+    session = session_factory()
+    session.add(product_with_lines(model.OrderLine))
+    session.commit()
+    session.close()
+    return session_factory
+
+
+def load_product(session_factory):
+    session = session_factory()
+    product = session.query(model.Product).options(
+        *repository.loading_options("selectin")).first()
+    return session, product
+
+
+def main():
+    print(f"{'instance':>22} {'dict bytes':>12} {'slots bytes':>12}")
+    samples = [
+        (commands.Allocate, lambda cls, i: cls(f"order-{i}", "SKU", 1)),
+        (events.Allocated, lambda cls, i: cls(f"order-{i}", "SKU", 1, "batch")),
+        (events.Deallocated, lambda cls, i: cls(f"order-{i}", "SKU", 1)),
+    ]
+    for cls, build in samples:
+        legacy = with_dict(cls)
+        print(f"{cls.__name__:>22}"
+              f" {bytes_per_instance(lambda i: build(legacy, i)):>12.0f}"
+              f" {bytes_per_instance(lambda i: build(cls, i)):>12.0f}")
+    slotted_line = slotted(model.OrderLine)
+    print(f"{'OrderLine (unmapped)':>22}"
+          f" {bytes_per_instance(lambda i: model.OrderLine(f'order-{i}', 'SKU', 1)):>12.0f}"
+          f" {bytes_per_instance(lambda i: slotted_line(f'order-{i}', 'SKU', 1)):>12.0f}")
+
+    unmapped = measure(lambda: product_with_lines(model.OrderLine))
+    unmapped_slots = measure(lambda: product_with_lines(slotted_line))
+    session_factory = product_database()
+    loaded = measure(lambda: load_product(session_factory))
+    clear_mappers()
+    print()
+    print(f"Product with {LINES_PER_PRODUCT} lines:")
+    for label, allocated in [
+        ("unmapped, dict lines", unmapped),
+        ("unmapped, slotted lines", unmapped_slots),
+        ("loaded, dict lines", loaded),
+    ]:
+        print(f"  {label:>24}: {allocated:>10} bytes"
+              f" ({allocated / LINES_PER_PRODUCT:.0f}/line)")
+
+
+if __name__ == "__main__":
+    main()
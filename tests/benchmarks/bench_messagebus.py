@@ -0,0 +1,97 @@
+import time
+
+from tenacity import Retrying, RetryError, stop_after_attempt, wait_exponential
+
+from allocation import bootstrap
+from allocation.domain import commands, events
+from allocation.service_layer import messagebus
+from tests.fakes import FakeUnitOfWork, FakeNotifications
+
+LINE_COUNTS = [1_000, 10_000, 50_000]
+
+
+class FakeSession:
+    def execute(self, *args, **kwargs):
+        pass
+
+
+class FakeSessionUnitOfWork(FakeUnitOfWork):
+    session = FakeSession()
+
+
+class LegacyFakeUnitOfWork(FakeSessionUnitOfWork):
+    def collect_new_events(self):
+        for product in self.products.seen:
+            while product.events:
+                yield product.events.pop(0)
+
+
+class LegacyMessageBus(messagebus.MessageBus):
+    def handle(self, message):
+        results = []
+        self.queue = [message]
+        while self.queue:
+            message = self.queue.pop(0)
+            if isinstance(message, events.Event):
+                self.handle_event(message)
+            else:
+                results.append(self.handle_command(message))
+        return results
+
+    def handle_event(self, event):
+        for handler in self.event_handlers[type(event)]:
+            try:
+                for attempt in Retrying(
+                        stop=stop_after_attempt(3),
+                        wait=wait_exponential()
+                ):
+                    with attempt:
+                        handler([event] if messagebus.is_batchable(handler)
+                                else event)
+                        self.queue.extend(self.uow.collect_new_events())
+            except RetryError:
+                continue
+
+
+class RetriedByLegacyBus(messagebus.RetryPolicy):
+    def wrap(self, handler):
+        return handler
+
+
+def build_bus(legacy):
+    extra = dict(retry_policy=RetriedByLegacyBus()) if legacy else {}
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=LegacyFakeUnitOfWork() if legacy else FakeSessionUnitOfWork(),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+        **extra,
+    )
+    if legacy:
+        bus.__class__ = LegacyMessageBus
+    bus.handle(commands.CreateBatch("batch", "SKU", 10 ** 9, None))
+    return bus
+
+
+def messages_per_second(legacy, line_count):
+    bus = build_bus(legacy)
+    bus.handle(commands.AllocateMany(
+        "SKU", [(f"warmup-{i}", 1) for i in range(line_count)]))
+    command = commands.AllocateMany(
+        "SKU", [(f"order-{i}", 1) for i in range(line_count)])
+    start = time.perf_counter()
+    bus.handle(command)
+    elapsed = time.perf_counter() - start
+    return (line_count + 1) / elapsed
+
+
+def main():
+    print(f"{'events':>8} {'legacy msg/s':>14} {'deque msg/s':>14}")
+    for line_count in LINE_COUNTS:
+        print(f"{line_count:>8}"
+              f" {messages_per_second(True, line_count):>14,.0f}"
+              f" {messages_per_second(False, line_count):>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import time
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from allocation import bootstrap, metrics
+from allocation.adapters import orm
+from allocation.domain import commands
+from allocation.service_layer import unit_of_work
+from tests.benchmarks.bench_messagebus import build_bus
+from tests.fakes import FakeNotifications
+
+COMMANDS = {"fake": 20_000, "sqlite": 300}
+OBSERVATIONS = 1_000_000
+
+
+def observe_cost():
+    histogram = metrics.Registry().histogram("bench", "", ["handler"])
+    start = time.perf_counter()
+    for _ in range(OBSERVATIONS):
+        histogram.observe(0.003, "allocate")
+    return (time.perf_counter() - start) / OBSERVATIONS
+
+
+def build_sqlite_bus():
+    engine = create_engine("sqlite://")
+    orm.metadata.create_all(engine)
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine)),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+    )
+    bus.handle(commands.CreateBatch("batch", "SKU", 10 ** 9, None))
+    return bus
+
+
+def commands_per_second(build, count, instrumented):
+    def run():
+        bus = build()
+        start = time.perf_counter()
+        for i in range(count):
+            bus.handle(commands.Allocate(f"order-{i}", "SKU", 1))
+        elapsed = time.perf_counter() - start
+        clear_mappers()
+        return count / elapsed
+
+    if instrumented:
+        return max(run() for _ in range(3))
+    with mock.patch.object(metrics.Histogram, "observe", lambda *a: None), \
+            mock.patch.object(metrics.Counter, "inc", lambda *a, **k: None):
+        return max(run() for _ in range(3))
+
+
+def main():
+    print(f"histogram.observe: {observe_cost() * 1e9:,.0f} ns")
+    print(f"{'unit of work':>13} {'metrics off cmd/s':>18}"
+          f" {'metrics on cmd/s':>17} {'overhead':>9}")
+    workloads = [
+        ("fake", lambda: build_bus(legacy=False)),
+        ("sqlite", build_sqlite_bus),
+    ]
+    for name, build in workloads:
+        count = COMMANDS[name]
+        baseline = commands_per_second(build, count, instrumented=False)
+        instrumented = commands_per_second(build, count, instrumented=True)
+        print(f"{name:>13} {baseline:>18,.0f} {instrumented:>17,.0f}"
+              f" {(baseline / instrumented - 1) * 100:>8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,20 @@ from allocation import config
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
 
-from allocation.adapters.orm import metadata, start_mappers
+from allocation.adapters import migrations
+from allocation.adapters.orm import start_mappers
+from allocation.domain import model
+
+
+@pytest.fixture(autouse=True)
+def check_quantity_counters(monkeypatch):
+    monkeypatch.setattr(model, "CHECK_QUANTITY_COUNTERS", True)
+
 
 @pytest.fixture
 def in_memory_db():
     engine = create_engine("sqlite:///:memory:")
-    metadata.create_all(engine)
+    migrations.migrate(engine)
 
     return engine
 
@@ -57,7 +65,7 @@ def wait_for_redis_to_come_up():
 def postgres_db():
     engine = create_engine(config.get_postgres_uri())
     wait_for_postgres_to_come_up(engine)
-    metadata.create_all(engine)
+    migrations.migrate(engine)
     return engine
 
 
@@ -21,5 +21,25 @@ def post_to_allocate(order_id, sku, quantity, expect_success=True):
     return r
 
 
+def post_to_allocate_order(order_id, lines, expect_success=True):
+    r = requests.post(
+        f"{config.get_api_url()}/allocate_order", json={
+            "order_id": order_id,
+            "lines": [
+                {"sku": sku, "quantity": quantity} for sku, quantity in lines
+            ],
+        })
+    if expect_success:
+        assert r.status_code == 202
+
+    return r
+
+
 def get_allocation(order_id):
-    return requests.get(f"{config.get_api_url()}/allocations/{order_id}")
\ No newline at end of file
+    return requests.get(f"{config.get_api_url()}/allocations/{order_id}")
+
+def post_to_lookup_allocations(order_ids):
+    return requests.post(
+        f"{config.get_api_url()}/allocations/lookup",
+        json={"order_ids": order_ids},
+    )
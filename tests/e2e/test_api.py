@@ -44,3 +44,74 @@ def test_unhappy_path_returns_400_and_error_message():
 
     r = api_client.get_allocation(order_id)
     assert r.status_code ==404
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_metrics_are_exposed_in_prometheus_format():
+    unknow_sku, order_id = random_sku(), random_order_id()
+    api_client.post_to_allocate(order_id, unknow_sku, 20, expect_success=False)
+
+    r = requests.get(f"{config.get_api_url()}/metrics")
+
+    assert r.status_code == 200
+    assert r.headers["Content-Type"].startswith("text/plain")
+    assert 'allocation_http_request_seconds_count{method="POST",' \
+           'route="/allocate",status="400"}' in r.text
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_allocate_order_allocates_every_line():
+    order_id = random_order_id()
+    sku, other_sku = random_sku(), random_sku("other")
+    batch, other_batch = random_batchref(1), random_batchref(2)
+    api_client.post_to_add_batch(batch, sku, 100, None)
+    api_client.post_to_add_batch(other_batch, other_sku, 100, None)
+
+    r = api_client.post_to_allocate_order(
+        order_id, [(sku, 3), (other_sku, 200)])
+
+    assert r.json() == {"batchrefs": [batch, None]}
+    r = api_client.get_allocation(order_id)
+    assert r.json() == [{"sku": sku, "batchref": batch}]
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_allocate_order_with_an_unknown_sku_allocates_nothing():
+    order_id = random_order_id()
+    sku, unknown_sku = random_sku(), random_sku("unknown")
+    api_client.post_to_add_batch(random_batchref(), sku, 100, None)
+
+    r = api_client.post_to_allocate_order(
+        order_id, [(sku, 3), (unknown_sku, 1)], expect_success=False)
+
+    assert r.status_code == 400
+    assert r.json()["message"] == f"Invalid sku {unknown_sku}"
+    assert api_client.get_allocation(order_id).status_code == 404
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_lookup_returns_allocations_keyed_by_order_id():
+    sku, batch = random_sku(), random_batchref()
+    order1, order2, unknown = (
+        random_order_id(1), random_order_id(2), random_order_id(3))
+    api_client.post_to_add_batch(batch, sku, 100, None)
+    api_client.post_to_allocate(order1, sku, 3)
+    api_client.post_to_allocate(order2, sku, 3)
+
+    r = api_client.post_to_lookup_allocations([order1, order2, unknown])
+
+    assert r.status_code == 200
+    assert r.json() == {
+        order1: [{"sku": sku, "batchref": batch}],
+        order2: [{"sku": sku, "batchref": batch}],
+        unknown: [],
+    }
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_lookup_rejects_a_body_without_order_ids():
+    r = api_client.post_to_lookup_allocations("not-a-list")
+
+    assert r.status_code == 400
@@ -0,0 +1,99 @@
+from collections import defaultdict
+
+from allocation.adapters import notifications, repository
+from allocation.service_layer import unit_of_work
+
+
+class FakeRepository(repository.AbstractRepository):
+    def __init__(self, products):
+        super().__init__()
+        self._products = set(products)
+
+    def _add(self, product):
+        self._products.add(product)
+
+    def _get(self, sku, loading=None):
+        return next((p for p in self._products if p.sku == sku), None)
+
+    def _get_sku_by_batchref(self, batchref):
+        return next(
+            (p.sku for p in self._products for b in p.batches if
+             b.reference == batchref),
+            None,
+        )
+
+
+class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
+
+    def __init__(self):
+        self.products = FakeRepository([])
+        self.committed = False
+
+    def _commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+class FakeNotifications(notifications.AbstractNotification):
+    def __init__(self):
+        self.sent = defaultdict(list)
+
+    def send(self, destination, message):
+        self.sent[destination].append(message)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.commands.clear()
+
+    def hset(self, *args):
+        self.commands.append((self.redis.hset, args))
+
+    def hdel(self, *args):
+        self.commands.append((self.redis.hdel, args))
+
+    def hgetall(self, *args):
+        self.commands.append((self.redis.hgetall, args))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        results = [command(*args, _pipelined=True)
+                   for command, args in self.commands]
+        self.commands.clear()
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def hset(self, name, key, value, _pipelined=False):
+        self.round_trips += not _pipelined
+        is_new = key not in self.hashes.setdefault(name, {})
+        self.hashes[name][key] = value
+        return int(is_new)
+
+    def hdel(self, name, *keys, _pipelined=False):
+        self.round_trips += not _pipelined
+        fields = self.hashes.get(name, {})
+        deleted = sum(fields.pop(key, None) is not None for key in keys)
+        if not fields:
+            self.hashes.pop(name, None)
+        return deleted
+
+    def hgetall(self, name, _pipelined=False):
+        self.round_trips += not _pipelined
+        return dict(self.hashes.get(name, {}))
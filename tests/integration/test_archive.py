@@ -0,0 +1,102 @@
+from datetime import date, timedelta
+from unittest import mock
+
+import pytest
+from sqlalchemy.orm import clear_mappers
+
+from allocation import bootstrap, views
+from allocation.domain import commands
+from allocation.service_layer import unit_of_work
+from allocation.service_layer.archiver import BatchArchiver
+
+today = date(2026, 10, 1)
+tomorrow = today + timedelta(days=1)
+yesterday = today - timedelta(days=1)
+
+
+@pytest.fixture
+def sqlite_bus(sqlite_session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+    )
+    yield bus
+    clear_mappers()
+
+
+def archiver(bus, chunk_size=500):
+    return BatchArchiver(bus.uow, chunk_size=chunk_size, today=lambda: today)
+
+
+def product_version(bus, sku):
+    with bus.uow:
+        return bus.uow.session.execute(
+            "SELECT version_number FROM products WHERE sku = :sku",
+            dict(sku=sku),
+        ).scalar()
+
+
+def test_archives_shipped_and_consumed_batches_only(sqlite_bus):
+    for ref, eta in [("shipped", tomorrow), ("consumed", None),
+                     ("partial", yesterday), ("arriving", tomorrow)]:
+        sqlite_bus.handle(commands.CreateBatch(ref, "LAMP", 10, eta))
+    sqlite_bus.handle(commands.ShipBatch("shipped"))
+    sqlite_bus.handle(commands.Allocate("o1", "LAMP", 10))
+    sqlite_bus.handle(commands.Allocate("o2", "LAMP", 5))
+    version = product_version(sqlite_bus, "LAMP")
+
+    archived = archiver(sqlite_bus).archive_once()
+
+    assert sorted(archived) == ["consumed", "shipped"]
+    assert product_version(sqlite_bus, "LAMP") == version + 1
+    with sqlite_bus.uow:
+        product = sqlite_bus.uow.products.get("LAMP")
+        assert sorted(b.reference for b in product.batches) == [
+            "arriving", "partial"]
+
+
+def test_archives_in_chunks(sqlite_bus):
+    for i in range(5):
+        sqlite_bus.handle(commands.CreateBatch(f"b{i}", "LAMP", 10, None))
+        sqlite_bus.handle(commands.ShipBatch(f"b{i}"))
+
+    assert len(archiver(sqlite_bus, chunk_size=2).archive_once()) == 2
+    assert archiver(sqlite_bus, chunk_size=2).archive_all() == 3
+    assert archiver(sqlite_bus, chunk_size=2).archive_once() == []
+
+
+def test_counts_lines_when_allocated_quantity_is_unknown(sqlite_bus):
+    sqlite_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    sqlite_bus.handle(commands.Allocate("o1", "LAMP", 10))
+    with sqlite_bus.uow:
+        sqlite_bus.uow.session.execute(
+            "UPDATE batches SET allocated_quantity = NULL")
+        sqlite_bus.uow.commit()
+
+    assert archiver(sqlite_bus).archive_once() == ["b1"]
+    with sqlite_bus.uow:
+        assert sqlite_bus.uow.session.execute(
+            "SELECT allocated_quantity FROM archived_batches").scalar() == 10
+
+
+def test_history_includes_archived_allocations(sqlite_bus):
+    sqlite_bus.handle(commands.CreateBatch("old", "LAMP", 10, yesterday))
+    sqlite_bus.handle(commands.CreateBatch("new", "CHAIR", 10, None))
+    sqlite_bus.handle(commands.Allocate("o1", "LAMP", 10))
+    sqlite_bus.handle(commands.Allocate("o1", "CHAIR", 3))
+
+    archiver(sqlite_bus).archive_once()
+
+    assert sorted(
+        views.allocation_history("o1", sqlite_bus.uow),
+        key=lambda r: r["sku"],
+    ) == [
+        {"sku": "CHAIR", "batchref": "new", "quantity": 3, "archived": False},
+        {"sku": "LAMP", "batchref": "old", "quantity": 10, "archived": True},
+    ]
+    with sqlite_bus.uow:
+        assert sqlite_bus.uow.session.execute(
+            "SELECT count(*) FROM order_lines WHERE sku = 'LAMP'"
+        ).scalar() == 0
@@ -0,0 +1,335 @@
+import pytest
+import redis
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, clear_mappers
+from sqlalchemy.orm.exc import StaleDataError
+from tenacity import wait_none
+
+from allocation import bootstrap, views
+from allocation.adapters import orm, read_models
+from allocation.domain import commands, events, model
+from allocation.service_layer import handlers, messagebus, unit_of_work
+from ..fakes import FakeNotifications, FakeRedis
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def let_sqlalchemy_emit_begin(dbapi_connection, _):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    orm.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def commits(engine):
+    committed = []
+    event.listen(engine, "commit", lambda connection: committed.append(1))
+    return committed
+
+
+@pytest.fixture
+def uow(engine):
+    orm.start_mappers()
+    yield unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+    clear_mappers()
+
+
+def make_bus(uow, cascade_transactions):
+    return bootstrap.bootstrap(
+        start_orm=False,
+        uow=uow,
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+        cascade_transactions=cascade_transactions,
+    )
+
+
+@pytest.mark.parametrize("cascade_transactions, expected_commits", [
+    (False, 2),
+    (True, 1),
+])
+def test_allocate_commits_once_per_cascade(
+        uow, commits, cascade_transactions, expected_commits
+):
+    bus = make_bus(uow, cascade_transactions)
+    bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+    commits.clear()
+
+    bus.handle(commands.Allocate("o1", "LAMP", 10))
+
+    assert len(commits) == expected_commits
+    assert views.allocations("o1", uow) == [{"sku": "LAMP", "batchref": "b1"}]
+
+
+def test_reallocation_cascade_commits_once(uow, commits):
+    bus = make_bus(uow, cascade_transactions=True)
+    bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    bus.handle(commands.CreateBatch("b2", "LAMP", 10, None))
+    bus.handle(commands.Allocate("o1", "LAMP", 10))
+    commits.clear()
+
+    bus.handle(commands.ChangeBatchQuantity("b1", 5))
+
+    assert len(commits) == 1
+    assert views.allocations("o1", uow) == [{"sku": "LAMP", "batchref": "b2"}]
+
+
+def test_failed_block_rolls_back_to_its_savepoint(uow, engine):
+    class HandlerFailed(Exception):
+        pass
+
+    with uow.cascade():
+        with uow:
+            uow.session.execute(
+                "INSERT INTO allocations_view VALUES ('o1', 'LAMP', 'b1')")
+            uow.commit()
+        with pytest.raises(HandlerFailed):
+            with uow:
+                uow.session.execute(
+                    "INSERT INTO allocations_view VALUES ('o2', 'LAMP', 'b1')")
+                raise HandlerFailed()
+
+    assert list(engine.execute("SELECT orderid FROM allocations_view")) \
+        == [("o1",)]
+
+
+def test_rolled_back_allocation_is_not_written_with_the_cascade(
+        uow, engine
+):
+    engine.execute("INSERT INTO products (sku) VALUES ('LAMP')")
+    engine.execute(
+        "INSERT INTO batches (sku, reference, _purchased_quantity,"
+        " allocated_quantity, shipped) VALUES ('LAMP', 'b1', 10, 0, 0)")
+
+    with uow.cascade():
+        with pytest.raises(ValueError):
+            with uow:
+                product = uow.products.get("LAMP", loading="counts_only")
+                product.allocate(model.OrderLine("o1", "LAMP", 1))
+                [batch] = product.batches
+                raise ValueError()
+        with uow:
+            product = uow.products.get("LAMP", loading="counts_only")
+            product.allocate(model.OrderLine("o2", "LAMP", 2))
+            assert product.batches == [batch]
+            uow.commit()
+
+    assert list(engine.execute(
+        "SELECT order_id FROM order_lines JOIN allocations"
+        " ON allocations.order_line_id = order_lines.id")) == [("o2",)]
+    assert list(engine.execute(
+        "SELECT allocated_quantity FROM batches")) == [(2,)]
+
+
+def test_failed_cascade_commits_nothing(uow, engine):
+    with pytest.raises(ValueError):
+        with uow.cascade():
+            with uow:
+                uow.session.execute(
+                    "INSERT INTO allocations_view VALUES ('o1', 'LAMP', 'b1')")
+                uow.commit()
+            raise ValueError()
+
+    assert list(engine.execute("SELECT * FROM allocations_view")) == []
+
+
+def test_after_commit_callbacks_wait_for_the_cascade(uow, commits):
+    ran = []
+
+    with uow.cascade():
+        with uow:
+            uow.session.execute(
+                "INSERT INTO allocations_view VALUES ('o1', 'LAMP', 'b1')")
+            uow.after_commit(lambda: ran.append(len(commits)))
+            uow.commit()
+        assert ran == []
+
+    assert ran == [1]
+
+
+def test_conflict_in_a_cascade_is_retried_in_a_new_transaction(
+        uow, commits, monkeypatch
+):
+    sessions = []
+
+    def conflicts_once(cmd, uow):
+        sessions.append(uow.session)
+        if len(sessions) == 1:
+            raise StaleDataError("product version changed")
+        return handlers.allocate(cmd, uow)
+
+    monkeypatch.setitem(
+        handlers.COMMAND_HANDLERS, commands.Allocate, conflicts_once)
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=uow,
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+        cascade_transactions=True,
+        command_retry_policy=messagebus.RetryPolicy(
+            attempts=3, wait=wait_none(),
+            is_retryable=unit_of_work.is_concurrency_conflict),
+    )
+    bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+    commits.clear()
+
+    bus.handle(commands.Allocate("o1", "LAMP", 10))
+
+    assert len(sessions) == 2 and sessions[0] is not sessions[1]
+    assert len(commits) == 1
+    assert views.allocations("o1", uow) == [{"sku": "LAMP", "batchref": "b1"}]
+
+
+def fail_commits(engine, error, times=None):
+    failures = []
+
+    def commit(connection):
+        if times is None or len(failures) < times:
+            failures.append(1)
+            raise error
+
+    event.listen(engine, "commit", commit)
+    return failures
+
+
+@pytest.mark.parametrize("quantity", [10, 1000])
+def test_failed_cascade_sends_nothing(uow, engine, quantity):
+    notifications, published = FakeNotifications(), []
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=uow,
+        notifications=notifications,
+        publish=lambda *args: published.append(args),
+        cascade_transactions=True,
+    )
+    bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+    fail_commits(engine, ValueError("database went away"))
+
+    with pytest.raises(ValueError):
+        bus.handle(commands.Allocate("o1", "LAMP", quantity))
+
+    assert published == []
+    assert notifications.sent == {}
+
+
+@pytest.mark.parametrize("quantity, expected_sends", [(10, 1), (1000, 0)])
+def test_retried_cascade_publishes_once(uow, engine, quantity, expected_sends):
+    notifications, published = FakeNotifications(), []
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=uow,
+        notifications=notifications,
+        publish=lambda *args: published.append(args),
+        cascade_transactions=True,
+        command_retry_policy=messagebus.RetryPolicy(
+            attempts=3, wait=wait_none(),
+            is_retryable=unit_of_work.is_concurrency_conflict),
+    )
+    bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+    failures = fail_commits(
+        engine, StaleDataError("product version changed"), times=1)
+
+    bus.handle(commands.Allocate("o1", "LAMP", quantity))
+
+    assert failures == [1]
+    assert len(published) == expected_sends
+    assert len(notifications.sent["stock@made.com"]) == 1 - expected_sends
+
+
+def test_failed_after_commit_callback_is_raised(uow):
+    ran = []
+
+    def fails():
+        raise ConnectionError("redis is down")
+
+    with pytest.raises(ConnectionError):
+        with uow.cascade():
+            uow.after_commit(fails)
+            uow.after_commit(lambda: ran.append(1))
+
+    assert ran == [1]
+
+
+def test_failed_cascade_drops_its_after_commit_callbacks(uow):
+    ran = []
+
+    with pytest.raises(ValueError):
+        with uow.cascade():
+            uow.after_commit(lambda: ran.append(1))
+            raise ValueError()
+
+    assert ran == []
+
+
+def test_redis_read_model_is_written_once_the_cascade_commits(uow):
+    redis = FakeRedis()
+    read_model = read_models.RedisReadModel(redis)
+
+    with uow.cascade():
+        read_model.add(uow, [events.Allocated("o1", "LAMP", 10, "b1")])
+        assert redis.hashes == {}
+
+    assert read_model.allocations(uow, "o1") == [
+        {"sku": "LAMP", "batchref": "b1"},
+    ]
+
+
+class FlakyRedis(FakeRedis):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def pipeline(self, transaction=True):
+        pipe = super().pipeline(transaction)
+        if self.failures:
+            self.failures -= 1
+
+            def execute():
+                raise redis.exceptions.ConnectionError("redis is down")
+            pipe.execute = execute
+        return pipe
+
+
+def make_redis_bus(uow, client, cascade_transactions):
+    return bootstrap.bootstrap(
+        start_orm=False,
+        uow=uow,
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+        read_model=read_models.RedisReadModel(client),
+        retry_policy=messagebus.RetryPolicy(
+            retryable=bootstrap.TRANSIENT_ERRORS, wait=wait_none()),
+        cascade_transactions=cascade_transactions,
+    )
+
+
+def test_failed_redis_write_is_retried_with_its_handler(uow):
+    client = FlakyRedis(failures=1)
+    bus = make_redis_bus(uow, client, cascade_transactions=False)
+    bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+
+    bus.handle(commands.Allocate("o1", "LAMP", 10))
+
+    assert client.failures == 0
+    assert client.hashes == {"allocations:o1": {"LAMP": "b1"}}
+
+
+def test_failed_redis_write_after_a_cascade_is_raised(uow, engine):
+    client = FlakyRedis(failures=1)
+    bus = make_redis_bus(uow, client, cascade_transactions=True)
+    bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+
+    with pytest.raises(redis.exceptions.ConnectionError):
+        bus.handle(commands.Allocate("o1", "LAMP", 10))
+
+    assert client.hashes == {}
+    assert list(engine.execute("SELECT order_id FROM order_lines")) \
+        == [("o1",)]
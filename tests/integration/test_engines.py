@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from allocation import metrics
+from allocation.adapters import engines
+
+
+@pytest.fixture
+def sqlite_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'allocation.db'}"
+
+
+def test_engines_are_built_lazily_and_shared(sqlite_url):
+    asked = []
+
+    def url():
+        asked.append(1)
+        return sqlite_url
+
+    registry = engines.EngineRegistry({"default": url})
+    assert asked == []
+
+    session = registry.session_factory()()
+    assert session.execute("SELECT 1").scalar() == 1
+    assert registry.engine() is registry.engine()
+    assert len(asked) == 1
+
+
+def queue_pool_engine(url, name):
+    engine = create_engine(url, poolclass=engines.TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    engine.pool.engine_name = name
+    return engine
+
+
+def test_pool_checkout_waits_and_timeouts_are_recorded(sqlite_url):
+    engine = queue_pool_engine(sqlite_url, "waiting")
+    held = engine.connect()
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    held.close()
+    engine.connect().close()
+
+    assert metrics.DB_POOL_TIMEOUTS.value("waiting") == 1
+    assert metrics.DB_POOL_WAIT_SECONDS.count("waiting") == 3
+
+
+def test_connections_from_a_parent_process_are_replaced(
+        sqlite_url, monkeypatch
+):
+    engine = queue_pool_engine(sqlite_url, "forked")
+    engines.guard_against_forked_connections(engine)
+    with engine.connect() as connection:
+        parent_connection = connection.connection.dbapi_connection
+
+    monkeypatch.setattr(engines.os, "getpid", lambda: -1)
+    with engine.connect() as connection:
+        child_connection = connection.connection.dbapi_connection
+
+    assert child_connection is not parent_connection
+    assert parent_connection.execute("SELECT 1").fetchone() == (1,)
+
+
+def test_pool_status_is_exported(sqlite_url):
+    registry = engines.EngineRegistry({"default": lambda: sqlite_url})
+    registry._engines["default"] = queue_pool_engine(sqlite_url, "default")
+    with registry.engine().connect():
+        assert registry.pool_status()[("default", "checked_out")] == 1
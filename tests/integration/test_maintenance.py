@@ -0,0 +1,68 @@
+from allocation.adapters import maintenance
+
+
+def insert_stock(session):
+    session.execute(
+        "INSERT INTO products (sku, version_number) VALUES ('LAMP', 3)")
+    session.execute(
+        "INSERT INTO batches (id, reference, sku, _purchased_quantity,"
+        " allocated_quantity) VALUES"
+        " (1, 'right', 'LAMP', 100, 10),"
+        " (2, 'wrong', 'LAMP', 100, 99),"
+        " (3, 'unknown', 'LAMP', 100, NULL),"
+        " (4, 'empty', 'LAMP', 100, 0)"
+    )
+    session.execute(
+        "INSERT INTO order_lines (id, order_id, sku, quantity) VALUES"
+        " (1, 'o1', 'LAMP', 10), (2, 'o2', 'LAMP', 4), (3, 'o3', 'LAMP', 6)"
+    )
+    session.execute(
+        "INSERT INTO allocations (order_line_id, batch_id) VALUES"
+        " (1, 1), (2, 2), (3, 3)"
+    )
+    session.commit()
+
+
+def test_reports_batches_whose_stored_quantity_drifted(session):
+    insert_stock(session)
+
+    drift = maintenance.allocated_quantity_drift(session.connection())
+
+    assert [(d.reference, d.stored, d.actual) for d in drift] == [
+        ("wrong", 99, 4),
+        ("unknown", None, 6),
+    ]
+
+
+def test_reconciling_rewrites_quantities_and_invalidates_products(session):
+    insert_stock(session)
+
+    maintenance.reconcile_allocated_quantities(session.connection())
+    session.commit()
+
+    assert maintenance.allocated_quantity_drift(session.connection()) == []
+    assert list(session.execute(
+        "SELECT reference, allocated_quantity FROM batches ORDER BY id"
+    )) == [("right", 10), ("wrong", 4), ("unknown", 6), ("empty", 0)]
+    assert session.execute(
+        "SELECT version_number FROM products").scalar() == 4
+
+
+def test_reconciling_recounts_instead_of_writing_what_it_read(
+        session, monkeypatch
+):
+    insert_stock(session)
+    read = maintenance.allocated_quantity_drift(session.connection())
+    session.execute(
+        "INSERT INTO order_lines (id, order_id, sku, quantity) VALUES"
+        " (4, 'o4', 'LAMP', 5)")
+    session.execute(
+        "INSERT INTO allocations (order_line_id, batch_id) VALUES (4, 2)")
+    monkeypatch.setattr(
+        maintenance, "allocated_quantity_drift", lambda connection: read)
+
+    maintenance.reconcile_allocated_quantities(session.connection())
+
+    assert list(session.execute(
+        "SELECT reference, allocated_quantity FROM batches ORDER BY id"
+    )) == [("right", 10), ("wrong", 9), ("unknown", 6), ("empty", 0)]
@@ -0,0 +1,80 @@
+from sqlalchemy import create_engine, inspect, text
+
+from allocation.adapters import migrations, orm
+
+
+def index_names(engine):
+    inspector = inspect(engine)
+    return {
+        index["name"]
+        for table in inspector.get_table_names()
+        for index in inspector.get_indexes(table)
+    }
+
+
+def versions(engine):
+    with engine.connect() as connection:
+        return migrations.applied_versions(connection)
+
+
+def test_migrates_an_empty_database_once():
+    engine = create_engine("sqlite://")
+
+    applied = migrations.migrate(engine)
+
+    assert [m.version for m in applied] == [1, 2, 3, 4, 5]
+    assert versions(engine) == [1, 2, 3, 4, 5]
+    assert set(orm.metadata.tables) <= set(inspect(engine).get_table_names())
+    assert migrations.migrate(engine) == []
+
+
+def test_adds_indexes_to_a_schema_created_without_them():
+    engine = create_engine("sqlite://")
+    orm.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for name in index_names(engine):
+            connection.execute(text(f"DROP INDEX {name}"))
+
+    migrations.migrate(engine)
+
+    assert index_names(engine) >= {
+        "ix_batches_reference", "ix_batches_sku",
+        "ix_allocations_batch_id", "ix_allocations_order_line_id",
+        "ix_order_lines_order_id_sku", "ix_allocations_view_orderid_sku",
+    }
+
+
+def test_applies_new_migrations_up_to_a_target():
+    engine = create_engine("sqlite://")
+    migrations.migrate(engine)
+    added = []
+    later = [
+        *migrations.MIGRATIONS,
+        migrations.Migration(98, "first", lambda c: added.append(98)),
+        migrations.Migration(99, "second", lambda c: added.append(99)),
+    ]
+
+    assert [m.name for m in migrations.migrate(engine, later, target=98)] \
+        == ["first"]
+    assert [m.name for m in migrations.migrate(engine, later)] == ["second"]
+    assert added == [98, 99]
+    assert versions(engine)[-2:] == [98, 99]
+
+
+def test_adds_allocated_quantity_to_existing_batches_tables():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE batches (id INTEGER PRIMARY KEY, reference TEXT)"))
+        connection.execute(text("INSERT INTO batches VALUES (1, 'b1')"))
+    add_column = migrations.add_column(
+        "batches", "allocated_quantity", "INTEGER NULL")
+
+    with engine.begin() as connection:
+        add_column(connection)
+        add_column(connection)
+
+    with engine.connect() as connection:
+        assert list(connection.execute(text(
+            "SELECT reference, allocated_quantity FROM batches"))) \
+            == [("b1", None)]
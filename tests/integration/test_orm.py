@@ -1,3 +1,5 @@
+from sqlalchemy import event
+
 from allocation.domain import model
 from datetime import date
 
@@ -86,3 +88,66 @@ def test_retrieving_allocations(session):
     batch = session.query(model.Batch).first()
 
     assert batch._allocations == {model.OrderLine("order1", "sku1", 12)}
+
+
+def test_loaded_batches_count_their_allocations(session):
+    batch = model.Batch("batch1", "sku1", 100, eta=None)
+    batch.allocate(model.OrderLine("order1", "sku1", 12))
+    batch.allocate(model.OrderLine("order2", "sku1", 8))
+    session.add(batch)
+    session.commit()
+    session.close()
+
+    retrieved = session.query(model.Batch).first()
+
+    assert retrieved is not batch
+    assert retrieved.allocated_quantity == 20
+    assert retrieved.available_quantity == 80
+
+
+def test_allocated_quantity_is_stored_with_the_batch(session):
+    batch = model.Batch("batch1", "sku1", 100, eta=None)
+    batch.allocate(model.OrderLine("order1", "sku1", 12))
+    session.add(batch)
+    session.commit()
+
+    assert list(session.execute(
+        "SELECT reference, allocated_quantity FROM batches"
+    )) == [("batch1", 12)]
+
+
+def test_allocating_to_a_loaded_batch_does_not_load_its_lines(
+        session, in_memory_db
+):
+    batch = model.Batch("batch1", "sku1", 100, eta=None)
+    batch.allocate(model.OrderLine("order1", "sku1", 12))
+    session.add(batch)
+    session.commit()
+    session.close()
+    retrieved = session.query(model.Batch).one()
+    statements = []
+    event.listen(in_memory_db, "before_cursor_execute",
+                 lambda *args: statements.append(args[2]))
+
+    retrieved.allocate(model.OrderLine("order2", "sku1", 8))
+    session.commit()
+
+    assert not any(s.startswith("SELECT") for s in statements)
+    session.close()
+
+    retrieved = session.query(model.Batch).one()
+    assert retrieved.allocated_quantity == 20
+    assert {line.order_id for line in retrieved._allocations} \
+        == {"order1", "order2"}
+
+
+def test_batches_without_a_stored_quantity_count_their_lines(session):
+    batch = model.Batch("batch1", "sku1", 100, eta=None)
+    batch.allocate(model.OrderLine("order1", "sku1", 12))
+    session.add(batch)
+    session.commit()
+    session.execute("UPDATE batches SET allocated_quantity = NULL")
+    session.commit()
+    session.close()
+
+    assert session.query(model.Batch).one().available_quantity == 88
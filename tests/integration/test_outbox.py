@@ -0,0 +1,216 @@
+from unittest import mock
+
+import pytest
+from sqlalchemy.orm import clear_mappers
+
+from allocation import bootstrap
+from allocation.domain import commands, events, model
+from allocation.service_layer import handlers, messagebus, unit_of_work
+
+no_retries = messagebus.RetryPolicy(attempts=1)
+
+
+class FakePublisher:
+    def __init__(self):
+        self.published = []
+        self.failures = 0
+
+    def __call__(self, channel, *events_):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("redis is down")
+        self.published.extend((channel, event) for event in events_)
+
+
+@pytest.fixture
+def publish():
+    return FakePublisher()
+
+
+@pytest.fixture
+def notifications():
+    return mock.Mock()
+
+
+@pytest.fixture
+def outbox_bus(sqlite_session_factory, publish, notifications):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(
+            sqlite_session_factory,
+            outbox_event_types=tuple(handlers.OUTBOX_HANDLERS)),
+        notifications=notifications,
+        publish=publish,
+    )
+    yield bus
+    clear_mappers()
+
+
+@pytest.fixture
+def relay(sqlite_session_factory, publish, notifications):
+    return bootstrap.bootstrap_outbox_relay(
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=notifications,
+        publish=publish,
+        retry_policy=no_retries,
+        batch_size=2,
+    )
+
+
+def outbox_rows(session_factory):
+    return list(session_factory().execute(
+        "SELECT event_type FROM outbox ORDER BY id"))
+
+
+def test_side_effects_are_written_to_the_outbox_not_dispatched(
+        outbox_bus, sqlite_session_factory, publish, notifications
+):
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    outbox_bus.handle(commands.Allocate("o1", "LAMP", 10))
+    outbox_bus.handle(commands.Allocate("o2", "LAMP", 1))
+
+    assert publish.published == []
+    assert not notifications.send.called
+    assert outbox_rows(sqlite_session_factory) == [
+        ("Allocated",), ("OutOfStock",),
+    ]
+
+
+def test_read_model_is_still_updated_in_process(
+        outbox_bus, sqlite_session_factory
+):
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    outbox_bus.handle(commands.Allocate("o1", "LAMP", 10))
+
+    assert list(sqlite_session_factory().execute(
+        "SELECT orderid, batchref FROM allocations_view")) == [("o1", "b1")]
+
+
+def test_relay_dispatches_in_batches_and_empties_the_outbox(
+        outbox_bus, relay, sqlite_session_factory, publish, notifications
+):
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    outbox_bus.handle(commands.AllocateMany(
+        "LAMP", [("o1", 3), ("o2", 3), ("o3", 3), ("o4", 3)]))
+
+    assert relay.relay_once() == 2
+    assert relay.relay_once() == 2
+    assert relay.relay_once() == 0
+
+    assert publish.published == [
+        ("line_allocated", events.Allocated("o1", "LAMP", 3, "b1")),
+        ("line_allocated", events.Allocated("o2", "LAMP", 3, "b1")),
+        ("line_allocated", events.Allocated("o3", "LAMP", 3, "b1")),
+    ]
+    notifications.send.assert_called_once_with(
+        "stock@made.com", "Out of stock for LAMP")
+    assert outbox_rows(sqlite_session_factory) == []
+
+
+def test_failed_relay_leaves_events_for_the_next_attempt(
+        outbox_bus, relay, sqlite_session_factory, publish
+):
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    outbox_bus.handle(commands.Allocate("o1", "LAMP", 1))
+    publish.failures = 1
+
+    assert relay.relay_once() == 0
+    assert outbox_rows(sqlite_session_factory) == [("Allocated",)]
+
+    assert relay.relay_once() == 1
+    assert publish.published == [
+        ("line_allocated", events.Allocated("o1", "LAMP", 1, "b1")),
+    ]
+
+
+def test_failing_row_does_not_hold_back_the_rest(
+        outbox_bus, relay, sqlite_session_factory, publish, notifications
+):
+    notifications.send.side_effect = ConnectionError("smtp is down")
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    outbox_bus.handle(commands.Allocate("o1", "LAMP", 10))
+    outbox_bus.handle(commands.Allocate("o2", "LAMP", 1))
+
+    for _ in range(3):
+        relay.relay_once()
+
+    assert publish.published == [
+        ("line_allocated", events.Allocated("o1", "LAMP", 10, "b1")),
+    ]
+    assert list(sqlite_session_factory().execute(
+        "SELECT event_type, attempts FROM outbox")) == [("OutOfStock", 3)]
+
+
+def test_rows_are_dead_lettered_after_max_attempts(
+        outbox_bus, relay, sqlite_session_factory, notifications
+):
+    notifications.send.side_effect = ConnectionError("smtp is down")
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 1, None))
+    outbox_bus.handle(commands.Allocate("o1", "LAMP", 2))
+    relay.max_attempts = 2
+
+    relay.relay_once()
+    relay.relay_once()
+    relay.relay_once()
+
+    assert notifications.send.call_count == 2
+    [(attempts, dead_lettered_at)] = sqlite_session_factory().execute(
+        "SELECT attempts, dead_lettered_at FROM outbox")
+    assert attempts == 2
+    assert dead_lettered_at is not None
+
+
+def test_failed_batch_is_retried_one_event_at_a_time(
+        outbox_bus, relay, sqlite_session_factory, publish
+):
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    outbox_bus.handle(commands.AllocateMany("LAMP", [("o1", 1), ("o2", 1)]))
+    publish.failures = 2
+
+    assert relay.relay_once() == 1
+    assert outbox_rows(sqlite_session_factory) == [("Allocated",)]
+    assert relay.relay_once() == 1
+    assert publish.published == [
+        ("line_allocated", events.Allocated("o2", "LAMP", 1, "b1")),
+        ("line_allocated", events.Allocated("o1", "LAMP", 1, "b1")),
+    ]
+
+
+@pytest.mark.parametrize("event_type, payload", [
+    ("Allocated", "{not json"),
+    ("Allocated", '{"orderid": "o1"}'),
+    ("Shipped", "{}"),
+])
+def test_unreadable_row_is_dead_lettered_without_holding_back_the_rest(
+        outbox_bus, relay, sqlite_session_factory, publish,
+        event_type, payload
+):
+    session = sqlite_session_factory()
+    session.execute(
+        "INSERT INTO outbox (event_type, payload) VALUES (:type, :payload)",
+        dict(type=event_type, payload=payload))
+    session.commit()
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    outbox_bus.handle(commands.Allocate("o1", "LAMP", 1))
+    relay.max_attempts = 1
+
+    assert relay.relay_once() == 1
+    assert relay.relay_once() == 0
+
+    assert publish.published == [
+        ("line_allocated", events.Allocated("o1", "LAMP", 1, "b1")),
+    ]
+    [(attempts, dead_lettered_at)] = sqlite_session_factory().execute(
+        "SELECT attempts, dead_lettered_at FROM outbox")
+    assert attempts == 1
+    assert dead_lettered_at is not None
+
+
+def test_rolled_back_work_writes_nothing_to_the_outbox(
+        outbox_bus, sqlite_session_factory
+):
+    outbox_bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    uow = outbox_bus.uow
+    with uow:
+        uow.products.get("LAMP").allocate(model.OrderLine("o1", "LAMP", 1))
+    assert outbox_rows(sqlite_session_factory) == []
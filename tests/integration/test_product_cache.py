@@ -0,0 +1,142 @@
+import pytest
+from sqlalchemy import event
+
+from allocation.adapters import repository
+from allocation.domain import model
+from allocation.service_layer import unit_of_work
+from ..fakes import FakeRepository
+
+
+@pytest.fixture
+def cache():
+    return repository.ProductCache(maxsize=2)
+
+
+@pytest.fixture
+def uow(session_factory, cache):
+    return unit_of_work.SqlAlchemyUnitOfWork(
+        session_factory, product_cache=cache)
+
+
+@pytest.fixture
+def statements(in_memory_db):
+    executed = []
+    event.listen(in_memory_db, "before_cursor_execute",
+                 lambda *args: executed.append(args[2]))
+    return executed
+
+
+def add_product(uow, sku, quantity=100):
+    with uow:
+        uow.products.add(model.Product(
+            sku, [model.Batch(f"{sku}-batch", sku, quantity, None)]))
+        uow.commit()
+
+
+def allocate(uow, order_id, sku, quantity=1):
+    with uow:
+        batchref = uow.products.get(sku).allocate(
+            model.OrderLine(order_id, sku, quantity))
+        uow.commit()
+    return batchref
+
+
+def test_reuses_a_committed_product_after_one_version_check(
+        uow, cache, statements
+):
+    add_product(uow, "LAMP")
+    allocate(uow, "o1", "LAMP")
+    statements.clear()
+
+    with uow:
+        product = uow.products.get("LAMP")
+        assert [line.order_id for line in product.batches[0]._allocations] \
+            == ["o1"]
+
+    assert len(statements) == 1
+    assert "version_number" in statements[0]
+    assert cache.hits == 2
+
+
+def test_get_many_checks_cached_versions_in_one_query(
+        uow, cache, statements
+):
+    add_product(uow, "LAMP")
+    add_product(uow, "TABLE")
+    add_product(uow, "CHAIR")
+    statements.clear()
+
+    with uow:
+        products = uow.products.get_many(
+            ["LAMP", "TABLE", "CHAIR"], loading="selectin")
+
+    assert sorted(products) == ["CHAIR", "LAMP", "TABLE"]
+    assert cache.hits == 2
+    assert [s for s in statements if "IN (?, ?)" in s] == statements[:1]
+    assert "version_number" in statements[0]
+
+
+def test_reloads_when_the_version_has_moved_on(
+        uow, cache, session_factory
+):
+    add_product(uow, "LAMP")
+    session = session_factory()
+    session.execute(
+        "UPDATE batches SET _purchased_quantity = 5 WHERE sku = 'LAMP'")
+    session.execute(
+        "UPDATE products SET version_number = version_number + 1"
+        " WHERE sku = 'LAMP'")
+    session.commit()
+
+    with uow:
+        product = uow.products.get("LAMP")
+        assert product.batches[0]._purchased_quantity == 5
+
+    assert cache.stale == 1
+
+
+def test_rolled_back_changes_are_not_cached(uow, cache):
+    add_product(uow, "LAMP")
+    with uow:
+        uow.products.get("LAMP").allocate(model.OrderLine("o1", "LAMP", 10))
+
+    assert len(cache) == 0
+    with uow:
+        assert uow.products.get("LAMP").batches[0].available_quantity == 100
+
+
+def test_evicts_the_least_recently_committed_product(uow, cache):
+    for sku in ["LAMP", "SOFA", "TABLE"]:
+        add_product(uow, sku)
+
+    assert cache.checkout("LAMP") is None
+    assert cache.checkout("TABLE").sku == "TABLE"
+    assert cache.evictions == 1
+
+
+def test_events_are_collected_after_the_product_is_released(uow):
+    add_product(uow, "LAMP")
+    allocate(uow, "o1", "LAMP")
+
+    assert [type(e).__name__ for e in uow.collect_new_events()] \
+        == ["Allocated"]
+    assert list(uow.collect_new_events()) == []
+
+
+def test_finds_products_by_batchref_through_the_cache(uow, cache):
+    add_product(uow, "LAMP")
+    with uow:
+        product = uow.products.get_by_batchref("LAMP-batch")
+        assert product.sku == "LAMP"
+
+    assert cache.hits == 1
+
+
+def test_repository_without_version_checks_never_trusts_the_cache(cache):
+    stored = model.Product("LAMP", [])
+    repo = FakeRepository([stored])
+    repo.cache = cache
+    cache.put(model.Product("LAMP", [], version_number=7))
+
+    assert repo.get("LAMP") is stored
+    assert cache.stale == 1
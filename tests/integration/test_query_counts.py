@@ -0,0 +1,140 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import clear_mappers
+
+from allocation import bootstrap, views
+from allocation.adapters import repository
+from allocation.domain import commands
+from allocation.service_layer import unit_of_work
+from ..fakes import FakeNotifications
+
+
+@pytest.fixture
+def bus(sqlite_session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(
+            sqlite_session_factory,
+            batchref_index=repository.BatchrefIndex()),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+    )
+    yield bus
+    clear_mappers()
+
+
+@pytest.fixture
+def cached_bus(sqlite_session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(
+            sqlite_session_factory,
+            product_cache=repository.ProductCache(16),
+            batchref_index=repository.BatchrefIndex()),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+    )
+    yield bus
+    clear_mappers()
+
+
+@pytest.fixture
+def statements(in_memory_db):
+    executed = []
+    event.listen(in_memory_db, "before_cursor_execute",
+                 lambda *args: executed.append(args[2]))
+    return executed
+
+
+def add_stock(bus, batch_count):
+    for i in range(batch_count):
+        bus.handle(commands.CreateBatch(f"batch-{i}", "LAMP", 10, None))
+        bus.handle(commands.Allocate(f"order-{i}", "LAMP", 10))
+    bus.handle(commands.CreateBatch("spare", "LAMP", 1000, None))
+
+
+def count_statements(bus, statements, command):
+    statements.clear()
+    bus.handle(command)
+    return len(statements)
+
+
+@pytest.mark.parametrize("batch_count", [1, 10, 50])
+def test_allocate_runs_a_fixed_number_of_statements(
+        bus, statements, batch_count
+):
+    add_stock(bus, batch_count)
+    assert count_statements(
+        bus, statements, commands.Allocate("new-order", "LAMP", 1)) == 9
+
+
+def test_allocate_does_not_load_allocated_order_lines(bus, statements):
+    add_stock(bus, 10)
+    statements.clear()
+
+    bus.handle(commands.Allocate("new-order", "LAMP", 1))
+
+    assert not any("order_lines.quantity" in s for s in statements)
+
+
+def test_allocate_after_a_savepoint_rollback_runs_the_same_statements(
+        cached_bus, statements
+):
+    bus = cached_bus
+    add_stock(bus, 10)
+    bus.uow.product_cache.clear()
+    bus.handle(commands.Allocate("order-a", "LAMP", 1))
+    expected = count_statements(
+        bus, statements, commands.Allocate("order-b", "LAMP", 1))
+
+    uow = bus.uow
+    with uow.cascade():
+        with pytest.raises(ValueError):
+            with uow:
+                uow.products.get("LAMP", loading="counts_only")
+                raise ValueError()
+
+    assert count_statements(
+        bus, statements, commands.Allocate("order-c", "LAMP", 1)) == expected
+
+
+@pytest.mark.parametrize("batch_count", [1, 10, 50])
+def test_add_batch_runs_a_fixed_number_of_statements(
+        bus, statements, batch_count
+):
+    add_stock(bus, batch_count)
+    assert count_statements(
+        bus, statements,
+        commands.CreateBatch("new-batch", "LAMP", 10, None)) == 4
+
+
+@pytest.mark.parametrize("batch_count", [1, 10, 50])
+def test_change_batch_quantity_runs_a_fixed_number_of_statements(
+        bus, statements, batch_count
+):
+    add_stock(bus, batch_count)
+    assert count_statements(
+        bus, statements, commands.ChangeBatchQuantity("spare", 500)) == 5
+
+
+@pytest.mark.parametrize("sku_count", [1, 10, 30])
+def test_allocate_order_loads_products_in_a_fixed_number_of_queries(
+        bus, statements, sku_count
+):
+    skus = [f"SKU-{i}" for i in range(sku_count)]
+    for sku in skus:
+        bus.handle(commands.CreateBatch(f"batch-{sku}", sku, 10, None))
+        bus.handle(commands.Allocate("old-order", sku, 1))
+
+    statements.clear()
+    bus.handle(commands.AllocateOrder("new-order", [(sku, 1) for sku in skus]))
+
+    assert len([s for s in statements if s.startswith("SELECT")]) == 3
+
+
+def test_lookup_runs_one_query_per_chunk(bus, statements):
+    views.allocations_for_orders(
+        [f"order-{i}" for i in range(5)], bus.uow, chunk_size=2)
+
+    assert [s.count("?") for s in statements
+            if "allocations_view" in s] == [2, 2, 1]
@@ -0,0 +1,100 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import clear_mappers
+
+from allocation import bootstrap, views
+from allocation.adapters import repository
+from allocation.domain import commands
+from allocation.service_layer import handlers, unit_of_work
+from ..fakes import FakeNotifications
+
+
+@pytest.fixture
+def bus(sqlite_session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+    )
+    for sku in ["LAMP", "TABLE"]:
+        for i in range(3):
+            bus.handle(commands.CreateBatch(f"{sku}-{i}", sku, 10, None))
+            bus.handle(commands.Allocate(f"order-{i}", sku, 5))
+    yield bus
+    clear_mappers()
+
+
+@pytest.fixture
+def statements(in_memory_db):
+    executed = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0]
+        executed.append((statement, parameters))
+
+    event.listen(in_memory_db, "before_cursor_execute", capture)
+    return executed
+
+
+def full_scans(engine, statements):
+    scans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            if not statement.lstrip().upper().startswith(
+                    ("SELECT", "UPDATE", "DELETE")):
+                continue
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            scans.extend(
+                (detail, statement) for *_, detail in plan
+                if detail.startswith("SCAN") and "CONSTANT ROW" not in detail
+            )
+    return scans
+
+
+def product_loads(loading):
+    def run(bus):
+        with bus.uow:
+            bus.uow.products.get("LAMP", loading=loading)
+            bus.uow.products.get_many(["LAMP", "TABLE"], loading=loading)
+            for batch in bus.uow.products.get("TABLE").batches:
+                batch.available_quantity
+    return run
+
+
+def batchref_lookups(bus):
+    bus.uow.batchref_index = None
+    with bus.uow:
+        bus.uow.products.get_by_batchref("TABLE-1", loading="selectin")
+    bus.uow.batchref_index = repository.BatchrefIndex()
+    with bus.uow:
+        bus.uow.products.get_by_batchref("TABLE-2", loading="selectin")
+
+
+@pytest.mark.parametrize("operation", [
+    pytest.param(product_loads(loading), id=f"get-{loading}")
+    for loading in sorted({"lazy", *handlers.LOADING_PROFILES.values()})
+] + [
+    pytest.param(batchref_lookups, id="get_by_batchref"),
+    pytest.param(lambda bus: bus.handle(
+        commands.CreateBatch("LAMP-new", "LAMP", 10, None)),
+        id="create_batch"),
+    pytest.param(lambda bus: bus.handle(
+        commands.Allocate("new-order", "LAMP", 1)), id="allocate"),
+    pytest.param(lambda bus: bus.handle(commands.AllocateOrder(
+        "new-order", [("LAMP", 1), ("TABLE", 1)])), id="allocate_order"),
+    pytest.param(lambda bus: bus.handle(
+        commands.ChangeBatchQuantity("LAMP-1", 2)),
+        id="change_batch_quantity"),
+    pytest.param(lambda bus: views.allocations("order-1", bus.uow),
+                 id="allocations_view"),
+])
+def test_hot_queries_do_not_scan_whole_tables(
+        bus, statements, in_memory_db, operation
+):
+    operation(bus)
+
+    assert statements
+    assert full_scans(in_memory_db, statements) == []
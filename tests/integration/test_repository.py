@@ -1,3 +1,6 @@
+import pytest
+from sqlalchemy import event, inspect
+
 from allocation.domain import model
 from allocation.adapters import repository
 
@@ -101,3 +104,71 @@ def test_updating_a_batch(session):
     session.commit()
 
     assert get_allocations(session, "batch1") == {"order1", "order2"}
+
+
+@pytest.mark.parametrize(
+    "loading", ["lazy", "selectin", "joined", "counts_only"])
+def test_loading_profiles_load_the_same_quantities(session, loading):
+    order_line_id = insert_order_line(session)
+    batch_1_id = insert_batch(session, "batch1")
+    insert_batch(session, "batch2")
+    insert_allocation(session, order_line_id, batch_1_id)
+    session.commit()
+
+    repo = repository.SqlAlchemyRepository(session)
+    product = repo.get("GENERIC-SOFA", loading=loading)
+
+    assert [b.available_quantity for b in product.batches] == [88, 100]
+
+
+def test_batches_are_indexed_by_reference(in_memory_db):
+    assert ["reference"] in [index["column_names"] for index in
+                             inspect(in_memory_db).get_indexes("batches")]
+
+
+def test_get_by_batchref_resolves_the_sku_from_loaded_products(
+        session, in_memory_db
+):
+    insert_batch(session, "batch1")
+    insert_batch(session, "batch2")
+    session.commit()
+    batchrefs = repository.BatchrefIndex()
+    repository.SqlAlchemyRepository(session, batchrefs=batchrefs).get(
+        "GENERIC-SOFA", loading="selectin")
+    session.expunge_all()
+    statements = []
+    event.listen(in_memory_db, "before_cursor_execute",
+                 lambda *args: statements.append(args[2]))
+
+    repo = repository.SqlAlchemyRepository(session, batchrefs=batchrefs)
+    product = repo.get_by_batchref("batch2")
+
+    assert product.sku == "GENERIC-SOFA"
+    assert not any("batches.reference =" in s for s in statements)
+
+
+def test_get_by_batchref_ignores_a_wrong_index_entry(session):
+    insert_batch(session, "batch1")
+    session.execute(
+        "INSERT INTO products (sku, version_number) VALUES ('OTHER-SOFA', 0)")
+    session.commit()
+    batchrefs = repository.BatchrefIndex()
+    batchrefs.put("batch1", "OTHER-SOFA")
+
+    repo = repository.SqlAlchemyRepository(session, batchrefs=batchrefs)
+
+    assert repo.get_by_batchref("batch1").sku == "GENERIC-SOFA"
+    assert batchrefs.get("batch1") == "GENERIC-SOFA"
+    assert repo.get_by_batchref("missing") is None
+
+
+def test_batchref_index_evicts_the_least_recently_used_reference():
+    batchrefs = repository.BatchrefIndex(maxsize=2)
+    batchrefs.put("b1", "SOFA")
+    batchrefs.put("b2", "SOFA")
+    batchrefs.get("b1")
+    batchrefs.put("b3", "LAMP")
+
+    assert len(batchrefs) == 2
+    assert batchrefs.get("b2") is None
+    assert batchrefs.get("b1") == "SOFA"
@@ -1,10 +1,18 @@
 import threading
 import time
 import traceback
+from unittest import mock
 
 import pytest
-from allocation.domain import model
-from allocation.service_layer import unit_of_work
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, clear_mappers
+from sqlalchemy.orm.exc import StaleDataError
+from tenacity import wait_random
+
+from allocation import bootstrap
+from allocation.adapters import orm
+from allocation.domain import commands, model
+from allocation.service_layer import messagebus, unit_of_work
 from tests.e2e.test_api import random_sku, random_batchref, random_order_id
 
 
@@ -50,6 +58,22 @@ def test_uow_can_retrieve_a_batch_and_allocate_to_it(session_factory):
     assert batchref == "batch1"
 
 
+def test_numpy_engine_threshold_is_set_per_unit_of_work(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "HIPSTER-WORKBENCH", 100, None)
+    session.commit()
+
+    small = unit_of_work.SqlAlchemyUnitOfWork(
+        session_factory, numpy_engine_threshold=1)
+    default = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with small:
+        assert small.products.get(
+            "HIPSTER-WORKBENCH").numpy_engine_threshold == 1
+    with default:
+        assert default.products.get(
+            "HIPSTER-WORKBENCH").numpy_engine_threshold == 500
+
+
 def test_rolls_back_uncommitted_work_by_default(session_factory):
     session = session_factory()
     uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
@@ -77,6 +101,94 @@ def test_rolls_back_on_error(session_factory):
     assert rows == []
 
 
+def test_threads_sharing_a_uow_get_their_own_session(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    sessions = []
+    both_entered = threading.Barrier(2, timeout=1)
+
+    def use_uow():
+        with uow:
+            both_entered.wait()
+            sessions.append(uow.session)
+
+    threads = [threading.Thread(target=use_uow) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(sessions) == 2
+    assert sessions[0] is not sessions[1]
+
+
+@pytest.fixture
+def file_session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+
+
+def test_stale_version_number_is_a_conflict(file_session_factory):
+    session = file_session_factory()
+    insert_batch(session, "batch1", "LARGE-FORK", 100, None)
+    session.commit()
+    first = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+    second = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+
+    with pytest.raises(StaleDataError) as conflict:
+        with first:
+            product = first.products.get(sku="LARGE-FORK")
+            with second:
+                second.products.get(sku="LARGE-FORK").allocate(
+                    model.OrderLine("o2", "LARGE-FORK", 10))
+                second.commit()
+            product.allocate(model.OrderLine("o1", "LARGE-FORK", 10))
+            first.commit()
+
+    assert unit_of_work.is_concurrency_conflict(conflict.value)
+    assert get_allocated_batch_ref(session, "o2", "LARGE-FORK") == "batch1"
+    assert list(session.execute(
+        "SELECT order_id FROM order_lines")) == [("o2",)]
+
+
+def test_contended_allocations_are_retried_not_lost(file_session_factory):
+    session = file_session_factory()
+    insert_batch(session, "batch1", "LARGE-FORK", 100, None)
+    session.commit()
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(file_session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        command_retry_policy=messagebus.RetryPolicy(
+            attempts=50, wait=wait_random(0, 0.01),
+            is_retryable=unit_of_work.is_concurrency_conflict),
+    )
+    exceptions = []
+
+    def allocate_orders(thread):
+        try:
+            for i in range(5):
+                bus.handle(commands.Allocate(f"o{thread}-{i}", "LARGE-FORK", 1))
+        except Exception as e:
+            exceptions.append(e)
+
+    threads = [threading.Thread(target=allocate_orders, args=(t,))
+               for t in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert exceptions == []
+    [[version, allocated]] = session.execute(
+        "SELECT version_number, (SELECT COUNT(*) FROM allocations)"
+        " FROM products WHERE sku = 'LARGE-FORK'")
+    assert (version, allocated) == (21, 20)
+
+
 def try_to_allocate(order_id, sku, exceptions):
     line = model.OrderLine(order_id, sku, 10)
     try:
@@ -5,23 +5,33 @@ import pytest
 
 from sqlalchemy.orm import clear_mappers
 from allocation import views, bootstrap
+from allocation.adapters import read_models
 from allocation.domain import commands
 from allocation.service_layer import unit_of_work, messagebus
+from ..fakes import FakeRedis
 
 today = date.today()
 
+@pytest.fixture(params=["sql", "redis"])
+def read_model(request):
+    if request.param == "redis":
+        return read_models.RedisReadModel(FakeRedis())
+    return read_models.SqlAlchemyReadModel()
+
+
 @pytest.fixture
-def sqlite_bus(sqlite_session_factory):
+def sqlite_bus(sqlite_session_factory, read_model):
     bus = bootstrap.bootstrap(
         start_orm=True,
         uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
         notifications=mock.Mock(),
         publish= lambda *args: None,
+        read_model=read_model,
     )
     yield bus
     clear_mappers()
 
-def test_allocations_view(sqlite_bus):
+def test_allocations_view(sqlite_bus, read_model):
     sqlite_bus.handle(commands.CreateBatch("sku1batch", "sku1", 50, None))
     sqlite_bus.handle(commands.CreateBatch("sku2batch", "sku2", 50, None))
     sqlite_bus.handle(commands.Allocate("order1", "sku1", 20))
@@ -32,19 +42,81 @@ def test_allocations_view(sqlite_bus):
     sqlite_bus.handle(commands.Allocate("order2", "sku1", 20))
     sqlite_bus.handle(commands.Allocate("order2", "sku2", 20))
 
-    assert views.allocations("order1", sqlite_bus.uow) == [
+    assert views.allocations(
+        "order1", sqlite_bus.uow, read_model=read_model) == [
         {"sku": "sku1", "batchref": "sku1batch"},
         {"sku": "sku2", "batchref": "sku2batch"},
     ]
 
-def test_deallocate(sqlite_bus):
+def test_deallocate(sqlite_bus, read_model):
     sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
     sqlite_bus.handle(commands.CreateBatch("b2", "sku1", 50, today))
     sqlite_bus.handle(commands.Allocate("o1", "sku1", 40))
     sqlite_bus.handle(commands.ChangeBatchQuantity("b1", 10))
 
-    assert views.allocations("o1", sqlite_bus.uow) == [
+    assert views.allocations(
+        "o1", sqlite_bus.uow, read_model=read_model) == [
         {"sku": "sku1", "batchref": "b2"},
     ]
 
 
+def test_bulk_allocation_updates_the_view(sqlite_bus, read_model):
+    sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+    sqlite_bus.handle(commands.AllocateMany(
+        "sku1", [("o1", 10), ("o2", 10), ("o3", 10)]))
+
+    for order_id in ["o1", "o2", "o3"]:
+        assert views.allocations(
+            order_id, sqlite_bus.uow, read_model=read_model) == [
+            {"sku": "sku1", "batchref": "b1"},
+        ]
+
+
+def test_lookup_returns_every_order_keyed_by_id(sqlite_bus, read_model):
+    sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+    sqlite_bus.handle(commands.CreateBatch("b2", "sku2", 50, None))
+    sqlite_bus.handle(commands.AllocateMany(
+        "sku1", [("o1", 10), ("o2", 10), ("o3", 10)]))
+    sqlite_bus.handle(commands.Allocate("o1", "sku2", 10))
+
+    assert views.allocations_for_orders(
+        ["o3", "o1", "unknown", "o2", "o1"], sqlite_bus.uow,
+        read_model=read_model, chunk_size=2,
+    ) == {
+        "o3": [{"sku": "sku1", "batchref": "b1"}],
+        "o1": [{"sku": "sku1", "batchref": "b1"},
+               {"sku": "sku2", "batchref": "b2"}],
+        "unknown": [],
+        "o2": [{"sku": "sku1", "batchref": "b1"}],
+    }
+
+
+def test_cached_view_is_invalidated_by_the_read_model_handlers(
+        sqlite_session_factory
+):
+    cache = views.AllocationsCache()
+    broadcast = []
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        views_cache=cache,
+        broadcast_view_invalidations=broadcast.append,
+    )
+    try:
+        bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+        bus.handle(commands.CreateBatch("b2", "sku1", 50, today))
+        bus.handle(commands.Allocate("o1", "sku1", 40))
+        assert views.allocations("o1", bus.uow, cache=cache) == [
+            {"sku": "sku1", "batchref": "b1"},
+        ]
+
+        bus.handle(commands.ChangeBatchQuantity("b1", 10))
+
+        assert views.allocations("o1", bus.uow, cache=cache) == [
+            {"sku": "sku1", "batchref": "b2"},
+        ]
+        assert broadcast == [{"o1"}, {"o1"}]
+    finally:
+        clear_mappers()
@@ -1,5 +1,5 @@
 from datetime import date
-from src.allocation.domain.model import Batch, OrderLine
+from allocation.domain.model import Batch, OrderLine
 
 
 def test_allocating_to_a_batch_reduces_the_available_quantity():
@@ -57,3 +57,33 @@ def test_can_only_deallocate_allocated_lines():
     batch, unallocated_line = make_batch_and_line("DECORATIVE-TRINKTE", 20, 2)
     batch.deallocate(unallocated_line)
     assert batch.available_quantity == 20
+
+
+def test_deallocate_one_releases_its_quantity():
+    batch, line = make_batch_and_line("ANGULAR-DESK", 20, 2)
+    batch.allocate(line)
+    assert batch.deallocate_one() == line
+    assert batch.allocated_quantity == 0
+    assert batch.available_quantity == 20
+
+
+def test_deferred_batch_keeps_lines_allocated_before_they_are_loaded():
+    batch, line = make_batch_and_line("ANGULAR-DESK", 20, 2)
+    batch.defer_lines()
+
+    batch.allocate(line)
+
+    assert batch.available_quantity == 18
+    assert batch.is_allocated(line)
+    batch.deallocate(line)
+    assert batch.available_quantity == 20
+
+
+def test_unknown_counter_is_rebuilt_from_allocations():
+    batch, line = make_batch_and_line("ANGULAR-DESK", 20, 2)
+    batch.allocate(line)
+    batch.allocate(OrderLine("order-456", "ANGULAR-DESK", 5))
+    batch._allocated_quantity = None
+    assert batch.allocated_quantity == 7
+    batch.deallocate(line)
+    assert batch.available_quantity == 15
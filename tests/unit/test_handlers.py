@@ -1,55 +1,12 @@
-from collections import defaultdict
 from datetime import date
 from unittest import mock
 
 import pytest
 
 from allocation import bootstrap
-from allocation.domain import commands
-from allocation.adapters import repository
+from allocation.domain import commands, events, model
 from allocation.service_layer import handlers
-from allocation.service_layer import unit_of_work
-from allocation.adapters import notifications
-
-
-class FakeRepository(repository.AbstractRepository):
-    def __init__(self, products):
-        super().__init__()
-        self._products = set(products)
-
-    def _add(self, product):
-        self._products.add(product)
-
-    def _get(self, sku):
-        return next((p for p in self._products if p.sku == sku), None)
-
-    def _get_by_batchref(self, batchref):
-        return next(
-            (p for p in self._products for b in p.batches if
-             b.reference == batchref),
-            None,
-        )
-
-
-class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
-
-    def __init__(self):
-        self.products = FakeRepository([])
-        self.committed = False
-
-    def _commit(self):
-        self.committed = True
-
-    def rollback(self):
-        pass
-
-
-class FakeNotifications(notifications.AbstractNotification):
-    def __init__(self):
-        self.sent = defaultdict(list)
-
-    def send(self, destination, message):
-        self.sent[destination].append(message)
+from ..fakes import FakeNotifications, FakeUnitOfWork
 
 
 def bootstrap_test_app():
@@ -61,6 +18,22 @@ def bootstrap_test_app():
     )
 
 
+def test_bootstrap_does_not_configure_the_callers_uow():
+    uow = FakeUnitOfWork()
+    bootstrap.bootstrap(
+        start_orm=False,
+        uow=uow,
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+        numpy_engine_threshold=1,
+        outbox=True,
+        product_cache_size=10,
+    )
+    assert model.Product.numpy_engine_threshold == 500
+    assert not hasattr(uow, "outbox_event_types")
+    assert not hasattr(uow, "product_cache")
+
+
 class TestAddBatch:
     def test_add_batch_for_new_product(self):
         bus = bootstrap_test_app()
@@ -96,6 +69,33 @@ class TestAllocate:
         with pytest.raises(handlers.InvalidSku):
             bus.handle(commands.Allocate("o1", "NONEXISTENTSKU", 10))
 
+    def test_publishes_allocated_event(self):
+        published = []
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=FakeUnitOfWork(),
+            notifications=FakeNotifications(),
+            publish=lambda *args: published.append(args),
+        )
+        bus.handle(
+            commands.CreateBatch("batch1", "COMPLICATED-LAMP", 100, None))
+        bus.handle(commands.Allocate("o1", "COMPLICATED-LAMP", 10))
+
+        assert published == [(
+            "line_allocated",
+            events.Allocated("o1", "COMPLICATED-LAMP", 10, "batch1"),
+        )]
+
+    def test_retried_allocation_is_not_allocated_twice(self):
+        bus = bootstrap_test_app()
+        bus.handle(
+            commands.CreateBatch("batch1", "COMPLICATED-LAMP", 100, None))
+        bus.handle(commands.Allocate("o1", "COMPLICATED-LAMP", 10))
+        bus.handle(commands.Allocate("o1", "COMPLICATED-LAMP", 10))
+
+        [batch] = bus.uow.products.get("COMPLICATED-LAMP").batches
+        assert batch.available_quantity == 90
+
     def test_commits(self):
         bus = bootstrap_test_app()
         bus.handle(
@@ -133,6 +133,80 @@ class TestAllocate:
         ]
 
 
+class TestAllocateMany:
+    def test_returns_a_batchref_per_line(self):
+        fake_notifs = FakeNotifications()
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=FakeUnitOfWork(),
+            notifications=fake_notifs,
+            publish=lambda *args: None,
+        )
+        bus.handle(
+            commands.CreateBatch("batch1", "COMPLICATED-LAMP", 30, None))
+
+        [results] = bus.handle(commands.AllocateMany(
+            "COMPLICATED-LAMP", [("o1", 10), ("o2", 10), ("o3", 20)]))
+
+        assert results == ["batch1", "batch1", None]
+        [batch] = bus.uow.products.get("COMPLICATED-LAMP").batches
+        assert batch.available_quantity == 10
+        assert fake_notifs.sent["stock@made.com"] == [
+            "Out of stock for COMPLICATED-LAMP"
+        ]
+
+    def test_errors_for_invalid_sku(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "AREALSKU", 100, None))
+
+        with pytest.raises(handlers.InvalidSku):
+            bus.handle(commands.AllocateMany("NONEXISTENTSKU", [("o1", 10)]))
+
+
+class TestAllocateOrder:
+    def test_returns_a_batchref_per_line_in_order(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("lamp", "COMPLICATED-LAMP", 30, None))
+        bus.handle(commands.CreateBatch("table", "SMALL-TABLE", 5, None))
+
+        [results] = bus.handle(commands.AllocateOrder("o1", [
+            ("SMALL-TABLE", 10), ("COMPLICATED-LAMP", 10),
+        ]))
+
+        assert results == [None, "lamp"]
+        [lamp] = bus.uow.products.get("COMPLICATED-LAMP").batches
+        assert lamp.available_quantity == 20
+        assert bus.uow.committed
+
+    def test_unknown_sku_rejects_the_whole_order(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "AREALSKU", 100, None))
+        bus.uow.committed = False
+
+        with pytest.raises(handlers.InvalidSku, match="NONEXISTENTSKU"):
+            bus.handle(commands.AllocateOrder("o1", [
+                ("AREALSKU", 10), ("NONEXISTENTSKU", 10),
+            ]))
+
+        [batch] = bus.uow.products.get("AREALSKU").batches
+        assert batch.available_quantity == 100
+        assert not bus.uow.committed
+
+    def test_repeated_sku_rejects_the_whole_order(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+        bus.uow.committed = False
+
+        with pytest.raises(handlers.InvalidSku, match="Repeated sku LAMP"):
+            bus.handle(commands.AllocateOrder("o1", [
+                ("LAMP", 3), ("LAMP", 5),
+            ]))
+
+        [batch] = bus.uow.products.get("LAMP").batches
+        assert batch.available_quantity == 100
+        assert not bus.uow.committed
+
+
 class TestChangeBatchQuantity:
     def test_changes_available_quantity(self):
         bus = bootstrap_test_app()
@@ -167,3 +241,25 @@ class TestChangeBatchQuantity:
 
         assert batch1.available_quantity == 5
         assert batch2.available_quantity == 30
+
+
+class TestShipBatch:
+    def test_shipped_batch_takes_no_more_allocations(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("batch1", "CRUNCHY-ARMCHAIR", 100, None))
+        bus.handle(commands.CreateBatch(
+            "batch2", "CRUNCHY-ARMCHAIR", 100, date.today()))
+
+        bus.handle(commands.ShipBatch("batch1"))
+        bus.handle(commands.Allocate("o1", "CRUNCHY-ARMCHAIR", 10))
+
+        [batch1, batch2] = bus.uow.products.get("CRUNCHY-ARMCHAIR").batches
+        assert batch1.shipped
+        assert batch1.available_quantity == 0
+        assert batch2.available_quantity == 90
+
+    def test_errors_for_invalid_batchref(self):
+        bus = bootstrap_test_app()
+
+        with pytest.raises(handlers.InvalidBatchref):
+            bus.handle(commands.ShipBatch("nonexistent"))
@@ -0,0 +1,224 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+from tenacity import wait_none
+
+from allocation import bootstrap
+from allocation.domain import commands, events
+from allocation.service_layer import handlers, messagebus, unit_of_work
+from ..fakes import FakeUnitOfWork, FakeNotifications
+
+
+def bus_with_event_handler(handler, retry_policy):
+    return messagebus.MessageBus(
+        uow=FakeUnitOfWork(),
+        event_handlers={events.OutOfStock: [retry_policy.wrap(handler)]},
+        command_handlers={},
+    )
+
+
+class TestRetryPolicy:
+    def test_retries_transient_errors(self):
+        calls = []
+
+        def flaky_handler(event):
+            calls.append(event)
+            if len(calls) < 3:
+                raise ConnectionError("try again")
+
+        policy = messagebus.RetryPolicy(
+            retryable=(ConnectionError,), attempts=3, wait=wait_none())
+        bus_with_event_handler(flaky_handler, policy).handle(
+            events.OutOfStock("sku"))
+
+        assert len(calls) == 3
+
+    def test_fails_fast_on_fatal_errors(self):
+        calls = []
+
+        def broken_handler(event):
+            calls.append(event)
+            raise ValueError("a bug")
+
+        policy = messagebus.RetryPolicy(
+            retryable=(ConnectionError,), attempts=3, wait=wait_none())
+        bus_with_event_handler(broken_handler, policy).handle(
+            events.OutOfStock("sku"))
+
+        assert len(calls) == 1
+
+
+class ConflictingUnitOfWork(FakeUnitOfWork):
+    def __init__(self, conflicts):
+        super().__init__()
+        self.conflicts = conflicts
+        self.attempts = 0
+
+    def _commit(self):
+        self.attempts += 1
+        if self.attempts <= self.conflicts:
+            raise StaleDataError("version_number has moved on")
+        super()._commit()
+
+
+class TestCommandRetries:
+    def bus(self, uow):
+        return bootstrap.bootstrap(
+            start_orm=False,
+            uow=uow,
+            notifications=FakeNotifications(),
+            publish=lambda *args: None,
+            command_retry_policy=messagebus.RetryPolicy(
+                attempts=3, wait=wait_none(),
+                is_retryable=unit_of_work.is_concurrency_conflict),
+        )
+
+    def test_reruns_the_command_after_a_version_conflict(self):
+        uow = ConflictingUnitOfWork(conflicts=0)
+        bus = self.bus(uow)
+        bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+        uow.conflicts, uow.attempts = 2, 0
+
+        bus.handle(commands.Allocate("o1", "LAMP", 10))
+
+        assert uow.products.get("LAMP").batches[0].available_quantity == 90
+        assert uow.attempts == 3
+        assert uow.committed
+
+    def test_gives_up_after_the_last_attempt(self):
+        uow = ConflictingUnitOfWork(conflicts=0)
+        bus = self.bus(uow)
+        bus.handle(commands.CreateBatch("b1", "LAMP", 100, None))
+        uow.conflicts, uow.attempts = 5, 0
+
+        with pytest.raises(StaleDataError):
+            bus.handle(commands.Allocate("o1", "LAMP", 10))
+        assert uow.attempts == 3
+
+    def test_does_not_rerun_other_errors(self):
+        uow = ConflictingUnitOfWork(conflicts=0)
+
+        with pytest.raises(handlers.InvalidSku):
+            self.bus(uow).handle(commands.Allocate("o1", "NOPE", 10))
+        assert uow.attempts == 0
+
+
+class TestBatchableHandlers:
+    def test_run_after_the_rest_of_the_cascade(self):
+        calls = []
+
+        @handlers.batchable
+        def batch_handler(batch):
+            calls.append(("batch", [e.sku for e in batch]))
+
+        def single_handler(event):
+            calls.append(("single", event.sku))
+
+        bus = messagebus.MessageBus(
+            uow=FakeUnitOfWork(),
+            event_handlers={
+                events.OutOfStock: [batch_handler, single_handler]},
+            command_handlers={},
+        )
+        bus.handle(events.OutOfStock("sku"))
+
+        assert calls == [("single", "sku"), ("batch", ["sku"])]
+
+    def test_receive_every_event_of_the_cascade_at_once(self):
+        published = []
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=FakeUnitOfWork(),
+            notifications=FakeNotifications(),
+            publish=lambda channel, *events: published.append(events),
+        )
+        bus.handle(
+            commands.CreateBatch("batch1", "COMPLICATED-LAMP", 100, None))
+        bus.handle(commands.AllocateMany(
+            "COMPLICATED-LAMP", [("o1", 10), ("o2", 10), ("o3", 10)]))
+
+        [batch] = published
+        assert [e.order_id for e in batch] == ["o1", "o2", "o3"]
+
+
+class TestAsyncMessageBus:
+    def test_runs_handlers_of_one_event_concurrently(self):
+        both_started = threading.Barrier(2, timeout=1)
+        handled = []
+
+        def handler(event):
+            both_started.wait()
+            handled.append(event)
+
+        bus = messagebus.AsyncMessageBus(
+            uow=FakeUnitOfWork(),
+            event_handlers={events.OutOfStock: [handler, handler]},
+            command_handlers={},
+        )
+        asyncio.run(bus.handle(events.OutOfStock("sku")))
+
+        assert len(handled) == 2
+
+    def test_caps_handlers_in_flight(self):
+        in_flight, peak = [], []
+
+        def handler(event):
+            in_flight.append(event)
+            peak.append(len(in_flight))
+            time.sleep(0.01)
+            in_flight.pop()
+
+        bus = messagebus.AsyncMessageBus(
+            uow=FakeUnitOfWork(),
+            event_handlers={events.OutOfStock: [handler] * 6},
+            command_handlers={},
+            max_in_flight=2,
+        )
+        asyncio.run(bus.handle(events.OutOfStock("sku")))
+
+        assert len(peak) == 6
+        assert max(peak) == 2
+
+    def test_commands_behave_as_on_the_sync_bus(self):
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=FakeUnitOfWork(),
+            notifications=FakeNotifications(),
+            publish=lambda *args: None,
+            asynchronous=True,
+        )
+        asyncio.run(bus.handle(
+            commands.CreateBatch("batch1", "COMPLICATED-LAMP", 100, None)))
+
+        assert asyncio.run(bus.handle(
+            commands.AllocateMany("COMPLICATED-LAMP", [("o1", 10)]))
+        ) == [["batch1"]]
+        with pytest.raises(handlers.InvalidSku):
+            asyncio.run(bus.handle(
+                commands.Allocate("o1", "NONEXISTENTSKU", 10)))
+
+    def test_flushes_batched_handlers_concurrently(self):
+        both_started = threading.Barrier(2, timeout=1)
+        handled = []
+
+        @handlers.batchable
+        def first(batch):
+            both_started.wait()
+            handled.append(("first", batch))
+
+        @handlers.batchable
+        def second(batch):
+            both_started.wait()
+            handled.append(("second", batch))
+
+        bus = messagebus.AsyncMessageBus(
+            uow=FakeUnitOfWork(),
+            event_handlers={events.OutOfStock: [first, second]},
+            command_handlers={},
+        )
+        asyncio.run(bus.handle(events.OutOfStock("sku")))
+
+        assert sorted(name for name, _ in handled) == ["first", "second"]
@@ -0,0 +1,91 @@
+from tenacity import wait_none
+
+from allocation import bootstrap, metrics
+from allocation.domain import commands, events
+from allocation.service_layer import messagebus
+from ..fakes import FakeUnitOfWork, FakeNotifications
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    histogram = registry.histogram(
+        "latency_seconds", "Latency", ["handler"], buckets=(0.1, 1))
+    histogram.observe(0.05, "allocate")
+    histogram.observe(0.5, "allocate")
+    histogram.observe(5, "allocate")
+
+    assert registry.render().splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{handler="allocate",le="0.1"} 1',
+        'latency_seconds_bucket{handler="allocate",le="1"} 2',
+        'latency_seconds_bucket{handler="allocate",le="+Inf"} 3',
+        'latency_seconds_sum{handler="allocate"} 5.55',
+        'latency_seconds_count{handler="allocate"} 3',
+    ]
+
+
+def test_counter_escapes_label_values():
+    registry = metrics.Registry()
+    counter = registry.counter("errors_total", "Errors", ["handler"])
+    counter.inc('say "hi"')
+    counter.inc('say "hi"')
+
+    assert 'errors_total{handler="say \\"hi\\""} 2' in registry.render()
+
+
+def make_bus(**kwargs):
+    return bootstrap.bootstrap(
+        start_orm=False,
+        uow=FakeUnitOfWork(),
+        notifications=FakeNotifications(),
+        publish=lambda *args: None,
+        **kwargs,
+    )
+
+
+def test_bus_records_commands_handlers_and_cascades():
+    bus = make_bus()
+    commands_before = metrics.MESSAGE_SECONDS.count("command", "CreateBatch")
+    handler_before = metrics.HANDLER_SECONDS.count("allocate")
+    cascades_before = metrics.CASCADE_MESSAGES.count()
+
+    bus.handle(commands.CreateBatch("b1", "LAMP", 10, None))
+    bus.handle(commands.Allocate("o1", "LAMP", 1))
+
+    assert metrics.MESSAGE_SECONDS.count(
+        "command", "CreateBatch") == commands_before + 1
+    assert metrics.HANDLER_SECONDS.count("allocate") == handler_before + 1
+    assert metrics.CASCADE_MESSAGES.count() == cascades_before + 2
+
+
+def test_failed_commands_are_counted():
+    bus = make_bus()
+    before = metrics.MESSAGE_ERRORS.value("command", "Allocate")
+    try:
+        bus.handle(commands.Allocate("o1", "NONEXISTENT", 1))
+    except Exception:
+        pass
+
+    assert metrics.MESSAGE_ERRORS.value("command", "Allocate") == before + 1
+    assert metrics.HANDLER_ERRORS.value("allocate") >= 1
+
+
+def test_retries_are_counted_per_handler():
+    attempts = []
+
+    def flaky_handler(event):
+        attempts.append(event)
+        if len(attempts) < 3:
+            raise ConnectionError
+
+    before = metrics.HANDLER_RETRIES.value("flaky_handler")
+    policy = messagebus.RetryPolicy(
+        retryable=(ConnectionError,), attempts=3, wait=wait_none())
+    messagebus.MessageBus(
+        uow=FakeUnitOfWork(),
+        event_handlers={events.OutOfStock: [policy.wrap(flaky_handler)]},
+        command_handlers={},
+    ).handle(events.OutOfStock("LAMP"))
+
+    assert metrics.HANDLER_RETRIES.value("flaky_handler") == before + 2
@@ -1,7 +1,12 @@
+import random
+from dataclasses import asdict
 from datetime import date, timedelta
 
+import pytest
+
 from allocation.domain import events
-from allocation.domain.model import OrderLine, Batch, Product
+from allocation.domain.model import OrderLine, Batch, Product, \
+    deallocate_fewest_lines, deallocate_least_quantity, deallocation_strategy
 
 today = date.today()
 tomorrow = today + timedelta(days=1)
@@ -68,3 +73,213 @@ def test_increments_version_number():
     product.version_number = 7
     product.allocate(line)
     assert product.version_number == 8
+
+
+def test_every_change_to_the_batches_increments_version_number():
+    product = Product(sku="SCANDI-PEN", batches=[])
+
+    product.add_batch(Batch("b1", "SCANDI-PEN", 100, eta=None))
+    assert product.version_number == 1
+
+    product.change_batch_quantity("b1", 50)
+    assert product.version_number == 2
+
+
+def test_add_batch_keeps_allocation_order():
+    later_batch = Batch("later", "RETRO-CLOCK", 100, eta=later)
+    product = Product(sku="RETRO-CLOCK", batches=[later_batch])
+    product.allocate(OrderLine("order1", "RETRO-CLOCK", 10))
+
+    in_stock_batch = Batch("in-stock", "RETRO-CLOCK", 100, eta=None)
+    product.add_batch(in_stock_batch)
+
+    assert product.allocate(OrderLine("order2", "RETRO-CLOCK", 10)) == "in-stock"
+    assert product.batches == [later_batch, in_stock_batch]
+
+
+def test_batches_reopen_when_their_quantity_is_raised():
+    earliest = Batch("earliest", "RETRO-CLOCK", 10, eta=today)
+    latest = Batch("latest", "RETRO-CLOCK", 100, eta=later)
+    product = Product(sku="RETRO-CLOCK", batches=[earliest, latest])
+    product.allocate(OrderLine("order1", "RETRO-CLOCK", 10))
+    assert product.allocate(OrderLine("order2", "RETRO-CLOCK", 10)) == "latest"
+
+    product.change_batch_quantity("earliest", 30)
+
+    assert product.allocate(OrderLine("order3", "RETRO-CLOCK", 10)) == "earliest"
+
+
+def test_allocation_order_matches_sorting_the_batches():
+    rng = random.Random(42)
+    etas = [None, today, tomorrow, later]
+    batches = [
+        Batch(f"batch{i}", "RETRO-CLOCK", rng.randint(0, 20),
+              eta=rng.choice(etas))
+        for i in range(30)
+    ]
+    product = Product(sku="RETRO-CLOCK", batches=batches)
+
+    for i in range(100):
+        line = OrderLine(f"order{i}", "RETRO-CLOCK", rng.randint(1, 8))
+        expected = next(
+            (b.reference for b in sorted(batches) if b.can_allocate(line)),
+            None)
+        assert product.allocate(line) == expected
+
+
+def test_allocate_many_emits_the_same_events_as_allocate():
+    def make_product():
+        return Product(
+            sku="SCANDI-PEN", batches=[Batch("b1", "SCANDI-PEN", 15, eta=None)]
+        )
+
+    lines = [OrderLine(f"o{i}", "SCANDI-PEN", 5) for i in range(4)]
+    one_by_one, in_bulk = make_product(), make_product()
+    for line in lines:
+        one_by_one.allocate(line)
+
+    assert in_bulk.allocate_many(lines) == ["b1", "b1", "b1", None]
+    assert in_bulk.events == one_by_one.events
+    assert in_bulk.version_number == 1
+
+
+def test_events_are_slotted_value_objects():
+    event = events.Allocated("order1", "SCANDI-PEN", 10, "b1")
+
+    assert not hasattr(event, "__dict__")
+    assert asdict(event) == dict(
+        order_id="order1", sku="SCANDI-PEN", quantity=10, batchref="b1")
+    assert event == events.Allocated(**asdict(event))
+
+
+def make_batch_with_lines(quantities):
+    batch = Batch("b1", "SCANDI-PEN", sum(quantities), eta=None)
+    for i, quantity in enumerate(quantities):
+        batch.allocate(OrderLine(f"o{i}", "SCANDI-PEN", quantity))
+    return batch
+
+
+def test_change_batch_quantity_evicts_fewest_lines_by_default():
+    batch = make_batch_with_lines([1, 1, 1, 1, 5])
+    product = Product(sku="SCANDI-PEN", batches=[batch])
+
+    product.change_batch_quantity("b1", 5)
+
+    assert product.events == [events.Deallocated("o4", "SCANDI-PEN", 5)]
+    assert batch.available_quantity == 1
+
+
+def test_least_quantity_strategy_evicts_the_smallest_covering_lines():
+    lines = make_batch_with_lines([2, 3, 4, 10])._allocations
+
+    evicted = deallocate_least_quantity(lines, 6)
+
+    assert sorted(line.quantity for line in evicted) == [2, 4]
+    assert [l.quantity for l in deallocate_fewest_lines(lines, 6)] == [10]
+
+
+def test_change_batch_quantity_uses_the_given_strategy():
+    batch = make_batch_with_lines([2, 3, 4, 10])
+    product = Product(sku="SCANDI-PEN", batches=[batch])
+
+    product.change_batch_quantity(
+        "b1", 13, deallocation_strategy=deallocate_least_quantity)
+
+    assert {e.quantity for e in product.events} == {2, 4}
+    assert batch.available_quantity == 0
+
+
+def test_unknown_deallocation_strategy_lists_the_valid_names():
+    assert deallocation_strategy("least_quantity") is deallocate_least_quantity
+    with pytest.raises(ValueError, match="any, fewest_lines, least_quantity"):
+        deallocation_strategy("largest")
+
+
+def random_product(rng, batch_count):
+    etas = [None, today, tomorrow, later]
+    batches = [
+        Batch(f"batch{i}", "RETRO-CLOCK", rng.randint(0, 20),
+              eta=rng.choice(etas))
+        for i in range(batch_count)
+    ]
+    return Product(sku="RETRO-CLOCK", batches=batches)
+
+
+def test_numpy_engine_matches_sorting_the_batches(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(Product, "numpy_engine_threshold", 1)
+    rng = random.Random(7)
+    product = random_product(rng, 40)
+    batches = list(product.batches)
+
+    for i in range(100):
+        line = OrderLine(f"order{i}", "RETRO-CLOCK", rng.randint(0, 8))
+        expected = next(
+            (b.reference for b in sorted(batches) if b.can_allocate(line)),
+            None)
+        assert product.allocate(line) == expected
+        if i % 10 == 0:
+            product.change_batch_quantity(
+                rng.choice(batches).reference, rng.randint(0, 20))
+
+
+@pytest.mark.parametrize("threshold", [1, 1000])
+def test_allocate_many_plans_like_allocating_one_by_one(monkeypatch, threshold):
+    if threshold == 1:
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(Product, "numpy_engine_threshold", threshold)
+    rng = random.Random(11)
+    one_by_one = random_product(random.Random(3), 25)
+    in_bulk = random_product(random.Random(3), 25)
+    lines = [
+        OrderLine(f"order{rng.randint(0, 60)}", "RETRO-CLOCK", rng.randint(1, 8))
+        for _ in range(80)
+    ]
+
+    expected = [one_by_one.allocate(line) for line in lines]
+
+    assert in_bulk.allocate_many(lines) == expected
+    assert in_bulk.events == one_by_one.events
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_allocate_many_with_repeated_lines_matches_repeated_allocate(seed):
+    rng = random.Random(seed)
+    one_by_one = random_product(random.Random(seed), 4)
+    in_bulk = random_product(random.Random(seed), 4)
+    lines = [
+        OrderLine(f"order{rng.randint(0, 3)}", "RETRO-CLOCK",
+                  rng.randint(1, 30))
+        for _ in range(6)
+    ]
+
+    expected = [one_by_one.allocate(line) for line in lines]
+
+    assert in_bulk.allocate_many(lines) == expected
+    assert in_bulk.events == one_by_one.events
+
+
+def test_allocating_the_same_line_again_returns_the_existing_batch():
+    early = Batch("early", "SCANDI-PEN", 10, eta=None)
+    product = Product(sku="SCANDI-PEN", batches=[early])
+    product.allocate(OrderLine("o1", "SCANDI-PEN", 10))
+    product.add_batch(Batch("late", "SCANDI-PEN", 10, eta=tomorrow))
+    events_before, version_before = list(product.events), product.version_number
+
+    assert product.allocate(OrderLine("o1", "SCANDI-PEN", 10)) == "early"
+    assert product.allocate_many([OrderLine("o1", "SCANDI-PEN", 10)]) == ["early"]
+    assert product.events == events_before
+    assert product.version_number == version_before
+
+
+def test_evicted_lines_can_be_allocated_again():
+    product = Product(
+        sku="SCANDI-PEN",
+        batches=[Batch("b1", "SCANDI-PEN", 10, eta=None),
+                 Batch("b2", "SCANDI-PEN", 10, eta=tomorrow)])
+    line = OrderLine("o1", "SCANDI-PEN", 10)
+    product.allocate(line)
+
+    product.change_batch_quantity("b1", 5)
+
+    assert product.allocate(line) == "b2"
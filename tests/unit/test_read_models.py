@@ -0,0 +1,75 @@
+from allocation.adapters import read_models
+from allocation.domain import events
+from ..fakes import FakeRedis, FakeUnitOfWork
+
+
+def test_keeps_one_hash_per_order():
+    redis = FakeRedis()
+    read_model = read_models.RedisReadModel(redis)
+
+    read_model.add(FakeUnitOfWork(), [
+        events.Allocated("o1", "LAMP", 10, "b1"),
+        events.Allocated("o1", "CHAIR", 10, "b2"),
+        events.Allocated("o2", "LAMP", 10, "b1"),
+    ])
+
+    assert redis.hashes == {
+        "allocations:o1": {"LAMP": "b1", "CHAIR": "b2"},
+        "allocations:o2": {"LAMP": "b1"},
+    }
+    assert redis.round_trips == 1
+
+
+def test_reads_an_order_in_one_round_trip():
+    redis = FakeRedis()
+    read_model = read_models.RedisReadModel(redis)
+    read_model.add(FakeUnitOfWork(), [
+        events.Allocated("o1", "LAMP", 10, "b1"),
+        events.Allocated("o1", "CHAIR", 10, "b2"),
+    ])
+    redis.round_trips = 0
+
+    assert read_model.allocations(FakeUnitOfWork(), "o1") == [
+        {"sku": "CHAIR", "batchref": "b2"},
+        {"sku": "LAMP", "batchref": "b1"},
+    ]
+    assert redis.round_trips == 1
+
+
+def test_removes_deallocated_skus():
+    redis = FakeRedis()
+    read_model = read_models.RedisReadModel(redis)
+    read_model.add(FakeUnitOfWork(), [
+        events.Allocated("o1", "LAMP", 10, "b1"),
+        events.Allocated("o1", "CHAIR", 10, "b2"),
+    ])
+
+    read_model.remove(FakeUnitOfWork(), [
+        events.Deallocated("o1", "LAMP", 10),
+    ])
+    assert read_model.allocations(FakeUnitOfWork(), "o1") == [
+        {"sku": "CHAIR", "batchref": "b2"},
+    ]
+
+    read_model.remove(FakeUnitOfWork(), [
+        events.Deallocated("o1", "CHAIR", 10),
+    ])
+    assert redis.hashes == {}
+    assert read_model.allocations(FakeUnitOfWork(), "o1") == []
+
+
+def test_looks_up_many_orders_in_one_round_trip_per_chunk():
+    redis = FakeRedis()
+    read_model = read_models.RedisReadModel(redis)
+    read_model.add(FakeUnitOfWork(), [
+        events.Allocated(f"o{i}", "LAMP", 10, "b1") for i in range(5)
+    ])
+    redis.round_trips = 0
+
+    found = read_model.allocations_many(
+        FakeUnitOfWork(), ["o0", "o1", "o2", "o3", "o4", "unknown"],
+        chunk_size=4)
+
+    assert found["o3"] == [{"sku": "LAMP", "batchref": "b1"}]
+    assert found["unknown"] == []
+    assert redis.round_trips == 2
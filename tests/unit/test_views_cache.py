@@ -0,0 +1,201 @@
+import json
+import threading
+import time
+
+import pytest
+
+from allocation import metrics
+from allocation.adapters import view_invalidations
+from allocation.views import AllocationsCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    def __init__(self, result=()):
+        self.result = list(result)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+def test_serves_hits_until_the_ttl_expires():
+    clock = FakeClock()
+    cache = AllocationsCache(ttl=5, clock=clock)
+    load = Loader([{"sku": "LAMP", "batchref": "b1"}])
+
+    assert cache.get_or_load("o1", load) == load.result
+    clock.now = 4.9
+    assert cache.get_or_load("o1", load) == load.result
+    assert load.calls == 1
+
+    clock.now = 5
+    cache.get_or_load("o1", load)
+    assert load.calls == 2
+
+
+def test_expired_lookup_counts_once_in_the_hit_ratio(monkeypatch):
+    monkeypatch.setattr(metrics, "VIEW_CACHE", metrics.Counter(
+        "view_cache", "", ["result"]))
+    clock = FakeClock()
+    cache = AllocationsCache(ttl=5, clock=clock)
+    load = Loader()
+
+    cache.get_or_load("o1", load)
+    clock.now = 1
+    cache.get_or_load("o1", load)
+    clock.now = 6
+    cache.get_or_load("o1", load)
+
+    assert metrics.VIEW_CACHE.value("hits") == 1
+    assert metrics.VIEW_CACHE.value("misses") == 2
+    assert metrics.VIEW_CACHE.value("expired") == 1
+    assert metrics.VIEW_CACHE_HIT_RATIO.collect() == {(): 1 / 3}
+
+
+def test_evicts_the_least_recently_used_order():
+    cache = AllocationsCache(maxsize=2)
+    for order_id in ["o1", "o2", "o1", "o3"]:
+        cache.get_or_load(order_id, Loader())
+
+    load = Loader()
+    cache.get_or_load("o1", load)
+    cache.get_or_load("o3", load)
+    assert load.calls == 0
+
+    cache.get_or_load("o2", load)
+    assert load.calls == 1
+    assert len(cache) == 2
+
+
+def test_invalidation_forces_a_reload():
+    cache = AllocationsCache()
+    load = Loader()
+    cache.get_or_load("o1", load)
+
+    cache.invalidate("o1")
+    cache.get_or_load("o1", load)
+
+    assert load.calls == 2
+
+
+def test_concurrent_misses_share_one_load():
+    cache = AllocationsCache()
+    started, release = threading.Event(), threading.Event()
+    load = Loader([{"sku": "LAMP", "batchref": "b1"}])
+
+    def slow_load():
+        started.set()
+        release.wait(timeout=5)
+        return load()
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get_or_load("o1", slow_load)))
+        for _ in range(8)
+    ]
+    threads[0].start()
+    started.wait(timeout=5)
+    coalesced = metrics.VIEW_CACHE.value("coalesced")
+    for thread in threads[1:]:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while metrics.VIEW_CACHE.value("coalesced") - coalesced < 7 \
+            and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert results == [load.result] * 8
+    assert load.calls == 1
+
+
+def test_bulk_lookup_loads_only_the_misses_in_one_call():
+    cache = AllocationsCache()
+    cache.get_or_load("o1", Loader([{"sku": "LAMP", "batchref": "b1"}]))
+    calls = []
+
+    def load_many(order_ids):
+        calls.append(order_ids)
+        return {"o2": [{"sku": "LAMP", "batchref": "b2"}]}
+
+    assert cache.get_many_or_load(["o2", "o1", "o3", "o2"], load_many) == {
+        "o2": [{"sku": "LAMP", "batchref": "b2"}],
+        "o1": [{"sku": "LAMP", "batchref": "b1"}],
+        "o3": [],
+    }
+    assert calls == [["o2", "o3"]]
+
+    cache.get_many_or_load(["o1", "o2", "o3"], load_many)
+    assert len(calls) == 1
+
+
+def test_load_invalidated_while_in_flight_is_not_cached():
+    cache = AllocationsCache()
+
+    def load():
+        cache.invalidate("o1")
+        return []
+
+    cache.get_or_load("o1", load)
+
+    assert len(cache) == 0
+
+
+def test_failed_load_is_raised_and_not_cached():
+    cache = AllocationsCache()
+
+    def load():
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        cache.get_or_load("o1", load)
+    assert len(cache) == 0
+    assert cache._flights == {}
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+
+    def subscribe(self, channel):
+        self.channels.append(channel)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0):
+        return self.messages.pop(0) if self.messages else None
+
+
+def test_listener_invalidates_orders_published_by_other_processes():
+    cache = AllocationsCache()
+    for order_id in ["o1", "o2", "o3"]:
+        cache.get_or_load(order_id, Loader())
+    pubsub = FakePubSub([
+        {"type": "message", "data": json.dumps({"order_id": "o1"})},
+    ])
+    cache.clear = lambda: None
+
+    view_invalidations.listen(
+        cache, pubsub, should_stop=lambda: not pubsub.messages)
+
+    assert pubsub.channels == [view_invalidations.CHANNEL]
+    assert sorted(cache._entries) == ["o2", "o3"]
+
+
+def test_listener_drops_everything_cached_before_it_subscribed():
+    cache = AllocationsCache()
+    cache.get_or_load("o1", Loader())
+
+    view_invalidations.listen(cache, FakePubSub([]), should_stop=lambda: True)
+
+    assert len(cache) == 0